@@ -6,20 +6,67 @@ Created on Thu Aug 15 08:50:09 2019
 @warning reading a writing of integer keys using JSON is INVALID and WILL NOT WORK  
 @author: aweiss
 """
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import os
 import json
 import numpy as np
-from functools import reduce
+from functools import reduce,partial,wraps
 import operator
-import textwrap
+from textwrap import dedent
+import inspect
+import marshal
+import sys
+import base64
+import re
+import mmap
+import weakref
+import hashlib
+import threading
+import time
+import io
+import itertools
+import struct
+import shutil
+import copy
+import gzip
+import bz2
+import lzma
+from contextlib import contextmanager
+from collections.abc import ItemsView,ValuesView,Mapping
+
+try: #optional faster json backend
+    import orjson
+except ImportError:
+    orjson = None
+
+_MISSING = object() # sentinel for missing values
 
 class WDict(OrderedDict):
     '''
     @brief this is a class to inherit from that slightly extends orderedDict
         This will provide read/write from json file capabilities along with
         some other small capabilities not provided by orderedict  
+    @note resolved key paths (and aliases) are cached when every dictionary along
+        the path is a WDict. Setting or deleting a key in any of those dictionaries
+        invalidates only the paths that went through that key. Changes made directly
+        to the alias dictionary or to non-WDict containers are not tracked.  
+    @note once a dictionary is written with skip_unchanged, journaled, or queried with an index,
+        changes are also tracked up through parent WDicts so unchanged dictionaries can be skipped.
+        Until then nothing links WDicts to their parents so building and loading stays fast  
     '''
+    _cache_paths = True # whether resolved key paths through this dict can be cached
+    _epoch = 0 # incremented on every write. Dictionaries are touched with the current epoch when changed
+    _journal = None # _WDictJournal if this dictionary is journaled (see open_journal)
+    _journaled = False # whether this is (or was) in a journaled dictionary so changes look for journals above
+    _tracked = False # whether changes are passed up to parents (see _set_tracked)
+    # per instance values that are only set once they are used
+    _path_cache = None # {key_path tuple:value} for paths starting here
+    _path_deps = None # {key:{(id(cache),key_path):cache}} for cached paths through a key here
+    _parents = None # [(weakref to a WDict containing this one,our key in it)] when tracked
+    _touched = -1 # epoch this (or a tracked child) was last changed
+    _write_state = None # {abspath:(epoch,file size,file mtime,sha1)} of the last tracked writes
+    _query_index = None # {compiled query:(epoch,[(path,value),...])} of queries from here
+    
     def __init__(self,*args,**kwargs):
         '''
         @brief initialize the class. This will take the same arguments as dict()  
@@ -47,56 +94,261 @@ class WDict(OrderedDict):
         val = self.get(key,None) # make sure the value exists
         if val is None:
             raise KeyError("Alias must link to existing key ({} not a key)".format(key))
+        self._invalidate_paths(alias)
         self._alias_dict[alias] = key #add key to dictionary
+        self._touch()
+        if self._journaled:
+            self._journal_change('set',[self._alias_dict_key,alias],key)
         
-    def load(self,fpath,**kwargs):
+    def load(self,fpath,mmap_mode='c',backend='json',dict_type=None,replay_journal=True,**kwargs):
         '''
         @brief load dictionary data from a json file  
         @param[in] fpath - path to file to load  
+        @param[in/OPT] mmap_mode - mode to memory map any *.npy sidecar arrays with (see np.load).
+            Defaults to 'c' (copy on write). None will read the arrays fully into memory  
+        @param[in/OPT] backend - json library to use (see wjson_loads)  
+        @param[in/OPT] dict_type - type to decode nested dictionaries to (default WDict).
+            dict is much faster and smaller for large trees  
+        @param[in/OPT] replay_journal - apply any changes in the journal of fpath (see open_journal)  
         @param[in/OPT] kwargs - keyword args will be passed to json.load()  
         '''
         my_kwargs = {}
-        my_kwargs['object_hook'] = WJSONDecoder
+        my_kwargs['object_hook'] = partial(WJSONDecoder,
+                                           sidecar_root=os.path.dirname(os.path.abspath(fpath)),
+                                           mmap_mode=mmap_mode,dict_type=dict_type,shared_arrays={})
+        for k,v in kwargs.items():
+            my_kwargs[k] = v
+        if not os.path.exists(fpath):
+            raise FileNotFoundError("File '{}' not found".format(os.path.abspath(fpath)))
+        with open_json_file(fpath) as jsonFile: #decompress by extension (see COMPRESSION_TYPES)
+            self.update(wjson_loads(jsonFile.read(),backend=backend,**my_kwargs))
+        if replay_journal and os.path.exists(get_journal_path(fpath)):
+            self.replay_journal(fpath,**my_kwargs)
+        if self._alias_dict is None and self._alias_dict_key in self: #restore our aliases
+            self._alias_dict = dict.__getitem__(self,self._alias_dict_key)
+            
+    def open_journal(self,fpath,max_records=None,**kwargs):
+        '''
+        @brief start journaling changes to fpath. The dictionary is first written to fpath.
+            After that every change (including nested WDicts and set_from_path) is appended
+            to '<fpath>.journal' as a small record instead of rewriting the whole file.
+            The journal is compacted into fpath on write(fpath) and replayed by load(fpath)  
+        @param[in] fpath - path of the json file to journal changes for  
+        @param[in/OPT] max_records - compact (write) automatically after this many records  
+        @param[in/OPT] kwargs - keyword args passed to write() when compacting. base64_arrays
+            is also used for the journal records  
+        @note in place changes to values (e.g. arrays or plain dicts) and ordering are not
+            journaled. They are only saved by the next write  
+        '''
+        self.close_journal()
+        self._set_tracked() # changes are found through the parent links
+        self.write(fpath,**kwargs)
+        self._journal = journal = _WDictJournal(self,os.path.abspath(fpath),max_records,kwargs)
+        weakref.finalize(self,journal.close)
+        self._set_journaled()
+        
+    def close_journal(self):
+        '''@brief stop journaling changes (see open_journal). The journal is kept until the next write'''
+        journal = self._journal
+        self._journal = None
+        if journal is not None:
+            journal.close()
+            
+    def _set_journaled(self):
+        '''@brief mark this and the WDicts in it as in a journaled dictionary (so their changes are journaled)'''
+        self._journaled = True
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            for v in dict.values(node):
+                if isinstance(v,WDict) and not v._journaled:
+                    v._journaled = True
+                    nodes.append(v)
+                    
+    def _set_tracked(self):
+        '''@brief start passing changes in this dictionary and the WDicts in it up to their parents'''
+        self._tracked = True
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            for k,v in dict.items(node):
+                if isinstance(v,WDict):
+                    v._add_parent(node,k)
+                    if not v._tracked:
+                        v._tracked = True
+                        nodes.append(v)
+        
+    def replay_journal(self,fpath,**kwargs):
+        '''
+        @brief apply the changes in the journal of fpath to this dictionary  
+        @param[in] fpath - path of the json file (not the journal)  
+        @param[in/OPT] kwargs - keyword args passed to json.loads() for each record  
+        @note a partially written last record (e.g. from a crash) is ignored  
+        '''
+        my_kwargs = {'object_hook':WJSONDecoder}
+        my_kwargs.update(kwargs)
+        journal = self._journal #dont journal the replay
+        self._journal = None
+        try:
+            with open(get_journal_path(fpath),'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line,**my_kwargs)
+                    except ValueError: #incomplete record
+                        break
+                    path = record['path']
+                    if record['op']=='set':
+                        self.set_from_path(path,record['value'])
+                        continue
+                    try:
+                        parent = self.get_from_path(path[:-1]) if record['op']=='del' else self.get_from_path(path)
+                        if record['op']=='del':
+                            del parent[path[-1]]
+                        else:
+                            parent.clear()
+                    except (KeyError,IndexError,TypeError): #already gone
+                        pass
+        finally:
+            self._journal = journal
+                
+    def _journal_change(self,op,key_path,value=None):
+        '''@brief append a change to the journals of this dictionary and any journaled parents'''
+        nodes = [(self,list(key_path),frozenset())]
+        while nodes:
+            node,path,chain = nodes.pop()
+            if id(node) in chain: # contains itself
+                continue
+            chain = chain|{id(node)}
+            if node._journal is not None:
+                node._journal.append(op,path,value)
+            for parent,k in node._get_parent_links(): # each place we are in
+                nodes.append((parent,[k]+path,chain))
+            
+    def load_paths(self,fpath,key_paths,mmap_mode='c',**kwargs):
+        '''
+        @brief load only select values from a json file. The file is memory mapped and
+            scanned without decoding so only the requested values are ever decoded  
+        @param[in] fpath - path to file to load  
+        @param[in] key_paths - list of keys or key lists to load (e.g. ['a',['b','c']]). Integers
+            index into json lists (e.g. ['runs',0,'name'])  
+        @param[in/OPT] mmap_mode - mode to memory map any *.npy sidecar arrays with (see np.load)  
+        @param[in/OPT] kwargs - keyword args will be passed to json.loads()  
+        @note aliases (__aliases__) in the file are followed like in __getitem__ and the
+            value is stored at the key path the alias points to  
+        @note list elements are stored in a dictionary keyed by their index since only the 
+            requested elements are loaded  
+        @return self (with only the requested paths filled in)  
+        '''
+        my_kwargs = {}
+        my_kwargs['object_hook'] = partial(WJSONDecoder,
+                                           sidecar_root=os.path.dirname(os.path.abspath(fpath)),
+                                           mmap_mode=mmap_mode,shared_arrays={})
         for k,v in kwargs.items():
             my_kwargs[k] = v
         if not os.path.exists(fpath):
             raise FileNotFoundError("File '{}' not found".format(os.path.abspath(fpath)))
-        with open(fpath,'r') as jsonFile:
-            self.update(json.load(jsonFile,**my_kwargs))
+        _check_uncompressed(fpath)
+        with open(fpath,'rb') as json_file:
+            with mmap.mmap(json_file.fileno(),0,access=mmap.ACCESS_READ) as buf:
+                indices = {} # indices of objects we have already scanned {(start,end):index}
+                for key_path in key_paths:
+                    (start,end),real_path = _find_json_path(buf,key_path,indices=indices)
+                    value = json.loads(buf[start:end],**my_kwargs)
+                    if len(real_path)>1:
+                        self.set_from_path(real_path,value)
+                    else:
+                        self[real_path[0]] = value
+        return self
             
-    def loads(self,mystr,**kwargs):
+    def loads(self,mystr,backend='json',dict_type=None,**kwargs):
         '''
         @brief load dictionary data from a string
         @param[in] mystr - string to load from
+        @param[in/OPT] backend - json library to use (see wjson_loads)  
+        @param[in/OPT] dict_type - type to decode nested dictionaries to (default WDict)  
         @param[in/OPT] kwargs - keyword args will be passed to json.loads() 
         '''
         my_kwargs = {}
-        my_kwargs['object_hook'] = WJSONDecoder
+        my_kwargs['object_hook'] = partial(WJSONDecoder,dict_type=dict_type,shared_arrays={})
         for k,v in kwargs.items():
             my_kwargs[k] = v
-        self.update(json.loads(mystr,**my_kwargs))
+        self.update(wjson_loads(mystr,backend=backend,**my_kwargs))
             
-    def write(self,fpath,**kwargs):
+    def write(self,fpath,sidecar_threshold=None,backend='json',skip_unchanged=False,**kwargs):
         '''
-        @brief write out dictionary data to a json file  
+        @brief write out dictionary data to a json file. The file is written to a
+            temporary file first and then renamed so it is never left partially written  
         @param[in] fpath - path to write to   
-        @param[in/OPT] kwargs - keyword args will be passed to json.dump()  
+        @param[in/OPT] sidecar_threshold - if not None, ndarrays with at least this many
+            bytes are written to *.npy files in a '<fpath name>_arrays' directory next to fpath.
+            The json file then only holds a reference to the file. Sidecar files from earlier
+            writes that are no longer referenced are removed after the write (see remove_unused_sidecars)  
+        @param[in/OPT] backend - json library to use (see wjson_dumps)  
+        @note files ending in .gz, .bz2, .xz, or .lzma are compressed (see COMPRESSION_TYPES)  
+        @param[in/OPT] skip_unchanged - False to always write. True to skip writing if no
+            (tracked) changes were made since the last write to fpath and the file wasnt changed.
+            'hash' to serialize and skip the disk write if the content is the same  
+        @param[in/OPT] kwargs - keyword args will be passed to json.dump() and WJSONEncoder
+            (e.g. dedup_arrays=True to only write equal ndarrays once and share them on load)  
+        @note only changes to WDicts (including set_from_path) are tracked. Use
+            skip_unchanged='hash' if values are changed in place (e.g. arrays or plain dicts)  
+        @note tracking starts with the first skip_unchanged write (which is never skipped)  
         @return path that was written to   
         '''
+        if skip_unchanged and not self._tracked:
+            self._set_tracked()
+        abs_path = os.path.abspath(fpath)
+        last_write = (self._write_state or {}).get(abs_path)
+        if skip_unchanged is True and last_write is not None:
+            if last_write[0]>=self._touched and last_write[1:3]==_file_stat(abs_path):
+                return fpath
         my_kwargs = {}
         my_kwargs['indent'] = 4
         my_kwargs['cls'] = WJSONEncoder
+        sidecar_files = None
+        if sidecar_threshold is not None:
+            sidecar_dir = get_sidecar_dir(fpath)
+            os.makedirs(sidecar_dir,exist_ok=True)
+            sidecar_files = set()
+            my_kwargs['sidecar_dir'] = sidecar_dir
+            my_kwargs['sidecar_threshold'] = sidecar_threshold
+            my_kwargs['sidecar_files'] = sidecar_files
         for k,v in kwargs.items():
             my_kwargs[k] = v
-        with open(fpath,'w+') as json_file:
-            json.dump(self,json_file,**my_kwargs) 
+        epoch = WDict._epoch
+        WDict._epoch += 1 # any change from here on is after this write
+        digest = None
+        if skip_unchanged=='hash':
+            data = wjson_dumps(self,backend=backend,**my_kwargs).encode()
+            digest = hashlib.sha1(data).hexdigest()
+            if last_write is not None and last_write[1:3]==_file_stat(abs_path):
+                last_digest = last_write[3]
+            else:
+                last_digest = _file_sha1(abs_path)
+            if digest!=last_digest:
+                with atomic_json_writer(fpath) as json_file:
+                    json_file.write(data)
+        else:
+            wjson_dump(self,fpath,backend=backend,**my_kwargs)
+        if sidecar_files is not None: #only once the new file is in place
+            remove_unused_sidecars(sidecar_dir,sidecar_files)
+        if self._tracked: # otherwise _touched doesnt include nested changes
+            if self._write_state is None:
+                self._write_state = {}
+            self._write_state[abs_path] = (epoch,)+_file_stat(abs_path)+(digest,)
+        journal = self._journal
+        if journal is not None and journal.fpath==abs_path: #everything is in the file now
+            journal.truncate()
+        elif abs_path not in _open_journals and os.path.exists(get_journal_path(abs_path)):
+            os.remove(get_journal_path(abs_path)) #left over so it would be replayed onto this file
         return fpath
     
     dump=write #alias to match json names
     
-    def writes(self,**kwargs):
+    def writes(self,backend='json',**kwargs):
         '''
         @brief dump a dictionary to a json string  
+        @param[in/OPT] backend - json library to use (see wjson_dumps)  
         @param[in/OPT] kwargs - keyword args passed to json.dump  
         @return string of json  
         '''
@@ -105,43 +357,80 @@ class WDict(OrderedDict):
         my_kwargs['cls'] = WJSONEncoder
         for k,v in kwargs.items():
             my_kwargs[k] = v
-        mystr = json.dumps(self,**my_kwargs)
+        mystr = wjson_dumps(self,backend=backend,**my_kwargs)
         return mystr
     
     dumps=writes #alias to match json names
     
-    def get_rst_str(self,alt_names={},parse_functs={},rst_format_str='- **{0}** - {1}'):
+    def get_rst_str(self,alt_names={},parse_functs={},rst_format_str='- **{0}** - {1}',indent=None):
         '''
         @brief Get a nicely formatted ReStructuredText string (for sphinx)
         @param[in/OPT] alt_names - Dictionary with mapping of alternative names for the keys ({key:alt_name,...})
         @param[in/OPT] parse_functs - Dictionary to parse data. Keys should be types and values should be functions (e.g., {str:parse_string})
         @param[in/OPT] rst_format_str - format string for each line. This defaults to '**{0}** - {1}'. Requires 2 inputs to format (name,val).
+        @param[in/OPT] indent - indentation of nested dictionaries (see iter_rst_lines)
         @return String formatted for rst usage
+        @note use iter_rst_lines or write_rst for very large dictionaries
+        '''
+        return '\n'.join(self.iter_rst_lines(alt_names,parse_functs,rst_format_str,indent))
+    
+    def iter_rst_lines(self,alt_names={},parse_functs={},rst_format_str='- **{0}** - {1}',indent=None):
+        '''
+        @brief Generate the lines of get_rst_str one at a time so memory stays flat for large dictionaries
+        @param[in/OPT] alt_names - Dictionary with mapping of alternative names for the keys ({key:alt_name,...})
+        @param[in/OPT] parse_functs - Dictionary to parse data. Keys should be types and values should be functions (e.g., {str:parse_string})
+        @param[in/OPT] rst_format_str - format string for each line. Requires 2 inputs to format (name,val).
+        @param[in/OPT] indent - string to indent nested WDicts by for each level. Defaults to
+            the width of the list marker in rst_format_str (e.g. 2 spaces for '- ') so they are nested lists
+        @return generator of lines (without newlines). Items are separated by blank lines
         '''
-        #default parsing function
-        def default_parse(val):
-            if isinstance(val,type(self)): #if its also a dict, prettyprint
-                formatted_val = val.get_rst_str(alt_names,parse_functs,rst_format_str)
-                textwrap.indent(formatted_val, '   ')
+        if indent is None:
+            marker = re.match(r'\s*[-*+]\s+',rst_format_str)
+            indent = ' '*(marker.end() if marker is not None else 3)
+        stack = [iter(self.items())] # iterators of the dictionaries we are in
+        first = True
+        while stack:
+            item = next(stack[-1],_MISSING)
+            if item is _MISSING: # done with this dictionary
+                stack.pop()
+                continue
+            k,v = item
+            prefix = indent*(len(stack)-1)
+            if not first:
+                yield '' # blank lines between items
+            first = False
+            name_str = alt_names.get(k,k) #get alternative name otherwise use the key name
+            parse_fun = parse_functs.get(type(v),None)
+            if parse_fun is None and isinstance(v,WDict): # nested list
+                yield prefix+rst_format_str.format(name_str,'').rstrip()
+                stack.append(iter(v.items()))
+                continue
+            if parse_fun is None:
+                val_str = '{}'.format(v).replace('\n','') #remove any extraneous newlines
             else:
-                formatted_val = '{}'.format(val).replace('\n','') #remove any extraneous newlines
-            return formatted_val
-        
-        lines = []
-        for k,v in self.items(): #loop through each item
-            #get alternative name otherwise use the key name
-            name_str = alt_names.get(k,k) 
-            #now parse the value
-            parse_fun = parse_functs.get(type(v),default_parse)
-            val_str = parse_fun(v)
-            #now lets format
+                val_str = parse_fun(v)
             line = rst_format_str.format(name_str,val_str)
-            lines.append(line)
-        
-        #now combine our lines  
-        lines_str = ' \n\n'.join(lines)
-        return lines_str
-    
+            if '\n' in line: # keep everything in a parsed value at this level
+                for l in line.split('\n'):
+                    yield prefix+l if l else l
+            else:
+                yield prefix+line
+                
+    def write_rst(self,fpath,**kwargs):
+        '''
+        @brief stream the ReStructuredText from iter_rst_lines to a file
+        @param[in] fpath - path or open text file to write to
+        @param[in/OPT] kwargs - passed to iter_rst_lines (e.g. alt_names,parse_functs)
+        @return fpath
+        '''
+        if hasattr(fpath,'write'):
+            for line in self.iter_rst_lines(**kwargs):
+                fpath.write(line+'\n')
+            return fpath
+        with atomic_open(fpath,'w') as rst_file:
+            for line in self.iter_rst_lines(**kwargs):
+                rst_file.write(line+'\n')
+        return fpath
     
     def set_from_path(self,key_list,value,**kwargs):
         '''
@@ -159,14 +448,98 @@ class WDict(OrderedDict):
             cur_dict = next_dict
         #now we have made up to our last value and thats in cur_dict
         cur_dict[key_list[-1]] = value
+        self._touch() #nested dicts may not be tracked
+        if self._journaled and not isinstance(cur_dict,WDict): #WDicts journal themselves
+            self._journal_change('set',key_list,value)
             
     def get_from_path(self,key_list,**kwargs):
         '''
         @param[in] value - value to set at final value  
         @param[in] key_list - list of keys to traverse to set the dictionary value  
         @note solution from https://stackoverflow.com/questions/14692690/access-nested-dictionary-items-via-a-list-of-keys  
+        @note resolved paths are cached (see class notes)  
         ''' 
-        return reduce(operator.getitem,key_list,self)
+        if not self._cache_paths:
+            return reduce(operator.getitem,key_list,self)
+        key_path = tuple(key_list)
+        cache = self._path_cache
+        try:
+            if cache is None:
+                hash(key_path) #make sure it can be cached
+                val = _MISSING
+            else:
+                val = cache.get(key_path,_MISSING)
+        except TypeError: # unhashable keys cant be cached
+            return reduce(operator.getitem,key_list,self)
+        if val is not _MISSING:
+            return val
+        deps = []
+        val,tracked = _walk_path(self,key_list,deps)
+        if tracked: # everything along the path is tracked so we can cache
+            if self._path_cache is None:
+                self._path_cache = {}
+            cache = self._path_cache
+            cache[key_path] = val
+            for node,k in deps:
+                if node._path_deps is None:
+                    node._path_deps = {}
+                node._path_deps.setdefault(k,{})[(id(cache),key_path)] = cache
+        return val
+    
+    def query(self,query,use_index=True):
+        '''
+        @brief find all values matching a key path with wildcards  
+        @param[in] query - path string like 'runs/*/results/s21' or a list of path elements. Elements can be  
+            - a key (aliases are followed like in get_from_path)  
+            - '*' - any key at this level  
+            - '**' - any number of levels (including none)  
+            - function(key,value) - keys at this level where this returns True (list form only)  
+        @param[in/OPT] use_index - reuse the results of the last identical query if nothing changed since.
+            Only done for queries without functions through WDicts  
+        @note wildcards only go through dictionaries and skip __aliases__  
+        @return generator of (key path tuple,value)  
+        @example
+            for path,s21 in mywdict.query('runs/*/results/s21'): ...
+            mywdict.query(['runs',lambda k,v: v['params']['power']>0,'results','s21'])
+        '''
+        steps = compile_query(query)
+        if not (use_index and self._cache_paths) or any(kind=='pred' for kind,_ in steps):
+            return _iter_query(self,steps,[True])
+        index = self._query_index
+        entry = None if index is None else index.lookup(steps)
+        if entry is not None and entry[0]>=self._touched:
+            return iter(entry[1])
+        return self._index_query(steps)
+        
+    def _index_query(self,steps):
+        '''@brief run a query and store the results in the query index once its done'''
+        if not self._tracked: # nested changes must reach us to know the index is out of date
+            self._set_tracked()
+        epoch = WDict._epoch
+        WDict._epoch += 1 # any change from here on is after the query
+        tracked = [True]
+        results = []
+        for item in _iter_query(self,steps,tracked):
+            results.append(item)
+            yield item
+        if tracked[0]:
+            if self._query_index is None:
+                self._query_index = _LRUCache(64)
+            self._query_index.store(steps,(epoch,results))
+    
+    def _invalidate_paths(self,key):
+        '''@brief remove any cached paths that go through key in this dictionary'''
+        if self._path_deps is not None:
+            deps = self._path_deps.pop(key,None)
+            if deps is not None:
+                for (_,key_path),cache in deps.items():
+                    cache.pop(key_path,None)
+                    
+    def _invalidate_all_paths(self):
+        '''@brief remove any cached paths that go through this dictionary'''
+        if self._path_deps is not None:
+            for key in list(self._path_deps.keys()):
+                self._invalidate_paths(key)
     
     def get(self,key,default=None):
         '''
@@ -189,17 +562,15 @@ class WDict(OrderedDict):
         if type(item) is list or type(item) is tuple: #if its a list or tuple, get from path
             return self.get_from_path(item)
         else:
-            try: #first try to get the value from the dict
-                return super().__getitem__(item)
-            except KeyError as ke: #otherwise check our aliases
-                if self._alias_dict is not None:
-                    if item in self._alias_dict.keys(): #if its an alias try and get that
-                        new_item = self._alias_dict[item]
-                        return self.__getitem__(new_item) #try and get the new item
-                    else: #if it isnt a key just raise the error
-                        raise ke
-                else:
-                    raise ke #also raise the error if the alias dict doesnt exist
+            val = dict.get(self,item,_MISSING) #first try to get the value from the dict
+            if val is not _MISSING:
+                return val
+            #otherwise check our aliases
+            if self._alias_dict is None or item not in self._alias_dict: 
+                raise KeyError(item) #raise the error if it isnt an alias
+            if self._cache_paths: #get through the path cache
+                return self.get_from_path((item,))
+            return self.__getitem__(self._alias_dict[item]) #try and get the new item
       
     def __setitem__(self,*args,**kwargs):
         '''
@@ -210,91 +581,1280 @@ class WDict(OrderedDict):
         if type(item) is list or type(item) is tuple: #if its a list or tuple, get from path
             return self.set_from_path(item,value)
         else:
-            return super().__setitem__(*args,**kwargs)
+            self._invalidate_paths(item)
+            if self._touched!=WDict._epoch:
+                self._touch()
+            if self._tracked and isinstance(value,WDict):
+                value._add_parent(self,item)
+                if not value._tracked:
+                    value._set_tracked()
+                if self._journaled and not value._journaled:
+                    value._set_journaled()
+            rv = super().__setitem__(*args,**kwargs)
+            if self._journaled:
+                self._journal_change('set',[item],value)
+            return rv
+        
+    def __delitem__(self,key):
+        self._invalidate_paths(key)
+        self._touch()
+        rv = super().__delitem__(key)
+        if self._journaled:
+            self._journal_change('del',[key])
+        return rv
+    
+    def pop(self,key,*args):
+        if not dict.__contains__(self,key): # nothing is removed so nothing changes
+            return super().pop(key,*args)
+        self._invalidate_paths(key)
+        self._touch()
+        rv = super().pop(key)
+        if self._journaled:
+            self._journal_change('del',[key])
+        return rv
+    
+    def popitem(self,last=True):
+        item = super().popitem(last)
+        self._invalidate_paths(item[0])
+        self._touch()
+        if self._journaled:
+            self._journal_change('del',[item[0]])
+        return item
+    
+    def clear(self):
+        self._invalidate_all_paths()
+        self._touch()
+        rv = super().clear()
+        if self._journaled:
+            self._journal_change('clear',[])
+        return rv
+    
+    def move_to_end(self,key,last=True):
+        self._touch() #order is written out too
+        return super().move_to_end(key,last)
+    
+    def _add_parent(self,parent,key):
+        '''@brief keep a weak reference to a WDict containing this one (at key) to pass changes up to'''
+        link = (weakref.ref(parent),key)
+        if self._parents is None:
+            self._parents = [link]
+        else: #remove dead or moved ones
+            self._parents = [(r,k) for r,k in self._parents if r() is not None and 
+                             not (r() is parent and k==key) and dict.get(r(),k,None) is self]
+            self._parents.append(link)
+                
+    def _touch(self):
+        '''@brief mark this dictionary and its parents (if tracked) as changed in the current epoch'''
+        epoch = WDict._epoch
+        if not self._tracked:
+            self._touched = epoch
+            return
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node._touched==epoch: #already passed up
+                continue
+            node._touched = epoch
+            nodes += node._get_parents()
+                
+    def _get_parents(self):
+        '''@brief get the (still existing) WDicts containing this one'''
+        return [p for p,_ in self._get_parent_links()]
+    
+    def _get_parent_links(self):
+        '''@brief get [(parent,key)] of the WDicts this one is still in'''
+        if self._parents is None:
+            return []
+        return [(p,k) for p,k in ((r(),k) for r,k in self._parents) 
+                if p is not None and dict.get(p,k,None) is self]
+                
+    def is_modified(self,fpath):
+        '''
+        @brief check if there are (tracked) changes since the last write to fpath  
+        @param[in] fpath - path that was written to  
+        @note always True unless the last write was tracked (e.g. skip_unchanged)  
+        '''
+        last_write = (self._write_state or {}).get(os.path.abspath(fpath))
+        return last_write is None or last_write[0]<self._touched
+    
+    def __getstate__(self):
+        '''@brief dont pickle/copy the path caches or change tracking'''
+        state = self.__dict__.copy()
+        for k in ('_path_cache','_path_deps','_parents','_touched','_write_state','_query_index',
+                  '_journal','_journaled','_tracked'):
+            state.pop(k,None)
+        return state
+    
+    def __reduce__(self):
+        '''@brief pickle/copy with __getstate__ (OrderedDict.__reduce__ only uses it from python 3.11)'''
+        return (type(self),(),self.__getstate__() or None,None,iter(self.items()))
+
+_open_journals = weakref.WeakValueDictionary() # {absolute json path:_WDictJournal} of open journals
+
+def get_journal_path(fpath):
+    '''@brief get the path of the journal for a json file (see WDict.open_journal)'''
+    return fpath+'.journal'
+
+class _WDictJournal:
+    '''
+    @brief append only log of changes to a WDict with one json record per line like
+        {"op":"set","path":[k1,k2,...],"value":...}, {"op":"del","path":[...]},
+        or {"op":"clear","path":[...]}  
+    @param[in] root - dictionary being journaled  
+    @param[in] fpath - absolute path of the json file the journal belongs to  
+    @param[in/OPT] max_records - write root to fpath after this many records  
+    @param[in/OPT] write_kwargs - keyword args passed to root.write()  
+    '''
+    def __init__(self,root,fpath,max_records=None,write_kwargs={}):
+        self.root = weakref.ref(root)
+        self.fpath = fpath
+        self.max_records = max_records
+        self.write_kwargs = write_kwargs
+        self.json_kwargs = {'cls':WJSONEncoder,'base64_arrays':write_kwargs.get('base64_arrays',False)}
+        self.nrecords = 0
+        self._file = open(get_journal_path(fpath),'a')
+        _open_journals[fpath] = self
+        
+    def append(self,op,path,value=None):
+        '''@brief append a record and compact if we have too many'''
+        record = OrderedDict([('op',op),('path',path)])
+        if op=='set':
+            record['value'] = value
+        self._file.write(json.dumps(record,**self.json_kwargs)+'\n')
+        self._file.flush()
+        self.nrecords += 1
+        if self.max_records is not None and self.nrecords>=self.max_records:
+            root = self.root()
+            if root is not None:
+                root.write(self.fpath,**self.write_kwargs) #truncates the journal
+                
+    def truncate(self):
+        '''@brief remove all records (after they were written to fpath)'''
+        self._file.seek(0)
+        self._file.truncate()
+        self.nrecords = 0
         
-def update_nested_dict(dict_update,dict_to_add,overwrite_values=False,**kwargs):
+    def close(self):
+        if _open_journals.get(self.fpath) is self:
+            del _open_journals[self.fpath]
+        self._file.close()
+        
+class _LazyJSONValue:
+    '''
+    @brief placeholder for a value of a LazyWDict that has not been decoded yet 
+        (byte range in the file or in its own file fpath)
     '''
-    @brief take two nested dictionaries and merge them. 
-        items in dict1 take precedence. will be merged into dict 1  
+    __slots__ = ('start','end','fpath')
+    def __init__(self,start,end,fpath=None):
+        self.start = start
+        self.end = end
+        self.fpath = fpath
+    @property
+    def nbytes(self):
+        return self.end-self.start
+    def __repr__(self):
+        return '<undecoded json {}[{}:{}]>'.format(self.fpath or '',self.start,self.end)
+    
+class LazyWDict(WDict):
+    '''
+    @brief WDict that only indexes the byte ranges of the keys of a json file on load.
+        Values are decoded from the file when they are first accessed (e.g. __getitem__
+        or get_from_path) and then cached.  
+    @note when a max_cache_bytes is given, least recently used values are evicted and
+        reread from the file on the next access. In place changes to a value that
+        was retrieved (e.g. d['a']['b']=1) are lost on eviction. Values set through
+        __setitem__ or set_from_path are never evicted.  
+    '''
+    _cache_paths = False # values can be evicted so dont cache paths through this
+    
+    def __init__(self,*args,**kwargs):
+        self._lazy_fpath = None
+        self._lazy_depth = 1
+        self._lazy_kwargs = {}
+        self._max_cache_bytes = None
+        self._cache = OrderedDict() # evictable decoded values {key:placeholder} in LRU order
+        self._cache_bytes = 0
+        super().__init__(*args,**kwargs)
+        
+    def load(self,fpath,lazy_depth=1,max_cache_bytes=None,mmap_mode='c',**kwargs):
+        '''
+        @brief index the keys of a json file. Values are decoded on first access  
+        @param[in] fpath - path to file to load  
+        @param[in/OPT] lazy_depth - number of levels of nested dictionaries to index
+            instead of decoding (e.g. 2 will index the second level keys on first access)  
+        @param[in/OPT] max_cache_bytes - approximate maximum number of bytes (of json) to keep
+            decoded. None (default) will never evict  
+        @param[in/OPT] mmap_mode - mode to memory map any *.npy sidecar arrays with (see np.load)  
+        @param[in/OPT] kwargs - keyword args will be passed to json.loads() when decoding  
+        '''
+        if not os.path.exists(fpath):
+            raise FileNotFoundError("File '{}' not found".format(os.path.abspath(fpath)))
+        fpath = os.path.abspath(fpath)
+        my_kwargs = {}
+        # weak so shared arrays are freed with the values that use them when those are evicted
+        my_kwargs['object_hook'] = partial(WJSONDecoder,sidecar_root=os.path.dirname(fpath),
+                                           mmap_mode=mmap_mode,shared_arrays=weakref.WeakValueDictionary())
+        for k,v in kwargs.items():
+            my_kwargs[k] = v
+        self._init_lazy(fpath,None,None,lazy_depth,max_cache_bytes,my_kwargs)
+        
+    def _init_lazy(self,fpath,start,end,lazy_depth,max_cache_bytes,json_kwargs):
+        '''@brief index the object in fpath[start:end] and add placeholders for its values'''
+        self._lazy_fpath = fpath
+        self._lazy_depth = lazy_depth
+        self._max_cache_bytes = max_cache_bytes
+        self._lazy_kwargs = json_kwargs
+        for k,(vs,ve) in index_json_file(fpath,start,end).items():
+            OrderedDict.__setitem__(self,k,_LazyJSONValue(vs,ve))
+            
+    def _decode_item(self,key,lazy):
+        '''@brief decode the value for key from its placeholder and cache it'''
+        val = self._read_value(lazy)
+        OrderedDict.__setitem__(self,key,val)
+        self._cache_item(key,lazy)
+        return val
+    
+    def _read_value(self,lazy):
+        '''@brief read and decode the value for a placeholder'''
+        fpath = self._lazy_fpath if lazy.fpath is None else lazy.fpath
+        if self._lazy_depth>1:
+            index = index_json_file(fpath,lazy.start,lazy.end,allow_other=True)
+            if index is not None and not is_json_directive(next(iter(index),'')):
+                val = LazyWDict()
+                val._init_lazy(fpath,lazy.start,lazy.end,self._lazy_depth-1,None,self._lazy_kwargs)
+                return val
+        with open(fpath,'rb') as json_file:
+            json_file.seek(lazy.start)
+            return json.loads(json_file.read(lazy.nbytes),**self._lazy_kwargs)
+        
+    def _cache_item(self,key,lazy):
+        '''@brief track a decoded value and evict least recently used ones past max_cache_bytes'''
+        self._cache[key] = lazy
+        self._cache_bytes += lazy.nbytes
+        if self._max_cache_bytes is not None: # evict least recently used (never the current)
+            while self._cache_bytes>self._max_cache_bytes and len(self._cache)>1:
+                k,lz = self._cache.popitem(last=False)
+                self._cache_bytes -= lz.nbytes
+                self._evict_item(k,lz)
+                
+    def _evict_item(self,key,lazy):
+        '''@brief replace a decoded value with its placeholder'''
+        OrderedDict.__setitem__(self,key,lazy)
+    
+    def _pin(self,key):
+        '''@brief stop tracking a key in the cache so it is never evicted'''
+        lazy = self._cache.pop(key,None)
+        if lazy is not None:
+            self._cache_bytes -= lazy.nbytes
+            
+    def decode_all(self):
+        '''@brief decode all values and stop evicting them'''
+        for k in list(self.keys()):
+            self[k]
+        self._cache.clear()
+        self._cache_bytes = 0
+        
+    def is_decoded(self,key):
+        '''@brief check whether the value for a key has been decoded'''
+        return type(OrderedDict.__getitem__(self,key)) is not _LazyJSONValue
+    
+    def items(self):
+        return ItemsView(self)
+    
+    def values(self):
+        return ValuesView(self)
+    
+    def __getitem__(self,*args,**kwargs):
+        '''@brief get an item, decoding it from the file if it has not been yet'''
+        item = args[0]
+        if type(item) is list or type(item) is tuple: #if its a list or tuple, get from path
+            return self.get_from_path(item)
+        val = super().__getitem__(item)
+        if type(val) is _LazyJSONValue:
+            val = self._decode_item(item,val)
+        elif item in self._cache:
+            self._cache.move_to_end(item)
+        return val
+    
+    def __setitem__(self,*args,**kwargs):
+        item = args[0]
+        if not (type(item) is list or type(item) is tuple):
+            self._pin(item)
+        return super().__setitem__(*args,**kwargs)
+    
+    def __delitem__(self,key):
+        self._pin(key)
+        return super().__delitem__(key)
+    
+    def set_from_path(self,key_list,value,**kwargs):
+        rv = super().set_from_path(key_list,value,**kwargs)
+        self._pin(key_list[0])
+        return rv
+    
+    def pop(self,key,*args):
+        if key in self:
+            self[key] # decode so we never return a placeholder
+            self._pin(key)
+        return super().pop(key,*args)
+    
+    def popitem(self,last=True):
+        if not self:
+            raise KeyError('dictionary is empty')
+        key = next(reversed(self)) if last else next(iter(self))
+        return key,self.pop(key)
+    
+    def __eq__(self,other):
+        self.decode_all()
+        if isinstance(other,LazyWDict): other.decode_all()
+        return super().__eq__(other)
+    
+    def __ne__(self,other):
+        return not self.__eq__(other)
+    
+class ShardedWDict(LazyWDict):
+    '''
+    @brief WDict stored in a directory with one json file (shard) per top level key and a
+        small manifest.json with the key order, shard file names, and aliases.
+        Shards are loaded on first access, evicted past max_cache_bytes, and only
+        written back by write() (or on eviction) when they were changed  
+    @note changes to WDict values (including nested ones) are tracked. Other values
+        (e.g. lists or arrays) must be set again (e.g. d[key] = value) to be saved  
+    @note top level keys must be strings so they are the same after loading the manifest  
+    '''
+    manifest_name = 'manifest.json'
+    shard_dir_name = 'shards'
+    
+    def __init__(self,*args,**kwargs):
+        self._shard_dir = None # directory we were loaded from/written to
+        self._shard_files = {} # {key:shard file name}
+        self._shard_epochs = {} # {key:epoch when the shard was read or written}
+        self._dirty = set() # keys that were set or deleted
+        self._write_kwargs = {}
+        super().__init__(*args,**kwargs)
+        
+    def load(self,dirpath,max_cache_bytes=None,mmap_mode='c',**kwargs):
+        '''
+        @brief open a sharded dictionary directory. Shards are loaded on first access  
+        @param[in] dirpath - directory written by write()  
+        @param[in/OPT] max_cache_bytes - approximate maximum number of bytes (of json) to keep
+            loaded. None (default) will never evict  
+        @param[in/OPT] mmap_mode - mode to memory map any *.npy sidecar arrays with (see np.load)  
+        @param[in/OPT] kwargs - keyword args will be passed to json.loads() when decoding  
+        '''
+        dirpath = os.path.abspath(dirpath)
+        manifest_path = os.path.join(dirpath,self.manifest_name)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError("Manifest '{}' not found".format(manifest_path))
+        with open(manifest_path,'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        shard_dir = os.path.join(dirpath,self.shard_dir_name)
+        my_kwargs = {}
+        my_kwargs['object_hook'] = partial(WJSONDecoder,sidecar_root=shard_dir,mmap_mode=mmap_mode,
+                                           shared_arrays=weakref.WeakValueDictionary()) # see LazyWDict.load
+        for k,v in kwargs.items():
+            my_kwargs[k] = v
+        self._lazy_kwargs = my_kwargs
+        self._max_cache_bytes = max_cache_bytes
+        self._shard_dir = dirpath
+        if manifest.get('aliases') is not None:
+            OrderedDict.__setitem__(self,self._alias_dict_key,manifest['aliases'])
+            self._alias_dict = manifest['aliases']
+        for k,fname in manifest['shards'].items():
+            fpath = os.path.join(shard_dir,fname)
+            OrderedDict.__setitem__(self,k,_LazyJSONValue(0,os.path.getsize(fpath),fpath))
+            self._shard_files[k] = fname
+            
+    def _decode_item(self,key,lazy):
+        val = super()._decode_item(key,lazy)
+        if isinstance(val,WDict): # so is_shard_modified sees nested changes
+            val._set_tracked()
+        self._shard_epochs[key] = WDict._epoch
+        WDict._epoch += 1 #any change from here on is after the read
+        return val
+        
+    def _pin(self,key):
+        '''@brief values that were set or deleted are kept until they are written'''
+        super()._pin(key)
+        if key!=self._alias_dict_key:
+            self._dirty.add(key)
+        
+    def _evict_item(self,key,lazy):
+        '''@brief write the shard back if it was changed before evicting it'''
+        if self.is_shard_modified(key):
+            lazy = self._write_shard(key,OrderedDict.__getitem__(self,key))
+        super()._evict_item(key,lazy)
+        
+    def clear(self):
+        self._dirty.update(self.keys())
+        return super().clear()
+        
+    def is_shard_modified(self,key):
+        '''@brief check if a top level value has (tracked) changes that arent written yet'''
+        if key in self._dirty:
+            return True
+        val = OrderedDict.__getitem__(self,key)
+        return isinstance(val,WDict) and val._touched>self._shard_epochs.get(key,-1)
+    
+    def _shard_fname(self,key):
+        '''@brief get (or make) a unique file name for the shard of a key'''
+        fname = self._shard_files.get(key)
+        if fname is None:
+            safe_key = re.sub(r'[^\w.-]','_',str(key))[:64]
+            fname = '{}_{}.json'.format(safe_key,hashlib.sha1(repr(key).encode()).hexdigest()[:10])
+            self._shard_files[key] = fname
+        return fname
+        
+    def _write_shard(self,key,val,dirpath=None):
+        '''@brief write the value for a key to its shard file and return a placeholder for it'''
+        dirpath = self._shard_dir if dirpath is None else dirpath
+        fpath = os.path.join(dirpath,self.shard_dir_name,self._shard_fname(key))
+        my_kwargs = {'indent':4,'cls':WJSONEncoder}
+        my_kwargs.update(self._write_kwargs)
+        epoch = WDict._epoch
+        WDict._epoch += 1
+        wjson_dump(val,fpath,**my_kwargs)
+        if isinstance(val,WDict): # so is_shard_modified sees nested changes
+            val._set_tracked()
+        self._shard_epochs[key] = epoch
+        self._dirty.discard(key)
+        return _LazyJSONValue(0,os.path.getsize(fpath),fpath)
+    
+    def write(self,dirpath=None,**kwargs):
+        '''
+        @brief write changed shards and the manifest  
+        @param[in/OPT] dirpath - directory to write to. Defaults to the directory we were
+            loaded from. If its a different directory, all shards are written there and
+            it becomes the directory for this dictionary  
+        @param[in/OPT] kwargs - keyword args passed to json.dump() for each shard  
+        @return path that was written to  
+        '''
+        dirpath = self._shard_dir if dirpath is None else os.path.abspath(dirpath)
+        if dirpath is None:
+            raise ValueError('A directory must be given for a new ShardedWDict')
+        bad_keys = [k for k in self.keys() if type(k) is not str]
+        if bad_keys: # json would make them strings in the manifest
+            raise TypeError('ShardedWDict top level keys must be strings, not {}'.format(bad_keys))
+        self._write_kwargs = kwargs
+        full = dirpath!=self._shard_dir #write everything to a new directory
+        shard_dir = os.path.join(dirpath,self.shard_dir_name)
+        os.makedirs(shard_dir,exist_ok=True)
+        if full:
+            self._shard_epochs.clear()
+        for key in list(self.keys()):
+            if key==self._alias_dict_key:
+                continue
+            val = OrderedDict.__getitem__(self,key)
+            if type(val) is _LazyJSONValue:
+                if full: #copy without decoding
+                    fpath = os.path.join(shard_dir,self._shard_fname(key))
+                    shutil.copyfile(val.fpath,fpath)
+                    OrderedDict.__setitem__(self,key,_LazyJSONValue(0,val.nbytes,fpath))
+            elif full or self.is_shard_modified(key):
+                lazy = self._write_shard(key,val,dirpath)
+                self._pin(key); self._dirty.discard(key)
+                self._cache_item(key,lazy) #now it can be evicted
+        for key in [k for k in self._dirty if k not in self]: #deleted
+            fname = self._shard_files.pop(key,None)
+            if fname is not None and not full and os.path.exists(os.path.join(shard_dir,fname)):
+                os.remove(os.path.join(shard_dir,fname))
+        self._dirty.clear()
+        manifest = OrderedDict()
+        manifest['shards'] = OrderedDict((k,self._shard_fname(k)) for k in self.keys() if k!=self._alias_dict_key)
+        manifest['aliases'] = dict.get(self,self._alias_dict_key)
+        with atomic_open(os.path.join(dirpath,self.manifest_name),'w') as manifest_file:
+            json.dump(manifest,manifest_file,indent=4)
+        self._shard_dir = dirpath
+        return dirpath
+    
+    dump = write
+        
+def _walk_path(node,key_list,deps):
+    '''
+    @brief get a value from a list of keys recording the (WDict,key) pairs it went through  
+    @param[in] node - dictionary to start at  
+    @param[in] key_list - list of keys to traverse  
+    @param[in/OUT] deps - list to append the (WDict,key) pairs to  
+    @return (value at the end of the path, whether every dictionary along the path was tracked)  
+    '''
+    for i,k in enumerate(key_list):
+        if not (isinstance(node,WDict) and node._cache_paths): # cant track changes past here
+            return reduce(operator.getitem,key_list[i:],node),False
+        deps.append((node,k))
+        val = dict.get(node,k,_MISSING)
+        if val is _MISSING: # resolve aliases from this node
+            alias_dict = node._alias_dict
+            if alias_dict is None or k not in alias_dict:
+                raise KeyError(k)
+            alias = alias_dict[k]
+            alias = alias if type(alias) is list or type(alias) is tuple else (alias,)
+            val,tracked = _walk_path(node,alias,deps)
+            if not tracked:
+                return reduce(operator.getitem,key_list[i+1:],val),False
+        node = val
+    return node,True
+
+MERGE_POLICIES = ['keep','overwrite','error']
+
+def update_nested_dict(dict_update,*dicts_to_add,overwrite_values=False,policy=None,share=True,**kwargs):
+    '''
+    @brief take nested dictionaries and merge them into the first one. 
+        Values in dict_update take precedence unless overwrite_values or policy say otherwise  
     @param[in] dict_update - dictionary to update  
-    @param[in] dict_to_add - dictionary to update from  
-    @param[in/OPT] overwrite_values - do we overwrite dict_update values if they already exist  
+    @param[in] dicts_to_add - one or more dictionaries to update from (merged in order in a single pass)  
+    @param[in/OPT] overwrite_values - do we overwrite dict_update values if they already exist.
+        This applies at every nesting level, not just the top one  
+    @param[in/OPT] policy - what to do when a key exists with a value that cant be merged 
+        (anything other than two dictionaries) at any level. Overrides overwrite_values. Can be  
+            - 'keep' - keep the existing value (default)  
+            - 'overwrite' - use the new value (default if overwrite_values)  
+            - 'error' - raise a ValueError if the values are different  
+            - function(key_path,old_value,new_value) returning the value to use  
+    @param[in/OPT] share - if True (default) dictionaries that only come from one input are
+        added by reference. False copies them so dict_update never shares subtrees with dicts_to_add  
+    @note this is iterative so very deep dictionaries can be merged. Any dict subclass (e.g. WDict) is merged  
+    @note dicts_to_add are never changed (shared dictionaries are copied before anything is merged into them).
+        Copies keep the type and constructor state (e.g. defaultdict's default_factory) of the original  
+    @note nothing is printed for added keys  
+    @return dict_update  
     '''
-    for k,v in dict_to_add.items():
-        if k in dict_update.keys(): #if the key exist keep merging
-            if type(v) is dict and type(dict_update[k]) is dict:
-                update_nested_dict(dict_update[k],v)
-            else:
-                if overwrite_values:
-                    dict_update[k] = v #overwrite the value
-        else: #if it doesnt exist, just add it
-            dict_update[k] = v #set the value in dict 1
-            print(dict_update[k])
+    if policy is None:
+        policy = 'overwrite' if overwrite_values else 'keep'
+    if not callable(policy) and policy not in MERGE_POLICIES:
+        raise ValueError("Unknown merge policy '{}'. Must be one of {} or a function".format(policy,MERGE_POLICIES))
+    queue = deque((dict_update,src,None) for src in dicts_to_add) # (target,dict to merge in,(parent path,key))
+    shared = set() # ids of dictionaries from the inputs added by reference. Copied before merging into them
+    while queue: # first in first out so each dictionary is merged in the input order
+        target,src,path = queue.popleft()
+        for k,v in src.items():
+            if k not in target:
+                if not isinstance(v,dict):
+                    target[k] = v
+                elif share:
+                    target[k] = v; shared.add(id(v))
+                else:
+                    target[k] = cur = _empty_dict_like(v)
+                    queue.append((cur,v,(path,k)))
+                continue
+            cur = target[k]
+            if isinstance(v,dict) and isinstance(cur,dict):
+                if id(cur) in shared: # copy on write so the inputs never change
+                    shared.discard(id(cur))
+                    target[k] = new = _empty_dict_like(cur)
+                    queue.append((new,cur,(path,k)))
+                    cur = new
+                queue.append((cur,v,(path,k)))
+                continue
+            val = _resolve_merge_conflict(policy,(path,k),cur,v)
+            if val is not cur:
+                if isinstance(val,dict):
+                    if share:
+                        shared.add(id(val))
+                    else:
+                        new = _empty_dict_like(val)
+                        queue.append((new,val,(path,k)))
+                        val = new
+                target[k] = val
+    return dict_update
+
+def _empty_dict_like(d):
+    '''@brief get an empty dictionary of the same type and constructor state (e.g. default_factory) as d'''
+    if isinstance(d,WDict): # dont copy aliases, caches, or parent links
+        return WDict()
+    new = copy.copy(d)
+    new.clear()
+    return new
+
+def _resolve_merge_conflict(policy,path,old,new):
+    '''@brief get the value to use when merging two values that cant be merged'''
+    if policy=='keep':
+        return old
+    if policy=='overwrite':
+        return new
+    key_path = [] # (parent path,key) pairs are only unrolled when needed
+    while path is not None:
+        path,k = path
+        key_path.append(k)
+    key_path = tuple(reversed(key_path))
+    if policy=='error':
+        if old is new:
+            return old
+        try:
+            equal = bool(old==new)
+        except ValueError: # e.g. arrays
+            equal = isinstance(old,np.ndarray) and np.array_equal(old,new)
+        if not equal:
+            raise ValueError('Merge conflict at {}: {!r} != {!r}'.format(list(key_path),old,new))
+        return old
+    return policy(key_path,old,new)
+
+def merge_nested_dicts(*dicts,policy='overwrite',share=True):
+    '''
+    @brief merge nested dictionaries into a new one without changing any of them  
+    @param[in] dicts - dictionaries to merge in order  
+    @param[in/OPT] policy - what to do with values that cant be merged (see update_nested_dict).
+        Defaults to 'overwrite' so later dictionaries take precedence  
+    @param[in/OPT] share - if True (default) subtrees that only exist in one input are shared
+        with it instead of copied  
+    @return new dictionary of the type of the first one (WDict for any WDict)  
+    '''
+    if not dicts:
+        return WDict()
+    return update_nested_dict(_empty_dict_like(dicts[0]),*dicts,policy=policy,share=share)
 
 class WJSONEncoder(json.JSONEncoder):
     '''
     @brief custom json encoder for specific Weiss Dictionary types  
+    @param[in/OPT] sidecar_dir - directory to write large ndarrays to as *.npy files  
+    @param[in/OPT] sidecar_threshold - ndarrays with at least this many bytes are written to sidecar_dir.
+        Files are named by the content hash of the array so files referenced by an earlier
+        write are never changed (they are removed once the new json is in place, see WDict.write)  
+    @param[in/OPT] base64_arrays - if True, write ndarrays (including complex) as
+        {__ndarray__:<base64 bytes>,dtype:<dtype>,shape:<shape>} instead of lists  
+    @param[in/OPT] dedup_arrays - if True, equal ndarrays are only written once (see shared_ndarray_decoder).
+        All copies of a sidecar array reference the same file  
+    @param[in/OPT] sidecar_files - set to add the names of all sidecar files referenced in the output to  
+    @note extra arguments are passed through json.dump(obj,fp,cls=WJSONEncoder,...)  
+    @note the encoding method for each type is found once and then cached in _dispatch_cache.
+        Use register_json_encoder to add encoders for other types  
     '''
     custom_encoding_method = '_encode_json_' #this method should be written to provide a custom encoding
+    _type_encoders = {} # registered {type:function(obj)} checked before the defaults
+    _dispatch_cache = {} # {type(obj):function(encoder,obj)}
+    
+    def __init_subclass__(cls,**kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch_cache = {} # subclasses may override the encoding methods
+        
+    def __init__(self,*args,sidecar_dir=None,sidecar_threshold=None,base64_arrays=False,dedup_arrays=False,
+                 sidecar_files=None,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.sidecar_dir = sidecar_dir
+        self.sidecar_threshold = sidecar_threshold
+        self.sidecar_files = sidecar_files
+        self.base64_arrays = base64_arrays
+        self.dedup_arrays = dedup_arrays
+        self._shared_refs = {} # {array hash:reference to the already written array}
+        self._array_hashes = {} # {id(array):(array,hash)} so the same object is only hashed once
+        
+    def reset_shared(self):
+        '''@brief forget the arrays already written so dedup_arrays starts again (e.g. for each record of a file)'''
+        self._shared_refs.clear()
+        self._array_hashes.clear()
+        
     def default(self,obj):
+        encoder = self._dispatch_cache.get(type(obj))
+        if encoder is None:
+            encoder,cacheable = self._find_encoder(obj)
+            if cacheable:
+                self._dispatch_cache[type(obj)] = encoder
+        return encoder(self,obj)
+    
+    def _find_encoder(self,obj):
+        '''
+        @brief find the method to encode an object with  
+        @return (function(encoder,obj), whether it can be cached for type(obj))  
+        '''
+        for base in type(obj).__mro__: #registered encoders first
+            fun = self._type_encoders.get(base)
+            if fun is not None:
+                return (lambda self,obj: fun(obj)),True
         if isinstance(obj,np.ndarray): #change any ndarrays to lists
-            return obj.tolist()
+            return type(self)._encode_ndarray,True
         if isinstance(obj,bytes):
-            try:
-                return obj.decode()
-            except UnicodeDecodeError:
-                return str(obj)
-        if np.iscomplexobj(obj): #then its a complex number
-            return complex_number_encoder(obj) #encode complex numbers
-        elif hasattr(obj,self.custom_encoding_method): #assume this will then be a class with a custom method
-            return class_encoder(obj)
-        elif callable(obj): #if its a callable (e.g. a fucntion) try to encode it
-            return function_encoder(obj)
-        else:
-            return super().default(obj)
+            return type(self)._encode_bytes,True
+        if isinstance(obj,(complex,np.complexfloating)): #then its a complex number
+            return (lambda self,obj: complex_number_encoder(obj)),True
+        if hasattr(obj,'dtype') and np.iscomplexobj(obj): #depends on the dtype so dont cache
+            return (lambda self,obj: complex_number_encoder(obj)),False
+        if isinstance(obj,np.generic): #other numpy scalars (e.g. np.int64)
+            return (lambda self,obj: obj.item()),True
+        if hasattr(obj,self.custom_encoding_method): #assume this will then be a class with a custom method
+            return (lambda self,obj: class_encoder(obj)),hasattr(type(obj),self.custom_encoding_method)
+        if callable(obj): #if its a callable (e.g. a fucntion) try to encode it
+            return (lambda self,obj: function_encoder(obj)),True
+        return json.JSONEncoder.default,True
+        
+    def _encode_ndarray(self,obj):
+        '''@brief encode an ndarray as a list, base64 bytes, or a sidecar file'''
+        if self.dedup_arrays and not obj.dtype.hasobject:
+            return self._encode_shared_ndarray(obj)
+        if (self.sidecar_dir is not None and not obj.dtype.hasobject
+                and obj.nbytes>=self.sidecar_threshold): #write large arrays to a file
+            fname = 'arr_{}.npy'.format(self._get_array_hash(obj))
+            if self.sidecar_files is not None:
+                self.sidecar_files.add(fname)
+            return sidecar_encoder(obj,self.sidecar_dir,fname,overwrite=False)
+        if self.base64_arrays and not obj.dtype.hasobject:
+            return ndarray_encoder(obj)
+        return obj.tolist()
+    
+    def _get_array_hash(self,obj):
+        '''@brief get the hash of an ndarray (each array object is only hashed once)'''
+        cached = self._array_hashes.get(id(obj))
+        if cached is not None and cached[0] is obj:
+            return cached[1]
+        key = get_array_hash(obj)
+        self._array_hashes[id(obj)] = (obj,key) # keep obj so its id isnt reused
+        return key
+    
+    def _encode_shared_ndarray(self,obj):
+        '''
+        @brief encode an ndarray only the first time its contents are seen. Later copies
+            are written as a reference to the first  
+        '''
+        key = self._get_array_hash(obj)
+        ref = self._shared_refs.get(key)
+        if ref is not None:
+            return ref
+        if self.sidecar_dir is not None and obj.nbytes>=self.sidecar_threshold:
+            fname = 'arr_{}.npy'.format(key)
+            if self.sidecar_files is not None:
+                self.sidecar_files.add(fname)
+            ref = sidecar_encoder(obj,self.sidecar_dir,fname,overwrite=False)
+            ref['shared'] = True
+            self._shared_refs[key] = ref
+            return ref
+        self._shared_refs[key] = {'__shared_ndarray__':key}
+        enc = OrderedDict({'__shared_ndarray__':key})
+        enc['value'] = ndarray_encoder(obj) if self.base64_arrays else obj.tolist()
+        return enc
+    
+    def _encode_bytes(self,obj):
+        '''@brief encode bytes as a string'''
+        try:
+            return obj.decode()
+        except UnicodeDecodeError:
+            return str(obj)
+        
+def register_json_encoder(type_,encoder):
+    '''
+    @brief register a function to encode a type (and its subclasses) with WJSONEncoder  
+    @param[in] type_ - type to encode  
+    @param[in] encoder - function taking the object and returning something json serializable  
+    '''
+    WJSONEncoder._type_encoders[type_] = encoder
+    classes = [WJSONEncoder]
+    while classes: #clear the cached methods
+        cls = classes.pop()
+        cls._dispatch_cache.clear()
+        classes += cls.__subclasses__()
+        
+_class_decoders = {} # {class name:function(encoded data)}
 
-def WJSONDecoder(o):
+def register_json_class(cls=None,name=None,decoder=None):
+    '''
+    @brief register a class so WJSONDecoder can decode it from class_encoder output.
+        This can also be used as a class decorator (@register_json_class)  
+    @param[in] cls - class to register. Unless decoder is given, it must have a default
+        constructor and a _decode_json_ method taking the output of _encode_json_  
+    @param[in/OPT] name - name to register as (default cls.__name__ like class_encoder)  
+    @param[in/OPT] decoder - function taking the output of _encode_json_ and returning the object  
+    @return cls  
+    '''
+    if cls is None: #used as @register_json_class(name=...)
+        return partial(register_json_class,name=name,decoder=decoder)
+    if decoder is None:
+        decoder = partial(_decode_class,cls)
+    _class_decoders[cls.__name__ if name is None else name] = decoder
+    return cls
+
+def _decode_class(cls,data):
+    '''@brief decode a class with its default constructor and _decode_json_ method'''
+    obj = cls()
+    rv = obj._decode_json_(data)
+    return obj if rv is None else rv
+
+def WJSONDecoder(o,sidecar_root=None,mmap_mode=None,dict_type=None,shared_arrays=None):
     '''
     @brief allow defining custom decoders in a function  
-    @note class must have a default constructor (class_())   
-    @note the class must have a _decode_json_ method  
-    @note the class must also be imported into globals()  
-    @note if the above notes are not met, standard decoding will be done  
-    '''
-    custom_decoding_method = '_decode_json_'
-    if o.keys():
-        first_key_name = list(o.keys())[0] #
-    else:
-        first_key_name = ''
-    if first_key_name.startswith('__') and first_key_name.endswith('__'): 
-        #then assume its a special directive (e.g. class or operation)
-        spec_dir = first_key_name.strip('__')
-        if spec_dir=='function':
-            return function_decoder(o)
-        elif spec_dir=='complex_number':
-            return complex_number_decoder(o)
-        elif spec_dir=='class': #assume its a class
-            class_name = spec_dir
-            globals_ = globals()
-            class_ = globals_.get(class_name)
-            obj = class_() #must have a default constructor
-            if class_ is not None: #check if its a 
-                if hasattr(obj,custom_decoding_method):
-                    cust_dec_meth = getattr(obj,custom_decoding_method)
-                    return cust_dec_meth(o)
-    elif isinstance(o,dict): #if its a dict, make it a WDict
+    @param[in] o - dictionary decoded by json  
+    @param[in/OPT] sidecar_root - directory sidecar array paths are relative to (default to cwd)  
+    @param[in/OPT] mmap_mode - memory map mode for sidecar arrays (see np.load)  
+    @param[in/OPT] dict_type - type to convert dictionaries to (default WDict). dict leaves them as is  
+    @param[in/OPT] shared_arrays - dictionary to keep arrays deduplicated by WJSONEncoder(dedup_arrays=True) 
+        in while decoding. Use a new one for each file. A weakref.WeakValueDictionary only shares
+        arrays while they are still used (e.g. for values that are evicted)  
+    @note use functools.partial to pass the optional arguments as an object_hook  
+    @note special directives are found from the first key (see JSON_DIRECTIVE_DECODERS)  
+    @note classes must be registered with register_json_class. Otherwise standard decoding will be done  
+    '''
+    first_key_name = next(iter(o),None)
+    decoder = JSON_DIRECTIVE_DECODERS.get(first_key_name)
+    if decoder is not None: #then its a special directive (e.g. class or operation)
+        if decoder is sidecar_decoder:
+            if o.get('shared') and shared_arrays is not None: #decode each shared file once
+                arr = shared_arrays.get(o['__ndarray_file__'])
+                if arr is None:
+                    arr = sidecar_decoder(o,sidecar_root,mmap_mode)
+                    arr.flags.writeable = False
+                    shared_arrays[o['__ndarray_file__']] = arr
+                return arr
+            return sidecar_decoder(o,sidecar_root,mmap_mode)
+        if decoder is shared_ndarray_decoder:
+            return shared_ndarray_decoder(o,shared_arrays)
+        return decoder(o)
+    if dict_type is None: #if its a dict, make it a WDict
         o = WDict(o)
+        if o._alias_dict_key in o:
+            o._alias_dict = dict.__getitem__(o,o._alias_dict_key)
+    elif dict_type is not dict:
+        o = dict_type(o)
     return o
 
-import inspect
-from textwrap import dedent
+#%% json backends
+JSON_BACKENDS = ['json','orjson','fast']
+
+def _resolve_backend(backend):
+    '''@brief get the json library to use for a backend name ('fast' uses orjson if installed)'''
+    if backend not in JSON_BACKENDS:
+        raise ValueError("Unknown json backend '{}'. Must be one of {}".format(backend,JSON_BACKENDS))
+    if backend=='orjson' and orjson is None:
+        raise ImportError("orjson backend requested but orjson is not installed")
+    if backend=='fast':
+        backend = 'json' if orjson is None else 'orjson'
+    return backend
+
+def _apply_object_hook(obj,object_hook):
+    '''@brief apply a json object_hook to decoded data from the inside out (like json.loads)'''
+    if type(obj) is dict:
+        for k,v in obj.items():
+            if type(v) is dict or type(v) is list:
+                obj[k] = _apply_object_hook(v,object_hook)
+        return object_hook(obj)
+    elif type(obj) is list:
+        for i,v in enumerate(obj):
+            if type(v) is dict or type(v) is list:
+                obj[i] = _apply_object_hook(v,object_hook)
+    return obj
+    
+def wjson_loads(mystr,backend='json',**kwargs):
+    '''
+    @brief decode json with a selectable backend  
+    @param[in] mystr - str or bytes to decode  
+    @param[in/OPT] backend - 'json' (stdlib), 'orjson', or 'fast' (orjson if installed, otherwise json)  
+    @param[in/OPT] kwargs - keyword args passed to json.loads(). orjson only supports object_hook,
+        so any other arguments will fall back to the stdlib  
+    @return decoded data  
+    '''
+    backend = _resolve_backend(backend)
+    if backend=='orjson' and not (kwargs.keys()-{'object_hook'}):
+        data = orjson.loads(mystr)
+        object_hook = kwargs.get('object_hook',None)
+        if object_hook is not None:
+            data = _apply_object_hook(data,object_hook)
+        return data
+    return json.loads(mystr,**kwargs)
+
+def _orjson_dumps(obj,cls=json.JSONEncoder,indent=None,sort_keys=False,**kwargs):
+    '''@brief dump to bytes with orjson using cls.default for unsupported types'''
+    encoder = cls(**kwargs)
+    option = orjson.OPT_NON_STR_KEYS
+    if indent: option |= orjson.OPT_INDENT_2 # orjson only supports 2 space indents
+    if sort_keys: option |= orjson.OPT_SORT_KEYS
+    if not (getattr(encoder,'sidecar_dir',None) or getattr(encoder,'base64_arrays',False)
+            or getattr(encoder,'dedup_arrays',False)):
+        option |= orjson.OPT_SERIALIZE_NUMPY # let orjson write arrays unless we encode them ourselves
+    return orjson.dumps(obj,default=encoder.default,option=option)
+    
+def wjson_dumps(obj,backend='json',**kwargs):
+    '''
+    @brief encode json with a selectable backend  
+    @param[in] obj - object to encode  
+    @param[in/OPT] backend - 'json' (stdlib), 'orjson', or 'fast' (orjson if installed, otherwise json)  
+    @param[in/OPT] kwargs - keyword args passed to json.dumps(). For orjson, cls is only used for
+        its default() method and indent will always be 2 spaces  
+    @return json string  
+    '''
+    if _resolve_backend(backend)=='orjson':
+        return _orjson_dumps(obj,**kwargs).decode()
+    return json.dumps(obj,**kwargs)
+
+def wjson_dump(obj,fpath,backend='json',**kwargs):
+    '''
+    @brief encode json to a file with a selectable backend  
+    @param[in] obj - object to encode  
+    @param[in] fpath - path to write to  
+    @param[in/OPT] backend - 'json' (stdlib), 'orjson', or 'fast' (orjson if installed, otherwise json)  
+    @param[in/OPT] kwargs - keyword args passed to json.dump() (see wjson_dumps)  
+    '''
+    if _resolve_backend(backend)=='orjson':
+        with atomic_json_writer(fpath) as json_file:
+            json_file.write(_orjson_dumps(obj,**kwargs))
+    else:
+        with atomic_json_writer(fpath) as json_file:
+            text_file = io.TextIOWrapper(json_file,encoding='utf-8')
+            json.dump(obj,text_file,**kwargs) #stream the chunks straight into the compressor
+            text_file.flush()
+            text_file.detach()
+            
+#%% compressed json files
+COMPRESSION_TYPES = {'.gz':gzip,'.bz2':bz2,'.xz':lzma,'.lzma':lzma} # extension:module
+
+def get_compression(fpath):
+    '''@brief get the compression module (gzip,bz2,lzma) for a file from its extension or None'''
+    return COMPRESSION_TYPES.get(os.path.splitext(fpath)[1].lower())
+
+def _check_uncompressed(fpath):
+    '''@brief raise an error for compressed files that need to be memory mapped'''
+    if get_compression(fpath) is not None:
+        raise ValueError("Indexing '{}' requires an uncompressed json file".format(fpath))
+
+def open_json_file(fpath,mode='rb'):
+    '''
+    @brief open a (possibly compressed) json file. Compression is chosen from the extension  
+    @param[in] fpath - path to the file  
+    @param[in/OPT] mode - mode to open with  
+    '''
+    comp = get_compression(fpath)
+    if comp is None:
+        return open(fpath,mode)
+    return comp.open(fpath,mode)
+
+@contextmanager
+def atomic_json_writer(fpath):
+    '''
+    @brief atomically write binary data to a (possibly compressed) json file
+        (see atomic_open and open_json_file)  
+    @param[in] fpath - path to write to  
+    '''
+    comp = get_compression(fpath)
+    with atomic_open(fpath,'wb') as raw_file:
+        if comp is None:
+            yield raw_file
+        elif comp is gzip:
+            with gzip.GzipFile(filename=os.path.basename(fpath),mode='wb',fileobj=raw_file) as comp_file:
+                yield comp_file
+        else:
+            with comp.open(raw_file,'wb') as comp_file:
+                yield comp_file
+            
+@contextmanager
+def atomic_open(fpath,mode='w'):
+    '''
+    @brief open a temporary file next to fpath that replaces fpath once it is
+        closed without errors. This way fpath is never left partially written  
+    @param[in] fpath - path to write to  
+    @param[in/OPT] mode - mode to open the file with (must be a write mode)  
+    @note the temporary file is renamed with replace_file (see there for files in use on Windows)  
+    '''
+    tmp_path = '{}.{}.{}.tmp'.format(fpath,os.getpid(),threading.get_ident())
+    try:
+        with open(tmp_path,mode) as tmp_file:
+            yield tmp_file
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        replace_file(tmp_path,fpath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+        
+def replace_file(src,dst,retries=10,delay=0.05):
+    '''
+    @brief os.replace that retries while dst is in use  
+    @param[in] src,dst - paths to rename src to dst  
+    @param[in/OPT] retries - number of times to try  
+    @param[in/OPT] delay - seconds to wait between tries  
+    @note on Windows replacing fails while dst is open (without delete sharing) or memory
+        mapped (e.g. sidecar arrays loaded with mmap_mode). Short uses are waited out, otherwise a
+        PermissionError names dst (release the arrays or load without mmap_mode to replace it).
+        Other systems replace the file and anything still open or mapped keeps the old contents  
+    '''
+    for i in range(retries):
+        try:
+            return os.replace(src,dst)
+        except PermissionError as err:
+            if i==retries-1:
+                raise PermissionError("Could not replace '{}'. It may be open or memory mapped "
+                                      "by another process or array".format(dst)) from err
+            time.sleep(delay)
+
+def _file_stat(fpath):
+    '''@brief get (size,mtime) of a file or (None,None) if it doesnt exist'''
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return (None,None)
+    return (st.st_size,st.st_mtime_ns)
+
+def _file_sha1(fpath):
+    '''@brief get the sha1 of a files contents or None if it doesnt exist'''
+    if not os.path.exists(fpath):
+        return None
+    sha = hashlib.sha1()
+    with open_json_file(fpath) as hash_file: #hash the uncompressed content
+        for chunk in iter(partial(hash_file.read,1<<20),b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+            
+#%% json indexing without decoding
+_JSON_STRING_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+_JSON_TOKEN_RE = re.compile(rb'[{}\[\]:,"]') # tokens at the level being indexed
+_JSON_NESTED_TOKEN_RE = re.compile(rb'[{}\[\]"]') # tokens in nested values
+
+def is_json_directive(key):
+    '''@brief check if a key is a special directive for WJSONDecoder (e.g. __complex_number__)'''
+    return key in JSON_DIRECTIVE_DECODERS
+
+def _json_string_end(buf,start,end):
+    '''@brief get the index right after the json string starting at start'''
+    m = _JSON_STRING_RE.match(buf,start,end)
+    if m is None:
+        raise ValueError('Unterminated json string starting at byte {}'.format(start))
+    return m.end()
+
+def skip_json_container(buf,start,end=None):
+    '''
+    @brief find the end of a json list or object without decoding it  
+    @param[in] buf - bytes like object (e.g. mmap) containing the json  
+    @param[in] start - index of the opening bracket  
+    @param[in/OPT] end - index to stop searching at  
+    @return index right after the matching closing bracket  
+    '''
+    end = len(buf) if end is None else end
+    depth = 0; pos = start
+    while True:
+        m = _JSON_NESTED_TOKEN_RE.search(buf,pos,end)
+        if m is None:
+            raise ValueError('Unterminated json container starting at byte {}'.format(start))
+        tok = buf[m.start():m.start()+1]; pos = m.end()
+        if tok==b'"':
+            pos = _json_string_end(buf,m.start(),end)
+        elif tok==b'{' or tok==b'[':
+            depth += 1
+        elif tok==b'}' or tok==b']':
+            depth -= 1
+            if depth==0:
+                return pos
+            
+def index_json_object(buf,start=0,end=None,allow_other=False):
+    '''
+    @brief find the byte ranges of the values of a json object without decoding them  
+    @param[in] buf - bytes like object (e.g. mmap) containing the json  
+    @param[in/OPT] start - index to start looking for the object at  
+    @param[in/OPT] end - index to stop at  
+    @param[in/OPT] allow_other - return None instead of raising if the value is not an object  
+    @return OrderedDict of {key:(value_start,value_end)}  
+    '''
+    end = len(buf) if end is None else end
+    m = _JSON_TOKEN_RE.search(buf,start,end)
+    if m is None or buf[m.start():m.end()]!=b'{' or buf[start:m.start()].strip():
+        if allow_other: return None
+        raise ValueError('No json object found at byte {}'.format(start))
+    index = OrderedDict()
+    key = None; vstart = None; pos = m.end()
+    while True:
+        m = _JSON_TOKEN_RE.search(buf,pos,end)
+        if m is None:
+            raise ValueError('Unterminated json object starting at byte {}'.format(start))
+        tok = buf[m.start():m.start()+1]; pos = m.end()
+        if tok==b'"':
+            pos = _json_string_end(buf,m.start(),end)
+            if vstart is None: # its a key, otherwise its a string value
+                key = json.loads(buf[m.start():pos])
+        elif tok==b':':
+            vstart = pos
+        elif tok==b',' or tok==b'}':
+            if key is not None:
+                index[key] = (vstart,m.start())
+            key = vstart = None
+            if tok==b'}':
+                return index
+        elif tok==b'{' or tok==b'[': # skip nested values
+            pos = skip_json_container(buf,m.start(),end)
+            
+def index_json_array(buf,start=0,end=None):
+    '''
+    @brief find the byte ranges of the elements of a json list without decoding them  
+    @param[in] buf - bytes like object (e.g. mmap) containing the json  
+    @param[in/OPT] start - index to start looking for the list at  
+    @param[in/OPT] end - index to stop at  
+    @return list of (value_start,value_end)  
+    '''
+    end = len(buf) if end is None else end
+    m = _JSON_TOKEN_RE.search(buf,start,end)
+    if m is None or buf[m.start():m.end()]!=b'[' or buf[start:m.start()].strip():
+        raise ValueError('No json list found at byte {}'.format(start))
+    index = []
+    vstart = pos = m.end()
+    while True:
+        m = _JSON_TOKEN_RE.search(buf,pos,end)
+        if m is None:
+            raise ValueError('Unterminated json list starting at byte {}'.format(start))
+        tok = buf[m.start():m.start()+1]; pos = m.end()
+        if tok==b'"':
+            pos = _json_string_end(buf,m.start(),end)
+        elif tok==b',' or tok==b']':
+            if tok==b',' or buf[vstart:m.start()].strip(): # not an empty list
+                index.append((vstart,m.start()))
+            vstart = pos
+            if tok==b']':
+                return index
+        elif tok==b'{' or tok==b'[': # skip nested values
+            pos = skip_json_container(buf,m.start(),end)
+            
+def find_json_path(buf,key_path,start=0,end=None,indices=None):
+    '''
+    @brief find the byte range of a nested value in json without decoding anything else  
+    @param[in] buf - bytes like object (e.g. mmap) containing the json  
+    @param[in] key_path - key or list of keys to the value (like WDict.__getitem__).
+        Integers index into json lists  
+    @param[in/OPT] start,end - range in buf containing the root object  
+    @param[in/OPT] indices - dictionary to cache object and list indices in between calls  
+    @note aliases (__aliases__) are followed like in WDict.__getitem__  
+    @return (start,end) of the value  
+    '''
+    return _find_json_path(buf,key_path,start,end,indices)[0]
+
+def _find_json_path(buf,key_path,start=0,end=None,indices=None):
+    '''@brief find_json_path also returning the key path with any aliases resolved'''
+    indices = {} if indices is None else indices
+    end = len(buf) if end is None else end
+    if not (type(key_path) is list or type(key_path) is tuple):
+        key_path = [key_path]
+    key_path = list(key_path)
+    rng = (start,end)
+    for i,k in enumerate(key_path):
+        index = indices.get(rng)
+        if index is None:
+            m = _JSON_TOKEN_RE.search(buf,*rng)
+            is_list = m is not None and buf[m.start():m.end()]==b'[' and not buf[rng[0]:m.start()].strip()
+            index = indices[rng] = index_json_array(buf,*rng) if is_list else \
+                                   index_json_object(buf,*rng,allow_other=True)
+            if index is None:
+                raise TypeError('Cannot get {!r} from a json value that is not an object or list (key path {})'.format(k,key_path))
+        if type(index) is list:
+            if type(k) is not int:
+                raise TypeError('json lists can only be indexed with integers, not {!r} (key path {})'.format(k,key_path))
+            try:
+                rng = index[k]
+            except IndexError:
+                raise IndexError('Index {} out of range for a json list of length {} (key path {})'.format(k,len(index),key_path))
+            if k<0: key_path[i] = k+len(index)
+        elif k in index:
+            rng = index[k]
+        elif '__aliases__' in index: # aliases are relative to this object
+            aliases = json.loads(buf[slice(*index['__aliases__'])])
+            if k not in aliases:
+                raise KeyError(k)
+            alias = aliases[k] if type(aliases[k]) is list else [aliases[k]]
+            rng,real_path = _find_json_path(buf,alias+key_path[i+1:],*rng,indices=indices)
+            return rng,key_path[:i]+real_path
+        else:
+            raise KeyError(k)
+    return rng,key_path
+    
+def index_json_file(fpath,start=None,end=None,allow_other=False):
+    '''
+    @brief find the byte ranges of the values of a json object in a file without decoding them  
+    @param[in] fpath - path to the json file  
+    @param[in/OPT] start,end - byte range of the object in the file (default to the whole file)  
+    @param[in/OPT] allow_other - return None instead of raising if the value is not an object  
+    @return OrderedDict of {key:(value_start,value_end)}  
+    '''
+    _check_uncompressed(fpath)
+    with open(fpath,'rb') as json_file:
+        with mmap.mmap(json_file.fileno(),0,access=mmap.ACCESS_READ) as buf:
+            return index_json_object(buf,0 if start is None else start,end,allow_other=allow_other)
+            
+
+class _LRUCache(OrderedDict):
+    '''@brief small least recently used cache'''
+    def __init__(self,maxsize=128):
+        self.maxsize = maxsize
+        super().__init__()
+        
+    def lookup(self,key,default=None):
+        '''@brief get a value and mark it as most recently used'''
+        try:
+            self.move_to_end(key)
+            return OrderedDict.__getitem__(self,key)
+        except (KeyError,TypeError): # not cached or unhashable
+            return default
+        
+    def store(self,key,value):
+        '''@brief add a value, evicting the least recently used past maxsize'''
+        try:
+            self[key] = value
+        except TypeError: # unhashable so dont cache
+            return
+        self.move_to_end(key)
+        self.trim()
+        
+    def trim(self):
+        '''@brief evict the least recently used values past maxsize'''
+        while self.maxsize is not None and len(self)>self.maxsize:
+            self.popitem(last=False)
+
+_function_code_cache = _LRUCache(256) # {sha1 of source:code object}
+_function_source_cache = _LRUCache(1024) # {code object (or callable):source}
+_function_cache_dir = None
+
+def set_function_cache(maxsize=256,cache_dir=None):
+    '''
+    @brief configure the caching of compiled functions for function_decoder  
+    @param[in/OPT] maxsize - number of compiled functions to keep in memory (None for no limit)  
+    @param[in/OPT] cache_dir - directory to also save compiled code to so it is
+        reused across processes (None for no disk cache)  
+    '''
+    global _function_cache_dir
+    _function_code_cache.maxsize = maxsize
+    _function_code_cache.trim()
+    if cache_dir is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+    _function_cache_dir = cache_dir
+    
+def clear_function_cache():
+    '''@brief clear the in memory function code and source caches'''
+    _function_code_cache.clear()
+    _function_source_cache.clear()
+    
+def get_function_source(myfun):
+    '''
+    @brief get the (dedented) source of a function. This is cached per code object  
+    @param[in] myfun - function to get the source of  
+    '''
+    key = getattr(myfun,'__code__',myfun)
+    src = _function_source_cache.lookup(key)
+    if src is None:
+        src = dedent(inspect.getsource(myfun))
+        _function_source_cache.store(key,src)
+    return src
+
+def compile_function_source(src):
+    '''
+    @brief compile function source to a code object using the in memory (and disk) cache  
+    @param[in] src - source code to compile  
+    @return code object to exec  
+    '''
+    key = hashlib.sha1(src.encode()).hexdigest()
+    code = _function_code_cache.lookup(key)
+    if code is not None:
+        return code
+    cache_path = None
+    if _function_cache_dir is not None: #try the disk cache
+        cache_path = os.path.join(_function_cache_dir,'{}.{}.code'.format(key,sys.implementation.cache_tag))
+        try:
+            with open(cache_path,'rb') as code_file:
+                code = marshal.loads(code_file.read())
+        except (OSError,EOFError,ValueError,TypeError):
+            code = None
+    if code is None:
+        code = compile(src,'<string>','exec')
+        if cache_path is not None:
+            with open(cache_path+'.tmp','wb') as code_file:
+                code_file.write(marshal.dumps(code))
+            os.replace(cache_path+'.tmp',cache_path)
+    _function_code_cache.store(key,code)
+    return code
+
 def function_encoder(myfun):
     '''
     @brief encode a funciton into a dictionary  
     @param[in] myfun - function to encode  
     @note this is still limited in functionality by inspect.getsource
     '''
-    mydict = OrderedDict({'__function__':dedent(inspect.getsource(myfun))})
+    mydict = OrderedDict({'__function__':get_function_source(myfun)})
     mydict['__name__'] = myfun.__name__
     return mydict
 
@@ -302,9 +1862,16 @@ def function_decoder(obj):
     '''
     @brief class to decode a function created by function_encoder  
     @param[in] object from function_encoder  
+    @note compiled code is cached (see set_function_cache)  
     '''
-    exec(obj['__function__']) #define the function (e.g. def foo(a,b): return a+b)
-    return eval(obj['__name__']) #return the function that was defined (e.g. foo)
+    src = obj['__function__']
+    namespace = {}
+    exec(compile_function_source(src),globals(),namespace) #define the function (e.g. def foo(a,b): return a+b)
+    fun = namespace[obj['__name__']] #the function that was defined (e.g. foo)
+    key = getattr(fun,'__code__',fun)
+    if _function_source_cache.lookup(key) is None: #so it can be encoded again
+        _function_source_cache.store(key,src)
+    return fun
     
 def class_encoder(myclass):
     '''
@@ -312,12 +1879,23 @@ def class_encoder(myclass):
     @param[in] myclass - class to encode
     @note this assumes the class has an encode and decode method
     '''
-    cust_enc_meth = getattr(myclass,'custom_encoding_method')
+    cust_enc_meth = getattr(myclass,WJSONEncoder.custom_encoding_method)
     class_name = myclass.__class__.__name__ #get the class name
     class_dict = OrderedDict({'__class__':cust_enc_meth()})
     class_dict['__classname__'] = class_name 
     return class_dict
 
+def class_decoder(obj):
+    '''
+    @brief decode a class encoded by class_encoder
+    @param[in] obj - encoded class like {__class__:<encoded data>,__classname__:<name>}
+    @note the class must be registered with register_json_class. Otherwise obj is returned
+    '''
+    decoder = _class_decoders.get(obj.get('__classname__'))
+    if decoder is None:
+        return obj
+    return decoder(obj['__class__'])
+
 def complex_number_encoder(obj):
     '''
     @brief Encode a complex number to json with the format
@@ -335,7 +1913,1008 @@ def complex_number_decoder(obj):
     '''
     nd = obj['__complex_number__']
     return np.array(nd['real'])+1j*np.array(nd['imag'])
+
+def ndarray_encoder(obj):
+    '''
+    @brief Encode an ndarray to json as raw base64 bytes with the format
+        {__ndarray__:<base64 bytes>,dtype:<dtype>,shape:<shape>}  
+    @param[in] obj - ndarray to encode (any non-object dtype, including complex)  
+    @return encoded array dictionary  
+    '''
+    enc = OrderedDict({'__ndarray__':base64.b64encode(np.ascontiguousarray(obj).data).decode('ascii')})
+    enc['dtype'] = obj.dtype.str
+    enc['shape'] = list(obj.shape)
+    return enc
+
+def ndarray_decoder(obj):
+    '''
+    @brief Decode an ndarray from ndarray_encoder  
+    @param[in] obj - encoded array like {__ndarray__:<base64 bytes>,dtype:<dtype>,shape:<shape>}  
+    @return writeable ndarray  
+    '''
+    buf = bytearray(base64.b64decode(obj['__ndarray__'])) #bytearray so the array is writeable
+    return np.frombuffer(buf,dtype=np.dtype(obj['dtype'])).reshape(obj['shape'])
+
+def get_sidecar_dir(fpath):
+    '''
+    @brief get the directory sidecar arrays for a json file are written to  
+    @param[in] fpath - path to the json file  
+    @return path to the sidecar directory (e.g. data/results.json -> data/results_arrays)  
+    '''
+    return os.path.splitext(fpath)[0]+'_arrays'
+
+def sidecar_encoder(obj,sidecar_dir,fname,overwrite=True):
+    '''
+    @brief write an ndarray to a *.npy file and get a reference to it with the format
+        {__ndarray_file__:<sidecar dir name>/<fname>,dtype:<dtype>,shape:<shape>}  
+    @param[in] obj - ndarray to write  
+    @param[in] sidecar_dir - directory to write the array to  
+    @param[in] fname - name of the file in sidecar_dir  
+    @param[in/OPT] overwrite - False to keep an existing file (e.g. when named by its content)  
+    @note the file is written to a temporary file and then renamed so any
+        arrays currently memory mapped from the old file remain valid (on Windows the
+        rename fails while the old file is mapped, see replace_file)  
+    @return sidecar reference dictionary  
+    '''
+    fpath = os.path.join(sidecar_dir,fname)
+    if overwrite or not os.path.exists(fpath):
+        with open(fpath+'.tmp','wb') as npy_file:
+            np.save(npy_file,obj)
+        replace_file(fpath+'.tmp',fpath)
+    ref = OrderedDict({'__ndarray_file__':'{}/{}'.format(os.path.basename(sidecar_dir),fname)})
+    ref['dtype'] = obj.dtype.str
+    ref['shape'] = list(obj.shape)
+    return ref
+
+def sidecar_decoder(obj,sidecar_root=None,mmap_mode=None):
+    '''
+    @brief load an ndarray referenced by sidecar_encoder  
+    @param[in] obj - reference like {__ndarray_file__:<path>,dtype:<dtype>,shape:<shape>}  
+    @param[in/OPT] sidecar_root - directory the path is relative to (default to cwd)  
+    @param[in/OPT] mmap_mode - memory map mode (see np.load). None reads the whole array  
+    @note raises a ValueError if the file does not match the dtype or shape in the reference  
+    @return the (possibly memory mapped) ndarray  
+    '''
+    fpath = obj['__ndarray_file__']
+    if sidecar_root is not None:
+        fpath = os.path.join(sidecar_root,fpath)
+    if not os.path.exists(fpath):
+        raise FileNotFoundError("Sidecar array '{}' not found".format(os.path.abspath(fpath)))
+    arr = np.load(fpath,mmap_mode=mmap_mode)
+    if 'dtype' in obj and arr.dtype!=np.dtype(obj['dtype']):
+        raise ValueError("Sidecar array '{}' has dtype {} but {} was expected".format(
+                            os.path.abspath(fpath),arr.dtype.str,obj['dtype']))
+    if 'shape' in obj and list(arr.shape)!=list(obj['shape']):
+        raise ValueError("Sidecar array '{}' has shape {} but {} was expected".format(
+                            os.path.abspath(fpath),list(arr.shape),list(obj['shape'])))
+    return arr
+
+SIDECAR_FILE_RE = re.compile(r'arr_\w+\.npy(\.tmp)?$') # names written by WJSONEncoder (and partial writes)
+
+def remove_unused_sidecars(sidecar_dir,used):
+    '''
+    @brief remove sidecar array files that are no longer referenced (e.g. after rewriting a file)  
+    @param[in] sidecar_dir - directory the sidecar files were written to  
+    @param[in] used - names of the files in sidecar_dir that are still referenced  
+    @note files that cant be removed (e.g. memory mapped on Windows) are left for the next write.
+        On other systems arrays already memory mapped from a removed file stay valid  
+    @return list of the names of the files that were removed  
+    '''
+    removed = []
+    for fname in os.listdir(sidecar_dir):
+        if fname in used or not SIDECAR_FILE_RE.match(fname):
+            continue
+        try:
+            os.remove(os.path.join(sidecar_dir,fname))
+        except OSError:
+            continue
+        removed.append(fname)
+    return removed
+
+def get_array_hash(obj):
+    '''@brief get a hash of the dtype, shape, and contents of an ndarray'''
+    obj = np.ascontiguousarray(obj)
+    hasher = hashlib.sha1('{}{}'.format(obj.dtype.str,obj.shape).encode())
+    hasher.update(obj.data)
+    return hasher.hexdigest()
+
+def shared_ndarray_decoder(obj,shared_arrays=None):
+    '''
+    @brief decode an array written with WJSONEncoder(dedup_arrays=True). The first copy has the format
+        {__shared_ndarray__:<hash>,value:<array>} and later copies are {__shared_ndarray__:<hash>}  
+    @param[in] obj - encoded shared array dictionary  
+    @param[in/OPT] shared_arrays - {hash:array} already decoded in this file. References
+        can only be decoded after the first copy (e.g. not with LazyWDict or load_paths)  
+    @return read only ndarray shared by all copies  
+    '''
+    key = obj['__shared_ndarray__']
+    if 'value' in obj:
+        arr = np.asarray(obj['value'])
+        arr.flags.writeable = False
+        if shared_arrays is not None:
+            shared_arrays[key] = arr
+        return arr
+    if shared_arrays is None or key not in shared_arrays:
+        raise KeyError("Shared array '{}' referenced before it was decoded. Write with a "
+                       "sidecar_threshold to load deduplicated arrays independently".format(key))
+    return shared_arrays[key]
+
+#decoders for special directives from the first key of an object
+JSON_DIRECTIVE_DECODERS = {
+    '__function__':function_decoder,
+    '__complex_number__':complex_number_decoder,
+    '__ndarray__':ndarray_decoder,
+    '__ndarray_file__':sidecar_decoder,
+    '__shared_ndarray__':shared_ndarray_decoder,
+    '__class__':class_decoder,
+    }
+    
+
+#%% key path queries
+_query_cache = _LRUCache(256) # {query:compiled steps}
+
+def compile_query(query):
+    '''
+    @brief compile a query (see WDict.query) into a tuple of (kind,argument) steps  
+    @param[in] query - path string like 'runs/*/results' or list of path elements  
+    @note compiled queries are cached  
+    @return tuple of steps with kind 'key', 'any', 'deep', or 'pred'  
+    '''
+    key = query if isinstance(query,str) else tuple(query)
+    steps = _query_cache.lookup(key)
+    if steps is None:
+        elements = query.split('/') if isinstance(query,str) else query
+        steps = []
+        for el in elements:
+            if el=='**':
+                steps.append(('deep',None))
+            elif el=='*':
+                steps.append(('any',None))
+            elif callable(el):
+                steps.append(('pred',el))
+            else:
+                steps.append(('key',el))
+        steps = tuple(steps)
+        _query_cache.store(key,steps)
+    return steps
+
+def _iter_query(root,steps,tracked):
+    '''
+    @brief walk the dictionary for compiled query steps  
+    @param[in] root - dictionary to start at  
+    @param[in] steps - steps from compile_query  
+    @param[in/OUT] tracked - [bool] set to [False] if it went through anything changes arent tracked for  
+    @return generator of (key path tuple,value) in key order  
+    '''
+    nsteps = len(steps)
+    stack = [((),root,0)]
+    while stack:
+        path,node,i = stack.pop()
+        if i==nsteps:
+            yield path,node
+            continue
+        if tracked[0] and not (isinstance(node,WDict) and node._cache_paths):
+            tracked[0] = False
+        kind,arg = steps[i]
+        if kind=='key':
+            try:
+                if isinstance(node,WDict) and node._cache_paths:
+                    val,tr = _walk_path(node,(arg,),[]) # follows aliases
+                    if not tr: tracked[0] = False
+                else:
+                    val = node[arg]
+            except (KeyError,IndexError,TypeError):
+                continue
+            stack.append((path+(arg,),val,i+1))
+            continue
+        if not isinstance(node,dict):
+            continue
+        alias_key = getattr(node,'_alias_dict_key',None)
+        children = [(k,v) for k,v in node.items() if k!=alias_key] if kind!='pred' else \
+                   [(k,v) for k,v in node.items() if k!=alias_key and arg(k,v)]
+        if kind=='deep': # go down a level and stay on this step, or go to the next step here
+            stack.extend((path+(k,),v,i) for k,v in reversed(children) if isinstance(v,dict))
+            stack.append((path,node,i+1))
+        else:
+            stack.extend((path+(k,),v,i+1) for k,v in reversed(children))
+
+#%% columnar tables
+def _split_key_path(key_path):
+    '''@brief get a key path tuple from a list or a 'a/b/c' string'''
+    return tuple(key_path.split('/')) if isinstance(key_path,str) else tuple(key_path)
+
+def _get_cell(d,key_path):
+    '''@brief get the value at key_path (following aliases for WDicts) or _MISSING'''
+    try:
+        if isinstance(d,WDict):
+            return d.get_from_path(key_path)
+        return reduce(operator.getitem,key_path,d)
+    except (KeyError,IndexError,TypeError):
+        return _MISSING
+    
+def _cell_dtype(val):
+    '''@brief get the dtype a column needs to hold a scalar value'''
+    if isinstance(val,(bool,int,float,complex,np.generic)):
+        dtype = np.asarray(val).dtype
+        if dtype.kind in 'biufc':
+            return dtype
+    return np.dtype(object)
+
+class _ColumnBuilder:
+    '''@brief typed numpy column that is promoted (e.g. int->float->complex->object) as values are added'''
+    __slots__ = ('data','type_','cell_shape','missing','fill_value')
+    def __init__(self,fill_value):
+        self.data = None
+        self.type_ = None # type of the values that can go straight in
+        self.cell_shape = () # shape of array valued cells
+        self.missing = [] # rows without a value
+        self.fill_value = fill_value
+        
+    def set(self,i,val,capacity):
+        '''@brief set row i. capacity is the number of rows to allocate for'''
+        if val is _MISSING:
+            self.missing.append(i)
+            return
+        if type(val) is list: 
+            val = np.asarray(val)
+        if self.data is None:
+            self._init(val,capacity)
+        elif type(val) is not self.type_ or (self.type_ is np.ndarray and 
+                (val.shape!=self.cell_shape or val.dtype!=self.data.dtype)):
+            self._promote(val)
+        self.data[i] = val
+        
+    def _init(self,val,capacity):
+        if isinstance(val,np.ndarray) and not val.dtype.hasobject:
+            self.cell_shape = val.shape
+            self.data = np.empty((capacity,)+val.shape,dtype=val.dtype)
+            self.type_ = np.ndarray
+        else:
+            self.data = np.empty(capacity,dtype=_cell_dtype(val))
+            self.type_ = None if self.data.dtype.kind=='O' else type(val)
+            
+    def _promote(self,val):
+        '''@brief change the column dtype (or make it an object column) so val fits'''
+        data = self.data
+        if data.dtype.kind=='O': # already holds anything
+            return
+        if self.type_ is np.ndarray or isinstance(val,np.ndarray):
+            if (self.type_ is np.ndarray and isinstance(val,np.ndarray) 
+                    and val.shape==self.cell_shape and not val.dtype.hasobject):
+                dtype = np.result_type(data.dtype,val.dtype)
+                if dtype!=data.dtype:
+                    self.data = data.astype(dtype)
+            else: # arrays of different shapes or mixed with scalars
+                self._to_object()
+            return
+        dtype = _cell_dtype(val)
+        if dtype.kind!='O':
+            dtype = np.result_type(data.dtype,dtype)
+        if dtype!=data.dtype:
+            self.data = data.astype(dtype)
+        self.type_ = None if self.data.dtype.kind=='O' else type(val)
+        
+    def _to_object(self):
+        '''@brief convert to a 1D object column (each cell is its own array)'''
+        data = np.empty(len(self.data),dtype=object)
+        for i in range(len(self.data)):
+            data[i] = self.data[i]
+        self.data = data
+        self.cell_shape = ()
+        self.type_ = None
+        
+    def resize(self,capacity):
+        '''@brief change the number of rows allocated'''
+        if self.data is not None:
+            data = np.empty((capacity,)+self.data.shape[1:],dtype=self.data.dtype)
+            n = min(capacity,len(self.data))
+            data[:n] = self.data[:n]
+            self.data = data
+            
+    def finish(self,nrows):
+        '''@brief get the column with nrows rows with missing values filled'''
+        if self.data is None: # never got a value
+            self.data = np.empty(nrows,dtype=_cell_dtype(self.fill_value))
+            self.data[:] = self.fill_value
+            return self.data
+        data = self.data[:nrows]
+        if self.missing:
+            if data.dtype.kind!='O':
+                dtype = np.result_type(data.dtype,_cell_dtype(self.fill_value))
+                if dtype!=data.dtype:
+                    data = data.astype(dtype)
+            data[self.missing] = self.fill_value
+        return data
+
+def wdicts_to_columns(dicts,key_paths,names=None,nrows=None,fill_value=np.nan):
+    '''
+    @brief get values at key paths from many (W)Dicts as typed numpy columns in a single pass  
+    @param[in] dicts - iterable of dictionaries (e.g. one WDict per run). Can be a generator  
+    @param[in] key_paths - list of key paths (lists of keys or 'a/b/c' strings) to make columns from  
+    @param[in/OPT] names - list of column names. Defaults to the key paths joined with '/'  
+    @param[in/OPT] nrows - number of dictionaries if known (len(dicts) is used if it exists)
+        so the columns are only allocated once. Otherwise the columns grow as needed  
+    @param[in/OPT] fill_value - value for dictionaries without a key path (columns are promoted to hold it)  
+    @note columns have the smallest dtype holding all their values (e.g. int->float->complex).
+        Array (or list) values with the same shape give an (nrows,*shape) column.
+        Anything else (e.g. strings or arrays of different shapes) gives an object column  
+    @return OrderedDict of {name:column array}  
+    '''
+    key_paths = [_split_key_path(kp) for kp in key_paths]
+    if names is None:
+        names = ['/'.join(str(k) for k in kp) for kp in key_paths]
+    if nrows is None and hasattr(dicts,'__len__'):
+        nrows = len(dicts)
+    capacity = nrows if nrows is not None else 1024
+    builders = [_ColumnBuilder(fill_value) for _ in key_paths]
+    i = -1
+    for i,d in enumerate(dicts):
+        if i>=capacity: # grow
+            capacity *= 2
+            for b in builders: b.resize(capacity)
+        for b,kp in zip(builders,key_paths):
+            b.set(i,_get_cell(d,kp),capacity)
+    return OrderedDict((name,b.finish(i+1)) for name,b in zip(names,builders))
+
+def iter_column_chunks(dicts,key_paths,chunk_size=10000,**kwargs):
+    '''
+    @brief stream (W)Dicts into columns chunk_size dictionaries at a time (see wdicts_to_columns)  
+    @param[in] dicts - iterable of dictionaries. Only chunk_size of them are taken at a time  
+    @param[in] key_paths - list of key paths to make columns from  
+    @param[in/OPT] chunk_size - number of dictionaries in each chunk  
+    @param[in/OPT] kwargs - passed to wdicts_to_columns  
+    @note dtypes can differ between chunks (e.g. a later chunk with complex values)  
+    @return generator of OrderedDict {name:column array} for each chunk  
+    '''
+    dict_iter = iter(dicts)
+    while True:
+        chunk = list(itertools.islice(dict_iter,chunk_size))
+        if not chunk:
+            return
+        yield wdicts_to_columns(chunk,key_paths,**kwargs)
+
+#%% thread safety
+class ReadWriteLock:
+    '''
+    @brief lock that any number of readers can hold at once or a single writer. Waiting writers
+        are let in before new readers so updates dont starve. Locks are reentrant within a thread
+        (including reads while holding the write lock), but a read lock cannot be upgraded to a write lock  
+    '''
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0 # number of threads reading
+        self._writer = None # thread id of the writer
+        self._writers_waiting = 0
+        self._local = threading.local() # depth of the locks held by each thread
+        
+    def acquire_read(self):
+        local = self._local
+        depth = getattr(local,'depth',0)
+        if depth: # already reading or writing in this thread
+            local.depth = depth+1
+            return
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        local.depth = 1
+        
+    def release_read(self):
+        local = self._local
+        local.depth -= 1
+        if local.depth or self._writer==threading.get_ident():
+            return
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+                
+    def acquire_write(self):
+        local = self._local
+        depth = getattr(local,'depth',0)
+        if depth:
+            if self._writer!=threading.get_ident():
+                raise RuntimeError('Cannot write while holding a read lock')
+            local.depth = depth+1
+            return
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = threading.get_ident()
+        local.depth = 1
+        
+    def release_write(self):
+        local = self._local
+        local.depth -= 1
+        if local.depth:
+            return
+        with self._cond:
+            self._writer = None
+            self._cond.notify_all()
     
+    @contextmanager
+    def read_locked(self):
+        '''@brief hold the read lock in a with statement'''
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+            
+    @contextmanager
+    def write_locked(self):
+        '''@brief hold the write lock in a with statement'''
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+            
+def _read_locked(fun):
+    '''@brief decorator to call a ThreadSafeWDict method holding the read lock'''
+    @wraps(fun)
+    def locked(self,*args,**kwargs):
+        lock = self._lock
+        lock.acquire_read()
+        try:
+            return fun(self,*args,**kwargs)
+        finally:
+            lock.release_read()
+    return locked
+
+def _write_locked(fun):
+    '''@brief decorator to call a ThreadSafeWDict method holding the write lock'''
+    @wraps(fun)
+    def locked(self,*args,**kwargs):
+        lock = self._lock
+        lock.acquire_write()
+        try:
+            return fun(self,*args,**kwargs)
+        finally:
+            lock.release_write()
+    return locked
+
+def _get_path_uncached(node,key_list):
+    '''@brief get a value from a list of keys following WDict aliases without using or filling any path caches'''
+    for k in key_list:
+        if not isinstance(node,WDict):
+            node = node[k]
+            continue
+        val = dict.get(node,k,_MISSING)
+        if val is _MISSING: # resolve aliases from this node
+            alias_dict = node._alias_dict
+            if alias_dict is None or k not in alias_dict:
+                raise KeyError(k)
+            alias = alias_dict[k]
+            val = _get_path_uncached(node,alias if type(alias) is list or type(alias) is tuple else (alias,))
+        node = val
+    return node
+    
+class ThreadSafeWDict(WDict):
+    '''
+    @brief WDict that can be shared between threads. Reads (d[key], get_from_path, ...) hold a
+        shared read lock so they never wait on each other, while changes (d[key]=value,
+        set_from_path, add_alias, ...) hold an exclusive write lock  
+    @note make all changes through this dictionary (e.g. d[['a','b']] = 1 instead of d['a']['b'] = 1)
+        since nested dictionaries are not locked  
+    @note keys(), values(), and items() return lists copied while holding the lock instead of
+        dictionary views so they can be iterated while other threads make changes. Use d.locked()
+        to hold the lock for a group of operations  
+    @note key paths and queries are not cached (reads would otherwise change the caches
+        while only holding the shared lock)  
+    '''
+    _cache_paths = False
+    
+    def __init__(self,*args,**kwargs):
+        self._lock = ReadWriteLock()
+        super().__init__(*args,**kwargs)
+        
+    def locked(self,write=False):
+        '''
+        @brief hold the lock for a group of operations (e.g. with d.locked(): ...)  
+        @param[in/OPT] write - True to hold the write lock. Otherwise the read lock is held  
+        '''
+        return self._lock.write_locked() if write else self._lock.read_locked()
+    
+    __getitem__ = _read_locked(WDict.__getitem__)
+    
+    @_read_locked
+    def get_from_path(self,key_list,**kwargs):
+        '''@brief like WDict.get_from_path but never caches the path'''
+        return _get_path_uncached(self,key_list)
+    
+    get = _read_locked(WDict.get)
+    __contains__ = _read_locked(WDict.__contains__)
+    query = _read_locked(lambda self,*args,**kwargs: list(WDict.query(self,*args,**kwargs)))
+    query.__doc__ = '''@brief like WDict.query but returns a list of (key path,value) found while holding the lock'''
+    writes = _read_locked(WDict.writes)
+    write = _write_locked(WDict.write) # updates the write state
+    dump = write
+    dumps = writes
+    
+    @_read_locked
+    def keys(self):
+        '''@brief get a list of the keys (not a view, see class notes)'''
+        return list(WDict.keys(self))
+    
+    @_read_locked
+    def values(self):
+        '''@brief get a list of the values (not a view, see class notes)'''
+        return [dict.__getitem__(self,k) for k in WDict.keys(self)]
+    
+    @_read_locked
+    def items(self):
+        '''@brief get a list of (key,value) (not a view, see class notes)'''
+        return [(k,dict.__getitem__(self,k)) for k in WDict.keys(self)]
+    
+    @_read_locked
+    def snapshot(self):
+        '''@brief get a deep copy (as a WDict) to read without holding the lock'''
+        return WDict(copy.deepcopy(list(OrderedDict.items(self))))
+    
+    __setitem__ = _write_locked(WDict.__setitem__)
+    __delitem__ = _write_locked(WDict.__delitem__)
+    set_from_path = _write_locked(WDict.set_from_path)
+    add_alias = _write_locked(WDict.add_alias)
+    pop = _write_locked(WDict.pop)
+    popitem = _write_locked(WDict.popitem)
+    clear = _write_locked(WDict.clear)
+    update = _write_locked(WDict.update)
+    setdefault = _write_locked(WDict.setdefault)
+    move_to_end = _write_locked(WDict.move_to_end)
+    load = _write_locked(WDict.load)
+    loads = _write_locked(WDict.loads)
+    
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_lock',None)
+        return state
+    
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock = ReadWriteLock()
+        
+    # pickle/copy without the lock (see WDict.__reduce__) reading the state and items under the lock
+    __reduce__ = _read_locked(WDict.__reduce__)
+        
+#%% json lines record store
+def _store_key(key):
+    '''@brief check a JSONLinesStore key can be written as json and read back the same (lists become tuples)'''
+    if isinstance(key,(list,tuple)):
+        return tuple(_store_key(k) for k in key)
+    if key is None or isinstance(key,(str,int,float,bool)):
+        return key
+    raise TypeError('Record keys must be str, int, float, bool, None, or tuples of these (not {})'.format(type(key).__name__))
+
+class JSONLinesStore:
+    '''
+    @brief append only store of WDicts (or anything WJSONEncoder can encode) with one json 
+        record per line in fpath. Records are written in batches and a binary index of record
+        offsets (<fpath>.idx, 8 bytes per record) gives random access by record number without
+        reading the file. Records can also be looked up by key (stored in <fpath>.keys)  
+    @param[in] fpath - path to the json lines file (e.g. measurements.jsonl)  
+    @param[in/OPT] mode - 'a' to append (creating the files if needed), 'r' to only read, or
+        'w' to start a new store  
+    @param[in/OPT] batch_size - number of records to keep before writing them  
+    @param[in/OPT] key_path - key path in each record to look records up by (e.g. 'name' or ['meta','id']).
+        Keys can also be given to append()  
+    @param[in/OPT] backend - json library to use (see wjson_dumps)  
+    @param[in/OPT] kwargs - passed to WJSONEncoder (e.g. base64_arrays=True). dedup_arrays only
+        shares arrays within a record so each record can be read on its own  
+    @note keys must be strings, numbers, booleans, None, or tuples of these (lists are converted to tuples)  
+    @note any complete records in fpath that are missing from the index (e.g. after a crash)
+        are indexed again when opened, and a partially written last line is removed  
+    @example
+        with JSONLinesStore('meas.jsonl',key_path='name') as store:
+            store.append(WDict({'name':'run_0','s21':1+1j}))
+        store = JSONLinesStore('meas.jsonl',mode='r')
+        store[0],store.get('run_0'),[r for r in store]
+    '''
+    index_suffix = '.idx'
+    keys_suffix = '.keys'
+    _offset_struct = struct.Struct('<Q')
+    
+    def __init__(self,fpath,mode='a',batch_size=1000,key_path=None,backend='json',**kwargs):
+        if mode not in ('a','r','w'):
+            raise ValueError("mode must be 'a', 'r', or 'w'")
+        self.fpath = os.path.abspath(fpath)
+        self.mode = mode
+        self.batch_size = batch_size
+        self.key_path = None if key_path is None else _split_key_path(key_path)
+        self.backend = backend
+        self._encoder = WJSONEncoder(**kwargs)
+        self._encoder_kwargs = kwargs
+        self._object_hook = partial(WJSONDecoder,sidecar_root=os.path.dirname(self.fpath))
+        self._pending = [] # [(encoded line,key)] not written yet
+        self._keys = None # {key:record number} loaded on first use
+        self._data_file = None; self._index_file = None; self._read_file = None
+        if mode=='w':
+            for suffix in ('',self.index_suffix,self.keys_suffix):
+                if os.path.exists(self.fpath+suffix): os.remove(self.fpath+suffix)
+        elif mode=='r' and not os.path.exists(self.fpath):
+            raise FileNotFoundError("File '{}' not found".format(self.fpath))
+        if mode!='r':
+            open(self.fpath,'ab').close()
+        self._nindexed,self._end = self._recover()
+        
+    def _recover(self):
+        '''@brief index any complete records missing from the index and get (number indexed,end offset)'''
+        if not os.path.exists(self.fpath):
+            return 0,0
+        idx_path = self.fpath+self.index_suffix
+        nindexed = os.path.getsize(idx_path)//8 if os.path.exists(idx_path) else 0
+        size = os.path.getsize(self.fpath)
+        with open(self.fpath,'rb') as data_file:
+            end = 0
+            if nindexed: # end of the last indexed record
+                data_file.seek(self._read_offset(nindexed-1))
+                end = data_file.tell()+len(data_file.readline())
+            if end>=size or self.mode=='r':
+                return nindexed,end
+            data_file.seek(end)
+            offsets = []; keys = []
+            for line in data_file:
+                if not line.endswith(b'\n'): # partially written
+                    break
+                offsets.append(end)
+                if self.key_path is not None:
+                    key = _get_cell(self._decode(line),self.key_path)
+                    keys.append(_MISSING if key is _MISSING or key is None else _store_key(key))
+                end += len(line)
+        with open(self.fpath,'r+b') as data_file:
+            data_file.truncate(end)
+        with open(idx_path,'r+b' if os.path.exists(idx_path) else 'wb') as index_file:
+            index_file.truncate(nindexed*8) # drop any partial offset
+            index_file.seek(0,os.SEEK_END)
+            index_file.write(np.asarray(offsets,dtype='<u8').tobytes())
+        self._write_keys([(k,nindexed+i) for i,k in enumerate(keys) if k is not _MISSING])
+        return nindexed+len(offsets),end
+    
+    def _read_offset(self,i):
+        '''@brief get the byte offset of record i from the index'''
+        if self._index_file is None:
+            self._index_file = open(self.fpath+self.index_suffix,'rb')
+        self._index_file.seek(8*i)
+        return self._offset_struct.unpack(self._index_file.read(8))[0]
+    
+    def _encode(self,record):
+        if self.backend=='json':
+            self._encoder.reset_shared() # each line has to decode on its own
+            return self._encoder.encode(record)
+        return wjson_dumps(record,backend=self.backend,cls=WJSONEncoder,**self._encoder_kwargs)
+    
+    def _decode(self,line):
+        return wjson_loads(line,backend=self.backend,object_hook=partial(self._object_hook,shared_arrays={}))
+    
+    def append(self,record,key=None):
+        '''
+        @brief add a record. Its written once batch_size records are waiting (or on flush/close)  
+        @param[in] record - WDict (or anything WJSONEncoder can encode) to add  
+        @param[in/OPT] key - key to look the record up by. Defaults to the value at key_path  
+        @return record number  
+        '''
+        if self.mode=='r':
+            raise IOError('Store was opened read only')
+        if key is None and self.key_path is not None:
+            key = _get_cell(record,self.key_path)
+            key = None if key is _MISSING else key
+        if key is not None:
+            key = _store_key(key)
+        self._pending.append(((self._encode(record)+'\n').encode(),key))
+        if len(self._pending)>=self.batch_size:
+            self.flush()
+        return len(self)-1
+    
+    def extend(self,records):
+        '''@brief add many records'''
+        for record in records:
+            self.append(record)
+    
+    def flush(self):
+        '''@brief write waiting records, then their offsets and keys'''
+        if not self._pending:
+            return
+        if self._data_file is None:
+            self._data_file = open(self.fpath,'ab')
+        lines = [line for line,_ in self._pending]
+        offsets = np.cumsum([self._end]+[len(line) for line in lines[:-1]],dtype='<u8')
+        self._data_file.write(b''.join(lines))
+        self._data_file.flush() # data before the index so the index never points past it
+        with open(self.fpath+self.index_suffix,'ab') as index_file:
+            index_file.write(offsets.tobytes())
+        keys = [(k,self._nindexed+i) for i,(_,k) in enumerate(self._pending) if k is not None]
+        self._write_keys(keys)
+        if self._keys is not None:
+            self._keys.update(keys)
+        self._end += sum(len(line) for line in lines)
+        self._nindexed += len(lines)
+        self._pending = []
+        
+    def _write_keys(self,keys):
+        '''@brief append [key,record number] lines to the keys file'''
+        if keys:
+            with open(self.fpath+self.keys_suffix,'a') as keys_file:
+                keys_file.write(''.join(json.dumps([k,i])+'\n' for k,i in keys))
+                
+    def _load_keys(self):
+        '''@brief load the {key:record number} lookup'''
+        self._keys = {}
+        keys_path = self.fpath+self.keys_suffix
+        if os.path.exists(keys_path):
+            with open(keys_path,'r') as keys_file:
+                for line in keys_file:
+                    if line.endswith('\n'):
+                        k,i = json.loads(line)
+                        if i<self._nindexed: # ignore keys of records that were never indexed
+                            self._keys[_store_key(k)] = i
+        self._keys.update((k,self._nindexed+i) for i,(_,k) in enumerate(self._pending) if k is not None)
+        return self._keys
+    
+    def __len__(self):
+        return self._nindexed+len(self._pending)
+    
+    def __getitem__(self,i):
+        '''@brief get record number i (negative numbers count from the end)'''
+        n = len(self)
+        if i<0: i += n
+        if not 0<=i<n:
+            raise IndexError('Record {} out of range for {} records'.format(i,n))
+        if i>=self._nindexed:
+            return self._decode(self._pending[i-self._nindexed][0])
+        if self._read_file is None:
+            self._read_file = open(self.fpath,'rb')
+        self._read_file.seek(self._read_offset(i))
+        return self._decode(self._read_file.readline())
+        
+    def get(self,key,default=None):
+        '''@brief get the record for a key (the last one if a key was added more than once)'''
+        keys = self._keys if self._keys is not None else self._load_keys()
+        i = keys.get(key)
+        return default if i is None else self[i]
+    
+    def keys(self):
+        '''@brief get the keys of the records'''
+        return (self._keys if self._keys is not None else self._load_keys()).keys()
+    
+    def __iter__(self):
+        return self.iter_records()
+        
+    def iter_records(self,start=0,stop=None):
+        '''
+        @brief stream decoded records without loading the whole file  
+        @param[in/OPT] start - first record number  
+        @param[in/OPT] stop - record number to stop before (default all)  
+        @return generator of records  
+        '''
+        stop = len(self) if stop is None else min(stop,len(self))
+        i = start
+        if i<min(stop,self._nindexed):
+            with open(self.fpath,'rb') as data_file:
+                data_file.seek(self._read_offset(i))
+                for line in data_file:
+                    if i>=min(stop,self._nindexed): break
+                    yield self._decode(line)
+                    i += 1
+        for line,_ in self._pending[i-self._nindexed:stop-self._nindexed]:
+            yield self._decode(line)
+        
+    def close(self):
+        '''@brief write any waiting records and close the files'''
+        self.flush()
+        for f in (self._data_file,self._index_file,self._read_file):
+            if f is not None: f.close()
+        self._data_file = None; self._index_file = None; self._read_file = None
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*args):
+        self.close()
+        
+#%% compact records
+class WRecord(Mapping):
+    '''
+    @brief base class for fixed key records made by compile_record_class. Values are
+        stored in __slots__ so there is no per record dictionary. Supports dictionary 
+        access (d[key], d[[key1,key2]], get_from_path, aliases of the schema) and json
+        encoding/decoding with WJSONEncoder/WJSONDecoder. Keys cannot be added or removed  
+    '''
+    __slots__ = ()
+    _keys = () # keys of the schema in order
+    _slot_of = {} # {key:slot name}
+    _aliases = {} # {alias:key path} for the schema
+    
+    def __getitem__(self,key):
+        try:
+            return getattr(self,self._slot_of[key])
+        except (KeyError,TypeError): # not a key or unhashable
+            if isinstance(key,(list,tuple)):
+                return self.get_from_path(key)
+            alias = self._aliases.get(key) if key.__hash__ is not None else None
+            if alias is None:
+                raise KeyError(key)
+            return self.get_from_path(alias)
+    
+    def __setitem__(self,key,value):
+        if isinstance(key,(list,tuple)) and key not in self:
+            return self.set_from_path(key,value)
+        try:
+            setattr(self,self._slot_of[key],value)
+        except KeyError:
+            raise KeyError("'{}' is not in the record keys {}".format(key,list(self._keys)))
+            
+    def get_from_path(self,key_list,**kwargs):
+        '''@brief get a value from a list of keys (like WDict.get_from_path)'''
+        return reduce(operator.getitem,key_list,self)
+    
+    def set_from_path(self,key_list,value,**kwargs):
+        '''@brief set a value at a list of keys. Only existing keys can be set in this record'''
+        if len(key_list)==1:
+            self[key_list[0]] = value
+        else:
+            self.get_from_path(key_list[:-1])[key_list[-1]] = value
+        
+    def __iter__(self):
+        return iter(self._keys)
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def __contains__(self,key):
+        try:
+            return key in self._slot_of
+        except TypeError:
+            return False
+        
+    def __eq__(self,other):
+        if not isinstance(other,Mapping):
+            return NotImplemented
+        return len(self)==len(other) and all(k in other and _values_equal(v,other[k]) for k,v in self.items())
+    
+    __hash__ = None
+        
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,', '.join('{!r}: {!r}'.format(k,v) for k,v in self.items()))
+    
+    def __reduce__(self):
+        return (_make_record,(self._keys,type(self).__name__,self._aliases,tuple(self.values())))
+    
+    def to_wdict(self):
+        '''@brief get the record as a WDict'''
+        return WDict(self.items())
+    
+    @classmethod
+    def from_dict(cls,mydict):
+        '''@brief make a record from a dictionary with (some of) the keys of the schema'''
+        extra = [k for k in mydict if k not in cls._slot_of]
+        if extra:
+            raise KeyError('{} are not in the record keys {}'.format(extra,list(cls._keys)))
+        return cls(*[mydict.get(k) for k in cls._keys])
+    
+    def _encode_json_(self):
+        return OrderedDict(self.items())
+
+def _values_equal(a,b):
+    '''@brief compare values that may be arrays'''
+    if isinstance(a,np.ndarray) or isinstance(b,np.ndarray):
+        return np.array_equal(a,b)
+    return a==b
+
+_record_classes = {} # {name:record class}
+
+def compile_record_class(keys,name=None,aliases=None):
+    '''
+    @brief make (or get the already made) record class for a fixed set of keys  
+    @param[in] keys - list of keys in order  
+    @param[in/OPT] name - class name. Used to decode it from json so it must be unique
+        for each schema (default Record_<hash of the keys and aliases>)  
+    @param[in/OPT] aliases - {alias:key or key path} like WDict.add_alias for all records  
+    @note the class constructor takes the values in key order (missing ones are None).
+        Use cls.from_dict() to make one from a dictionary  
+    @return WRecord subclass  
+    @note raises a ValueError if name is already used by a record class with different keys or aliases  
+    @example
+        Run = compile_record_class(['freq','s21','params'],name='Run')
+        run = Run(1e9,0.5+1j,{'power':0})
+        run['s21'],run[['params','power']]
+    '''
+    keys = tuple(keys)
+    if len(set(keys))!=len(keys):
+        raise ValueError('Record keys must be unique')
+    aliases = tuple((k,tuple(v) if isinstance(v,(list,tuple)) else (v,)) for k,v in (aliases or {}).items())
+    if name is None:
+        name = 'Record_'+hashlib.sha1(repr((keys,aliases)).encode()).hexdigest()[:10]
+    cls = _record_classes.get(name)
+    if cls is not None:
+        if cls._keys!=keys or cls._aliases!=dict(aliases):
+            raise ValueError("Record class '{}' already exists with keys {} and aliases {}".format(name,cls._keys,cls._aliases))
+        return cls
+    slots = tuple('_v{}'.format(i) for i in range(len(keys)))
+    args = ','.join('a{}=None'.format(i) for i in range(len(keys)))
+    body = ''.join('\n    self.{}=a{}'.format(s,i) for i,s in enumerate(slots)) or '\n    pass'
+    namespace = {}
+    exec('def __init__(self,{}):{}'.format(args,body),namespace) # generated so construction is just slot stores
+    cls = type(name,(WRecord,),{'__slots__':slots,'__init__':namespace['__init__'],'__module__':__name__,'_keys':keys,
+                                 '_slot_of':dict(zip(keys,slots)),'_aliases':dict(aliases)})
+    register_json_class(cls,name=name,decoder=cls.from_dict)
+    _record_classes[name] = cls
+    return cls
+
+def _make_record(keys,name,aliases,values):
+    '''@brief unpickle a record'''
+    return compile_record_class(keys,name=name,aliases=dict(aliases))(*values)
+
+@register_json_class
+class RecordBatch:
+    '''
+    @brief many fixed key records stored as one numpy column per key (see wdicts_to_columns).
+        batch[i] gives record i, batch[key] gives a whole column  
+    @param[in/OPT] keys - list of keys of the records  
+    @param[in/OPT] columns - {key:column array} with the same number of rows  
+    @param[in/OPT] name - name of the record class for rows (see compile_record_class)  
+    @param[in/OPT] aliases - aliases of the record class for rows (see compile_record_class)  
+    '''
+    def __init__(self,keys=(),columns=None,name=None,aliases=None):
+        self.keys = tuple(keys)
+        self.name = name
+        self.aliases = dict(aliases or {})
+        self.columns = OrderedDict((k,np.asarray(columns[k])) for k in self.keys) if columns else OrderedDict()
+        self._record_class = None
+        
+    @classmethod
+    def from_records(cls,records,keys=None,name=None,**kwargs):
+        '''
+        @brief build a batch from an iterable of records or dictionaries in one pass  
+        @param[in] records - iterable of WRecords or dictionaries  
+        @param[in/OPT] keys - keys to store (default the keys of the first record)  
+        @param[in/OPT] name - record class name (default the first record's if its a WRecord with these keys)  
+        @param[in/OPT] kwargs - passed to wdicts_to_columns (e.g. nrows,fill_value)  
+        '''
+        aliases = None
+        if keys is None or name is None:
+            records = iter(records)
+            first = next(records,None)
+            if first is not None:
+                records = itertools.chain([first],records)
+                if keys is None: keys = list(first.keys())
+                if name is None and isinstance(first,WRecord) and tuple(keys)==first._keys: 
+                    name,aliases = type(first).__name__,first._aliases
+        keys = list(keys or [])
+        columns = wdicts_to_columns(records,[[k] for k in keys],names=keys,**kwargs)
+        return cls(keys,columns,name=name,aliases=aliases)
+    
+    @property
+    def record_class(self):
+        '''@brief record class for rows of this batch'''
+        if self._record_class is None:
+            self._record_class = compile_record_class(self.keys,name=self.name,aliases=self.aliases)
+        return self._record_class
+    
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+    
+    def __getitem__(self,item):
+        if isinstance(item,(int,np.integer)):
+            return self.record_class(*[col[item] for col in self.columns.values()])
+        if isinstance(item,(list,tuple)): # path starting with an index or column
+            return reduce(operator.getitem,item[1:],self[item[0]])
+        return self.columns[item]
+    
+    def __iter__(self):
+        cls = self.record_class
+        for vals in zip(*self.columns.values()):
+            yield cls(*vals)
+            
+    def _encode_json_(self):
+        return OrderedDict([('keys',list(self.keys)),('name',self.name),
+                            ('aliases',{k:list(v) for k,v in self.aliases.items()}),('columns',self.columns)])
+    
+    def _decode_json_(self,data):
+        self.__init__(data['keys'],data['columns'],name=data.get('name'),aliases=data.get('aliases'))
 
 import unittest
 class TestWDict(unittest.TestCase):
@@ -354,6 +2933,268 @@ class TestWDict(unittest.TestCase):
         myd[[3,'test',5]] = 'xyz'
         self.assertEqual(myd[3]['test'][5],'xyz')
         
+    def test_update_nested_dict(self):
+        '''@brief test merging nested dictionaries'''
+        import copy
+        base = WDict({'a':1,'sub':WDict({'x':1,'deep':{'y':1}})})
+        add1 = {'a':2,'b':2,'sub':{'deep':{'z':2},'w':{'q':2}}}
+        add2 = {'b':3,'sub':{'x':3,'deep':{'z':3}},'c':{'only':3}}
+        out = update_nested_dict(copy.deepcopy(base),add1,add2)
+        self.assertEqual({'a':1,'b':2,'c':{'only':3},'sub':{'x':1,'deep':{'y':1,'z':2},'w':{'q':2}}},out)
+        self.assertIs(add1['sub']['w'],out[['sub','w']]) # shared
+        out = update_nested_dict(copy.deepcopy(base),add1,add2,overwrite_values=True)
+        self.assertEqual({'a':2,'b':3,'c':{'only':3},'sub':{'x':3,'deep':{'y':1,'z':3},'w':{'q':2}}},out)
+        out = update_nested_dict(copy.deepcopy(base),add1,add2,policy=lambda kp,old,new:old+new)
+        self.assertEqual([3,5,4,5],[out['a'],out['b'],out[['sub','x']],out[['sub','deep','z']]])
+        with self.assertRaisesRegex(ValueError,"'sub', 'deep', 'z'"):
+            update_nested_dict({},{'sub':add1['sub']},{'sub':add2['sub']},policy='error')
+        self.assertEqual({'a':1},update_nested_dict({'a':1},{'a':1},policy='error'))
+        out = update_nested_dict({},add1,share=False)
+        self.assertEqual(add1,out)
+        self.assertIsNot(add1['sub']['w'],out['sub']['w'])
+        from collections import defaultdict
+        dd = defaultdict(list,{'x':1})
+        out = update_nested_dict({},{'d':dd},share=False)
+        self.assertIsNot(dd,out['d'])
+        self.assertEqual([],out['d']['missing']) # default_factory kept
+        out = update_nested_dict({},{'d':dd},{'d':{'y':2}}) # shared then copied on write
+        self.assertEqual([],out['d']['missing'])
+        self.assertEqual({'x':1},dict(dd))
+        # new dictionary with shared subtrees. Inputs unchanged
+        merged = merge_nested_dicts(base,add1,add2)
+        self.assertEqual({'x':1,'deep':{'y':1}},base['sub'])
+        self.assertEqual({'deep':{'z':2},'w':{'q':2}},add1['sub'])
+        self.assertIs(add2['c'],merged['c'])
+        self.assertIsInstance(merged,WDict)
+        self.assertIsInstance(merged['sub'],WDict)
+        # very deep
+        deep = {}; d = deep
+        for i in range(5000): d['n'] = {}; d = d['n']
+        d['leaf'] = 1
+        out = update_nested_dict({'n':{'n':{'other':2}}},deep,share=False)
+        self.assertEqual(2,out['n']['n']['other'])
+        self.assertEqual(1,reduce(operator.getitem,['n']*5000+['leaf'],out))
+        
+    def test_query(self):
+        '''@brief test wildcard queries'''
+        myd = WDict()
+        for i in range(4):
+            myd[['runs','run_{}'.format(i)]] = WDict({'params':WDict({'power':i-1}),'results':WDict({'s21':i,'s11':-i})})
+        myd.add_alias('r0',['runs','run_0'])
+        self.assertEqual([(('runs','run_{}'.format(i),'results','s21'),i) for i in range(4)],list(myd.query('runs/*/results/s21')))
+        self.assertEqual([0,1,2,3],[v for _,v in myd.query('runs/*/results/s21')]) #from the index
+        self.assertEqual([(('r0','results','s11'),0)],list(myd.query('r0/results/s11'))) #aliases
+        self.assertEqual([2,3],[v for _,v in myd.query(['runs',lambda k,v: v['params']['power']>0,'results','s21'])])
+        self.assertEqual(4,len(list(myd.query('**/s11'))))
+        self.assertEqual(8,len(list(myd.query(['**',lambda k,v: k.startswith('s')]))))
+        self.assertEqual([],list(myd.query('runs/*/missing')))
+        # changes are seen after the index is built
+        myd[['runs','run_1','results','s21']] = 10
+        self.assertEqual([0,10,2,3],[v for _,v in myd.query('runs/*/results/s21')])
+        myd[['runs','run_4']] = WDict({'results':WDict({'s21':4})})
+        self.assertEqual([0,10,2,3,4],[v for _,v in myd.query('runs/*/results/s21')])
+        self.assertIs(compile_query('runs/*/results/s21'),compile_query('runs/*/results/s21'))
+        
+    def test_columns(self):
+        '''@brief test flattening dictionaries to columns'''
+        runs = [WDict({'params':{'power':i},'results':{'s21':i+1j*i,'trace':np.arange(3)*i},'name':'run_{}'.format(i)})
+                for i in range(5)]
+        runs[2]['params']['power'] = 2.5
+        del runs[3]['results']['trace']
+        runs[4].add_alias('p',['params','power'])
+        cols = wdicts_to_columns(runs,['params/power',['results','s21'],'results/trace','name','missing'])
+        self.assertEqual(['params/power','results/s21','results/trace','name','missing'],list(cols.keys()))
+        np.testing.assert_array_equal([0,1,2.5,3,4],cols['params/power'])
+        self.assertEqual(np.complex128,cols['results/s21'].dtype)
+        self.assertEqual((5,3),cols['results/trace'].shape)
+        self.assertTrue(np.isnan(cols['results/trace'][3]).all())
+        np.testing.assert_array_equal(np.arange(3)*4,cols['results/trace'][4])
+        self.assertEqual(object,cols['name'].dtype)
+        self.assertTrue(np.isnan(cols['missing']).all())
+        self.assertEqual([4],list(wdicts_to_columns(runs[4:],['p'],names=['power'])['power'])) #aliases
+        # unknown length and chunks
+        gen_cols = wdicts_to_columns((r for r in runs*500),['params/power','results/s21'])
+        np.testing.assert_array_equal(np.tile(cols['params/power'],500),gen_cols['params/power'])
+        chunks = list(iter_column_chunks(iter(runs),['params/power','name'],chunk_size=2))
+        self.assertEqual([2,2,1],[len(c['name']) for c in chunks])
+        np.testing.assert_array_equal(cols['params/power'],np.concatenate([c['params/power'] for c in chunks]))
+        
+    def test_records(self):
+        '''@brief test compiled record classes and record batches'''
+        import sys,pickle
+        Run = compile_record_class(['freq','s21','params'],name='TestRun',aliases={'power':['params','power']})
+        self.assertIs(Run,compile_record_class(['freq','s21','params'],name='TestRun',aliases={'power':['params','power']}))
+        with self.assertRaises(ValueError): # a name is one schema
+            compile_record_class(['freq','s21','params'],name='TestRun')
+        # default names depend on the aliases too
+        Plain = compile_record_class(['freq','s21','params'])
+        Aliased = compile_record_class(['freq','s21','params'],aliases={'power':['params','power']})
+        self.assertNotEqual(Plain.__name__,Aliased.__name__)
+        myd = WDict(); myd.loads(WDict({'plain':Plain(1.,1j,None),'aliased':Aliased(1.,1j,WDict({'power':3}))}).dumps())
+        self.assertIsInstance(myd['plain'],Plain)
+        self.assertEqual(3,myd['aliased']['power'])
+        run = Run(1e9,0.5+1j,WDict({'power':-10}))
+        self.assertEqual(0.5+1j,run['s21'])
+        self.assertEqual(-10,run[['params','power']])
+        self.assertEqual(-10,run['power'])
+        run[['params','power']] = 0
+        run['freq'] = 2e9
+        self.assertEqual({'freq':2e9,'s21':0.5+1j,'params':{'power':0}},run)
+        with self.assertRaises(KeyError): run['other'] = 1
+        with self.assertRaises(KeyError): run['other']
+        self.assertFalse(hasattr(run,'__dict__'))
+        wd = run.to_wdict()
+        self.assertLess(sys.getsizeof(run),sys.getsizeof(wd)+sys.getsizeof(wd.__dict__))
+        self.assertEqual(run,pickle.loads(pickle.dumps(run)))
+        # json in a WDict
+        myd = WDict({'runs':[Run(float(i),i*1j,WDict({'power':i})) for i in range(3)]})
+        myd2 = WDict(); myd2.loads(myd.dumps())
+        self.assertIsInstance(myd2['runs'][1],Run)
+        self.assertEqual(1j,myd2['runs'][1]['s21'])
+        self.assertEqual(2,myd2[['runs',2,'power']])
+        # batches
+        batch = RecordBatch.from_records(myd['runs'])
+        self.assertEqual(3,len(batch))
+        np.testing.assert_array_equal([0,1j,2j],batch['s21'])
+        self.assertEqual(myd['runs'][2],batch[2])
+        self.assertIsInstance(batch[0],Run)
+        self.assertEqual(1.,batch[[1,'freq']])
+        myd3 = WDict(); myd3.loads(WDict({'batch':batch}).dumps(base64_arrays=True))
+        np.testing.assert_array_equal(batch['s21'],myd3['batch']['s21'])
+        self.assertEqual([r['freq'] for r in batch],[r['freq'] for r in myd3['batch']])
+        self.assertEqual(1,myd3['batch'][1]['power'])
+        self.assertEqual(['freq'],list(RecordBatch.from_records(myd['runs'],keys=['freq'])[0].keys())) # other keys make their own class
+        
+    def test_jsonl_store(self):
+        '''@brief test the json lines record store'''
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir,'meas.jsonl')
+            with JSONLinesStore(fpath,batch_size=100,key_path='name',base64_arrays=True) as store:
+                for i in range(250):
+                    store.append(WDict({'name':'run_{}'.format(i),'i':i,'vals':np.arange(3)*i}))
+                self.assertEqual(250,len(store))
+                self.assertEqual(200,store._nindexed)
+                self.assertEqual(249,store[-1]['i']) #not written yet
+                self.assertEqual(5,store.get('run_5')['i'])
+            self.assertEqual(250*8,os.path.getsize(fpath+'.idx'))
+            store = JSONLinesStore(fpath,mode='r')
+            self.assertEqual(250,len(store))
+            self.assertIsInstance(store[123],WDict)
+            np.testing.assert_array_equal(np.arange(3)*123,store[123]['vals'])
+            self.assertEqual(77,store.get('run_77')['i'])
+            self.assertEqual(list(range(250)),[r['i'] for r in store])
+            self.assertEqual([10,11],[r['i'] for r in store.iter_records(10,12)])
+            # crash recovery: missing index entries and a partial last line
+            with open(fpath+'.idx','r+b') as f: f.truncate(240*8)
+            with open(fpath,'ab') as f: f.write(b'{"name": "run_')
+            store = JSONLinesStore(fpath,key_path='name')
+            self.assertEqual(250,len(store))
+            self.assertEqual(245,store.get('run_245')['i'])
+            store.append({'name':'new','i':-1}); store.close()
+            self.assertEqual(-1,JSONLinesStore(fpath,mode='r')[250]['i'])
+            # shared arrays and keys that arent strings
+            arr = np.arange(10.)
+            with JSONLinesStore(fpath,mode='w',dedup_arrays=True) as store:
+                store.append({'a':arr,'b':arr},key=('run',0))
+                store.append({'a':arr},key=['run',1])
+                with self.assertRaises(TypeError):
+                    store.append({},key={'bad':1})
+            store = JSONLinesStore(fpath,mode='r')
+            np.testing.assert_array_equal(arr,store[1]['a'])
+            rec = store[0]
+            self.assertIs(rec['a'],rec['b']) # shared within a record
+            self.assertEqual([('run',0),('run',1)],list(store.keys()))
+            self.assertEqual(1,store.get(('run',1))['a'][1])
+            
+    def test_thread_safe(self):
+        '''@brief test sharing a ThreadSafeWDict between reader and writer threads'''
+        import threading,time,copy
+        # readers dont block each other, writers wait for readers
+        lock = ReadWriteLock()
+        lock.acquire_read()
+        got = []
+        t = threading.Thread(target=lambda: (lock.acquire_read(),got.append('read'),lock.release_read()))
+        t.start(); t.join(1)
+        self.assertEqual(['read'],got)
+        t = threading.Thread(target=lambda: (lock.acquire_write(),got.append('write'),lock.release_write()))
+        t.start(); time.sleep(0.05)
+        self.assertEqual(['read'],got)
+        lock.release_read(); t.join(1)
+        self.assertEqual(['read','write'],got)
+        with lock.read_locked():
+            with self.assertRaises(RuntimeError):
+                lock.acquire_write()
+        # concurrent use
+        myd = ThreadSafeWDict({'config':{'a':0}})
+        errors = []; done = threading.Event()
+        def writer():
+            try:
+                for i in range(500):
+                    myd.set_from_path(['runs','run_{}'.format(i),'val'],i)
+                    myd.add_alias('last',['runs','run_{}'.format(i)])
+                    myd[['config','a']] = i
+            except Exception as e: errors.append(e)
+            finally: done.set()
+        def reader():
+            try:
+                while not done.is_set():
+                    last = myd.get('last')
+                    if last is not None: 
+                        self.assertEqual(last['val'],myd[['runs','run_{}'.format(last['val']),'val']])
+                    for k,v in myd.items(): pass
+                    myd[['config','a']]
+            except Exception as e: errors.append(e)
+        threads = [threading.Thread(target=reader) for _ in range(4)]+[threading.Thread(target=writer)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual([],errors)
+        self.assertEqual(499,myd['last']['val'])
+        self.assertEqual(500,len(myd['runs']))
+        # reads dont change any caches
+        myd['nested'] = WDict({'run':WDict({'val':3})})
+        myd['nested']['run'].add_alias('v','val')
+        myd.add_alias('nv',['nested','run','v'])
+        self.assertEqual(3,myd['nv'])
+        self.assertEqual(3,myd[['nested','run','v']])
+        self.assertEqual([3],[v for _,v in myd.query('nested/run/v')])
+        self.assertIsNone(myd._path_cache)
+        self.assertIsNone(myd['nested']._path_deps)
+        self.assertIsNone(myd['nested']['run']._path_deps)
+        with myd.locked(): # write needs the write lock
+            with self.assertRaises(RuntimeError):
+                myd.write(os.devnull)
+        myd2 = copy.deepcopy(myd)
+        self.assertIsInstance(myd2,ThreadSafeWDict)
+        myd2['x'] = 1
+        self.assertEqual(499,myd.snapshot()[['config','a']])
+        # nested thread safe dictionaries get their own locks
+        import pickle
+        myd['inner'] = ThreadSafeWDict({'v':WDict({'w':1})})
+        for myd2 in [copy.deepcopy(myd),pickle.loads(pickle.dumps(myd)),myd.snapshot()]:
+            with self.subTest(type=type(myd2).__name__):
+                self.assertIsInstance(myd2['inner'],ThreadSafeWDict)
+                self.assertIsNot(myd['inner']._lock,myd2['inner']._lock)
+                self.assertEqual(1,myd2[['inner','v','w']])
+                myd2[['inner','v','w']] = 2
+                self.assertEqual(1,myd[['inner','v','w']])
+        
+    def test_rst(self):
+        '''@brief test ReStructuredText output'''
+        import tempfile
+        myd = WDict({'freq':1e9,'sweep':WDict({'start':1,'stop':WDict({'val':2})}),'name':'a\nb'})
+        expected = ['- **freq** - 1000000000.0','','- **sweep** -','','  - **start** - 1','','  - **stop** -','',
+                    '    - **val** - 2','','- **Name** - ab']
+        self.assertEqual('\n'.join(expected),myd.get_rst_str(alt_names={'name':'Name'}))
+        lines = myd.iter_rst_lines(parse_functs={float:lambda v: '{:g} Hz'.format(v)})
+        self.assertEqual('- **freq** - 1e+09 Hz',next(lines))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = myd.write_rst(os.path.join(tmpdir,'params.rst'),alt_names={'name':'Name'})
+            with open(fpath) as f: self.assertEqual('\n'.join(expected)+'\n',f.read())
+        deep = WDict(); cur = deep
+        for i in range(3000): cur['n'] = WDict(); cur = cur['n']
+        self.assertEqual(2*3000-1,len(list(deep.iter_rst_lines())))
+        
     def test_ed_basic(self):
         '''@brief test encode/decode basic data from string'''
         #test basic dictionary
@@ -374,6 +3215,62 @@ class TestWDict(unittest.TestCase):
         mydl.loads(myd.dumps())
         self.assertEqual(foo(4,5),mydl['3']['test']['5'](4,5)) #make sure the function was decoded
         
+    def test_ed_registry(self):
+        '''@brief test registered class decoders and type encoders'''
+        @register_json_class
+        class MyPoint:
+            def __init__(self,x=0,y=0):
+                self.x = x; self.y = y
+            def _encode_json_(self):
+                return {'x':self.x,'y':self.y}
+            def _decode_json_(self,data):
+                self.x = data['x']; self.y = data['y']
+        class Unregistered(MyPoint): pass
+        class Celsius(float): pass
+        register_json_encoder(Celsius,lambda obj: {'celsius':float(obj)})
+        myd = WDict({'p':MyPoint(1,2),'u':Unregistered(3,4),'t':Celsius(5),'i':np.int32(6)})
+        myd.add_alias('pt','p')
+        mystr = myd.dumps()
+        self.assertIn(MyPoint,[k for k in WJSONEncoder._dispatch_cache.keys()])
+        mydl = WDict()
+        mydl.loads(mystr)
+        self.assertIsInstance(mydl['p'],MyPoint)
+        self.assertEqual((1,2),(mydl['p'].x,mydl['p'].y))
+        self.assertEqual({'x':3,'y':4},mydl[['u','__class__']]) #not registered so left as is
+        self.assertEqual(6,mydl['i'])
+        # nested aliases are restored
+        mydl = WDict(); mydl.loads(WDict({'n':myd}).dumps())
+        self.assertIs(mydl[['n','p']],mydl[['n','pt']])
+        
+    def test_function_cache(self):
+        '''@brief test caching of compiled functions and function sources'''
+        import tempfile
+        def foo(a,b):
+            return a*b
+        mystr = WDict({'f':foo}).dumps()
+        clear_function_cache()
+        f1 = WDict(); f1.loads(mystr)
+        self.assertEqual(1,len(_function_code_cache))
+        f2 = WDict(); f2.loads(mystr)
+        self.assertEqual(1,len(_function_code_cache))
+        self.assertIs(f1['f'].__code__,f2['f'].__code__) #compiled once
+        self.assertEqual(mystr,f1.dumps()) #decoded functions can be encoded again
+        with tempfile.TemporaryDirectory() as tmpdir:
+            set_function_cache(maxsize=1,cache_dir=tmpdir)
+            try:
+                clear_function_cache()
+                f1.loads(mystr)
+                self.assertEqual(1,len(os.listdir(tmpdir)))
+                clear_function_cache()
+                f1.loads(mystr) #now from the disk
+                self.assertEqual(12,f1['f'](3,4))
+                def bar(a):
+                    return a
+                f1.loads(WDict({'g':bar}).dumps())
+                self.assertEqual(1,len(_function_code_cache)) #foo was evicted
+            finally:
+                set_function_cache()
+        
     def test_ed_complex_number(self):
         '''@brief test encode/decode of complex number(s) from string'''
         myd = WDict({'test1':'test2','3':{'test':{'5':complex(1,0)},'t2':complex(3.2,4.1)}})
@@ -389,11 +3286,761 @@ class TestWDict(unittest.TestCase):
         mydl.loads(myd.dumps())
         self.assertTrue(np.all(vals_a==mydl['3']['test']['5']))
         self.assertTrue(np.all(vals_b==mydl['3']['t2']))
+        
+    def test_ed_sidecar(self):
+        '''@brief test writing large arrays to sidecar files and memory mapping them on load'''
+        import tempfile
+        big = np.random.rand(1000)+1j*np.random.rand(1000)
+        small = np.arange(5)
+        myd = WDict({'big':big,'nest':{'small':small,'big2':np.arange(2000.)}})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir,'test.json')
+            myd.write(fpath,sidecar_threshold=1000)
+            self.assertEqual(len(os.listdir(get_sidecar_dir(fpath))),2)
+            mydl = WDict()
+            mydl.load(fpath)
+            self.assertIsInstance(mydl['big'],np.memmap)
+            self.assertTrue(np.all(big==mydl['big']))
+            self.assertTrue(np.all(np.arange(2000.)==mydl['nest']['big2']))
+            self.assertEqual(list(small),mydl['nest']['small']) #small arrays stay in the json
+            # rewriting over memory mapped arrays should not change the loaded values
+            myd['big'] = np.zeros(1000)
+            myd.write(fpath,sidecar_threshold=1000)
+            self.assertTrue(np.all(big==mydl['big']))
+            del mydl
+            # files that are no longer referenced are removed
+            WDict({'big':big,'small':small}).write(fpath,sidecar_threshold=1000)
+            self.assertEqual(['arr_{}.npy'.format(get_array_hash(big))],os.listdir(get_sidecar_dir(fpath)))
+            WDict({'small':small}).write(fpath,sidecar_threshold=1000,dedup_arrays=True)
+            self.assertEqual([],os.listdir(get_sidecar_dir(fpath)))
+            # a failed write leaves the old json and its sidecar files as they were
+            WDict({'big':big}).write(fpath,sidecar_threshold=1000)
+            with self.assertRaises(TypeError):
+                WDict({'big':np.zeros_like(big),'bad':object()}).write(fpath,sidecar_threshold=1000)
+            mydl = WDict(); mydl.load(fpath)
+            np.testing.assert_array_equal(big,mydl['big'])
+            del mydl
+            # files that dont match the reference
+            big_path = os.path.join(get_sidecar_dir(fpath),'arr_{}.npy'.format(get_array_hash(big)))
+            np.save(big_path,np.zeros(10,dtype=big.dtype))
+            with self.assertRaisesRegex(ValueError,'shape'):
+                WDict().load(fpath)
+            np.save(big_path,np.zeros(1000))
+            with self.assertRaisesRegex(ValueError,'dtype'):
+                WDict().load(fpath)
+            
+    def test_ed_base64(self):
+        '''@brief test encode/decode of base64 typed arrays from string'''
+        vals = {'f8':np.random.rand(10,3),'c16':np.random.rand(7)+1j*np.random.rand(7),
+                'i2':np.arange(12,dtype=np.int16).reshape(3,4)[:,::2],'empty':np.zeros((0,4))}
+        myd = WDict({'test1':'test2','3':{'vals':vals},'scalar':complex(1,2)})
+        mystr = myd.dumps(base64_arrays=True)
+        self.assertNotIn('__complex_number__',mystr.split('scalar')[0]) #arrays shouldnt be split
+        mydl = WDict()
+        mydl.loads(mystr)
+        for k,v in vals.items():
+            with self.subTest(k=k):
+                vl = mydl[['3','vals',k]]
+                self.assertEqual(v.dtype,vl.dtype)
+                self.assertEqual(v.shape,vl.shape)
+                self.assertTrue(np.all(v==vl))
+        self.assertEqual(complex(1,2),mydl['scalar'])
+        mydl[['3','vals','f8']][0,0] = 5 #make sure its writeable
+        
+    def test_ed_dedup(self):
+        '''@brief test writing equal arrays only once'''
+        import tempfile
+        freqs = np.linspace(1e9,2e9,1001)
+        myd = WDict({'run_{}'.format(i):{'freqs':freqs.copy(),'s21':np.arange(3)+i} for i in range(20)})
+        myd['other'] = [freqs,np.arange(3)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for kwargs in [{},{'base64_arrays':True},{'sidecar_threshold':1000}]:
+                with self.subTest(**kwargs):
+                    fpath = os.path.join(tmpdir,'dedup.json')
+                    myd.write(fpath,dedup_arrays=True,**kwargs)
+                    full_path = os.path.join(tmpdir,'full.json')
+                    myd.write(full_path,**kwargs)
+                    def get_size(fp): #json and sidecar files
+                        sdir = get_sidecar_dir(fp)
+                        files = [os.path.join(sdir,f) for f in os.listdir(sdir)] if os.path.exists(sdir) else []
+                        return sum(os.path.getsize(f) for f in files+[fp])
+                    if 'sidecar_threshold' in kwargs: #equal sidecar arrays always share a file
+                        self.assertEqual(1,len(os.listdir(get_sidecar_dir(full_path))))
+                    else:
+                        self.assertLess(get_size(fpath),get_size(full_path)/5)
+                    for backend in ['json','fast']:
+                        myd2 = WDict(); myd2.load(fpath,backend=backend)
+                        self.assertIs(myd2[['run_0','freqs']],myd2[['run_19','freqs']])
+                        self.assertIs(myd2[['run_0','s21']],myd2['other'][1])
+                        self.assertFalse(myd2[['run_0','freqs']].flags.writeable)
+                        np.testing.assert_array_equal(freqs,myd2[['run_5','freqs']])
+                        np.testing.assert_array_equal(np.arange(3)+5,myd2[['run_5','s21']])
+            self.assertEqual(1,len(os.listdir(get_sidecar_dir(fpath)))) #one file for all the freqs
+            # lazily loaded shared arrays are freed when the values using them are evicted
+            import gc
+            mydl = LazyWDict(); mydl.load(fpath,max_cache_bytes=1)
+            shared = mydl._lazy_kwargs['object_hook'].keywords['shared_arrays']
+            self.assertIs(mydl[['run_0','freqs']],mydl[['run_1','freqs']])
+            mydl['run_2']; gc.collect() # only the current value is kept
+            self.assertEqual(2,len(shared)) # freqs file and run_2 s21
+            del mydl; gc.collect()
+            self.assertEqual(0,len(shared))
+            # content named files that are no longer used are removed
+            old_files = os.listdir(get_sidecar_dir(fpath))
+            WDict({'freqs':freqs*2}).write(fpath,dedup_arrays=True,sidecar_threshold=1000)
+            new_files = os.listdir(get_sidecar_dir(fpath))
+            self.assertEqual(1,len(new_files))
+            self.assertNotEqual(old_files,new_files)
+            
+    def test_backends(self):
+        '''@brief test encode/decode with the json backends and dictionary types'''
+        def foo(a,b):
+            return a+b
+        myd = WDict({'a':{'b':{'c':1,'i':np.int64(3)},'arr':np.arange(4.),'c':np.arange(2)*1j},'f':foo})
+        for backend in ['json','fast']:
+            for b64 in [False,True]:
+                with self.subTest(backend=backend,base64_arrays=b64):
+                    mystr = myd.dumps(backend=backend,base64_arrays=b64)
+                    for dict_type in [None,dict]:
+                        mydl = WDict()
+                        mydl.loads(mystr,backend=backend,dict_type=dict_type)
+                        self.assertIs(WDict if dict_type is None else dict,type(mydl['a']))
+                        self.assertEqual(3,mydl[['a','b','i']])
+                        self.assertTrue(np.all(myd['a']['arr']==mydl['a']['arr']))
+                        self.assertTrue(np.all(myd['a']['c']==mydl['a']['c']))
+                        self.assertEqual(3,mydl['f'](1,2))
+        with self.assertRaises(ValueError):
+            myd.dumps(backend='notabackend')
+            
+    def test_copy(self):
+        '''@brief test copying and pickling nested WDicts without their caches or change tracking'''
+        import copy,pickle
+        myd = WDict({'a':WDict({'b':WDict({'c':1})})})
+        myd.add_alias('ab',['a','b'])
+        self.assertEqual(1,myd[['ab','c']]) #fill the path cache
+        myd['a']['b']['c'] = 2 #and the change tracking
+        for myd2 in [copy.deepcopy(myd),pickle.loads(pickle.dumps(myd)),copy.copy(myd)]:
+            with self.subTest(myd2=myd2):
+                self.assertEqual(myd,myd2)
+                self.assertIsInstance(myd2['a']['b'],WDict)
+                self.assertEqual(2,myd2[['ab','c']])
+        myd2 = copy.deepcopy(myd)
+        myd2[['a','b','c']] = 3
+        self.assertEqual(2,myd[['ab','c']])
+        self.assertEqual(3,myd2[['ab','c']])
+        
+    def test_skip_unchanged(self):
+        '''@brief test tracking changes and skipping unchanged writes'''
+        import tempfile
+        myd = WDict({'a':{'b':1}})
+        myd.loads(WDict({'n':{'m':{'o':1}}}).dumps()) #nested WDicts
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir,'test.json')
+            def written(**kwargs):
+                from unittest import mock
+                with mock.patch.object(sys.modules[__name__],'atomic_open',wraps=atomic_open) as ao:
+                    myd.write(fpath,**kwargs)
+                return ao.called
+            self.assertIsNone(myd['n']['m']._parents) #not tracked until needed
+            self.assertTrue(written())
+            self.assertTrue(myd.is_modified(fpath)) #untracked writes arent recorded
+            self.assertTrue(written(skip_unchanged=True))
+            self.assertFalse(myd.is_modified(fpath))
+            self.assertFalse(written(skip_unchanged=True))
+            myd['n']['m']['o'] = 2 #nested change
+            self.assertTrue(myd.is_modified(fpath))
+            self.assertTrue(written(skip_unchanged=True))
+            myd['n'].pop('m')
+            self.assertTrue(written(skip_unchanged=True))
+            self.assertEqual(None,myd['n'].pop('m',None)) #nothing removed
+            self.assertFalse(written(skip_unchanged=True))
+            os.utime(fpath,ns=(0,0)) #changed by something else
+            self.assertTrue(written(skip_unchanged=True))
+            myd[['a','b']] = 3 #change through a plain dict
+            self.assertTrue(written(skip_unchanged=True))
+            myd['a']['b'] = 4 #untracked, but caught by hashing
+            self.assertFalse(written(skip_unchanged=True))
+            self.assertTrue(written(skip_unchanged='hash'))
+            self.assertFalse(written(skip_unchanged='hash'))
+            self.assertTrue(written()) #default always writes
+            mydl = WDict(); mydl.load(fpath)
+            self.assertEqual(4,mydl[['a','b']])
+            self.assertEqual(['test.json'],os.listdir(tmpdir)) #no temp files left
+            # failed writes shouldnt touch the file
+            myd['bad'] = object()
+            with self.assertRaises(TypeError):
+                myd.write(fpath)
+            self.assertEqual(['test.json'],os.listdir(tmpdir))
+            mydl.load(fpath)
+            self.assertNotIn('bad',mydl)
+            # target in use (e.g. memory mapped on windows)
+            from unittest import mock
+            del myd['bad']
+            with mock.patch('os.replace',side_effect=[PermissionError(),None]) as rep:
+                myd.write(fpath)
+            self.assertEqual(2,rep.call_count)
+            with mock.patch('os.replace',side_effect=PermissionError()):
+                with self.assertRaisesRegex(PermissionError,'memory mapped'):
+                    replace_file(fpath,fpath,retries=2,delay=0)
+            
+    def test_journal(self):
+        '''@brief test journaling, replaying, and compacting changes'''
+        import tempfile
+        myd = WDict(); myd.loads(WDict({'a':{'b':{'c':1}},'p':{'q':1},'arr':np.arange(3)}).dumps())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir,'test.json')
+            jpath = get_journal_path(fpath)
+            myd.open_journal(fpath,base64_arrays=True)
+            myd['a']['b']['c'] = 2 #nested change
+            myd['plain'] = {'q':1}
+            myd[['plain','r']] = 3 #through a plain dict
+            myd['new'] = WDict({'x':1})
+            myd['new']['y'] = np.arange(4)+1j
+            del myd['arr']
+            myd['a'].pop('zz',None) #doesnt exist so nothing to journal
+            myd['a']['b'].clear()
+            myd['a']['b']['d'] = 5
+            myd.add_alias('ali',['a','b'])
+            with open(jpath) as journal_file:
+                self.assertEqual(10,len(journal_file.readlines()))
+            with open(jpath,'a') as journal_file:
+                journal_file.write('{"op":"set","path":["partial"') #crashed while writing
+            mydl = WDict(); mydl.load(fpath)
+            self.assertEqual(5,mydl[['ali','d']])
+            self.assertEqual({'d':5},mydl[['a','b']])
+            self.assertEqual(3,mydl[['plain','r']])
+            self.assertTrue(np.all(mydl[['new','y']]==myd[['new','y']]))
+            self.assertNotIn('arr',mydl)
+            self.assertNotIn('partial',mydl)
+            myd.write(fpath) #compact
+            self.assertEqual(0,os.path.getsize(jpath))
+            mydl2 = WDict(); mydl2.load(fpath)
+            self.assertEqual(mydl[['a','b']],mydl2[['a','b']])
+            # compact automatically
+            myd.open_journal(fpath,max_records=2)
+            myd['k1'] = 1
+            self.assertEqual(1,myd._journal.nrecords)
+            myd['k2'] = 2
+            self.assertEqual(0,os.path.getsize(jpath))
+            myd.close_journal()
+            myd['k3'] = 3
+            self.assertEqual(0,os.path.getsize(jpath))
+            mydl3 = WDict(); mydl3.load(fpath)
+            self.assertEqual(2,mydl3['k2'])
+            # moved dictionaries are journaled at their new key and only journaled trees look for journals
+            other = WDict({'sub':WDict({'v':1})})
+            self.assertFalse(other['sub']._journaled)
+            myd.open_journal(fpath)
+            sub = myd['a']['b']
+            del myd['a']['b']
+            myd['moved'] = sub
+            sub['e'] = 6
+            myd['a']['b2'] = sub # in two places
+            sub['f'] = 7
+            mydl4 = WDict(); mydl4.load(fpath)
+            self.assertEqual({'d':5,'e':6,'f':7},mydl4['moved'])
+            self.assertEqual({'d':5,'e':6,'f':7},mydl4[['a','b2']])
+            self.assertNotIn('b',mydl4['a'])
+            # writing another dictionary to the same path keeps a journal that is still open
+            WDict({'x':1}).write(fpath)
+            self.assertTrue(os.path.exists(jpath))
+            myd.close_journal()
+            WDict({'x':1}).write(fpath)
+            self.assertFalse(os.path.exists(jpath))
+            
+    def test_compression(self):
+        '''@brief test writing and loading compressed files'''
+        import tempfile
+        myd = WDict({'a':{'b':list(range(100))},'c':np.arange(5)*1j})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for ext in ['.json']+['.json'+e for e in COMPRESSION_TYPES.keys()]:
+                for backend in ['json','fast']:
+                    with self.subTest(ext=ext,backend=backend):
+                        fpath = os.path.join(tmpdir,'test'+ext)
+                        myd.write(fpath,backend=backend)
+                        with open(fpath,'rb') as raw_file:
+                            self.assertEqual(ext=='.json',raw_file.read(1)==b'{')
+                        mydl = WDict(); mydl.load(fpath,backend=backend)
+                        self.assertEqual(myd['a'],mydl['a'])
+                        self.assertTrue(np.all(myd['c']==mydl['c']))
+                        myd.write(fpath,skip_unchanged='hash')
+            with self.assertRaises(ValueError):
+                LazyWDict().load(fpath)
+            
+    def test_sharded(self):
+        '''@brief test sharded directory storage'''
+        import tempfile
+        myd = WDict(); myd.loads(WDict({'run_{}'.format(i):{'vals':list(range(50)),'i':i} for i in range(5)}).dumps())
+        myd['scalar'] = 3
+        myd.add_alias('first',['run_0','i'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dpath = os.path.join(tmpdir,'store')
+            store = ShardedWDict(myd)
+            store.write(dpath)
+            self.assertEqual({store._shard_fname(k) for k in ['run_{}'.format(i) for i in range(5)]+['scalar']},
+                             set(os.listdir(os.path.join(dpath,'shards'))))
+            self.assertEqual({'manifest.json','shards'},set(os.listdir(dpath)))
+            with self.assertRaisesRegex(TypeError,'strings'):
+                ShardedWDict({1:'a'}).write(os.path.join(tmpdir,'bad'))
+            self.assertFalse(os.path.exists(os.path.join(tmpdir,'bad')))
+            shd = ShardedWDict(); shd.load(dpath,max_cache_bytes=500)
+            self.assertEqual(list(myd.keys()),list(shd.keys()))
+            self.assertFalse(shd.is_decoded('run_0'))
+            self.assertEqual(0,shd['first'])
+            self.assertEqual(myd[['run_1','vals']],shd[['run_1','vals']])
+            shd['run_0']['i'] = 10 #changed then evicted so it is written back
+            for k in ['run_2','run_3','run_4']:
+                shd[k]
+            self.assertFalse(shd.is_decoded('run_0'))
+            mtimes = {f:os.stat(os.path.join(dpath,'shards',f)).st_mtime_ns for f in os.listdir(os.path.join(dpath,'shards'))}
+            shd[['new','x']] = 1
+            del shd['scalar']
+            shd.write()
+            changed = [f for f in os.listdir(os.path.join(dpath,'shards')) if mtimes.get(f)!=os.stat(os.path.join(dpath,'shards',f)).st_mtime_ns]
+            self.assertEqual(1,len(changed)) #only the new shard
+            self.assertEqual(6,len(os.listdir(os.path.join(dpath,'shards'))))
+            shd2 = ShardedWDict(); shd2.load(dpath)
+            self.assertEqual(10,shd2['first'])
+            self.assertEqual(1,shd2[['new','x']])
+            self.assertNotIn('scalar',shd2)
+            # save to a new directory
+            shd2.write(os.path.join(tmpdir,'store2'))
+            shd3 = ShardedWDict(); shd3.load(os.path.join(tmpdir,'store2'))
+            self.assertEqual(shd2,shd3)
+            
+    def test_lazy_load(self):
+        '''@brief test lazy loading and eviction of values from a file'''
+        import tempfile
+        myd = WDict({'a':{'b':{'c':1,'s':'x,}]{["\\"'},'arr':[[1,2],[3,4]]},
+                     'big':list(range(100)),'cplx':complex(1,2),'str':'a"b','none':None})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir,'test.json')
+            myd.write(fpath)
+            mydl = LazyWDict()
+            mydl.load(fpath,max_cache_bytes=100)
+            self.assertEqual(list(myd.keys()),list(mydl.keys()))
+            self.assertFalse(any(mydl.is_decoded(k) for k in mydl.keys()))
+            self.assertEqual(myd[['a','b','s']],mydl[['a','b','s']])
+            self.assertTrue(mydl.is_decoded('a'))
+            self.assertEqual(1+2j,mydl['cplx'])
+            self.assertEqual(myd['big'],mydl['big']) #evicts 'a'
+            self.assertFalse(mydl.is_decoded('a'))
+            mydl[['a','b','c']] = 5 #set values shouldnt be evicted
+            mydl['big']
+            self.assertEqual(5,mydl[['a','b','c']])
+            # now index the second level too
+            mydl2 = LazyWDict()
+            mydl2.load(fpath,lazy_depth=2)
+            self.assertIsInstance(mydl2['a'],LazyWDict)
+            self.assertFalse(mydl2['a'].is_decoded('b'))
+            self.assertEqual(1,mydl2['a']['b']['c'])
+            self.assertEqual(1+2j,mydl2['cplx']) #directives arent indexed
+            self.assertEqual(myd,mydl2)
+            
+    def test_load_paths(self):
+        '''@brief test loading only select paths from a file'''
+        import tempfile
+        myd = WDict({'a':{'b':{'c':1,'d':[1,2]}},'e':np.arange(3)+1j,'f':'g'})
+        myd.add_alias('ali',['a','b'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir,'test.json')
+            myd.write(fpath)
+            mydl = WDict().load_paths(fpath,[['a','b','d'],'e',('ali','c')])
+            self.assertEqual(['a','e'],list(mydl.keys())) # aliases are stored at their real key
+            self.assertEqual([1,2],mydl[['a','b','d']])
+            self.assertEqual(['d','c'],list(mydl['a']['b'].keys()))
+            self.assertTrue(np.all(myd['e']==mydl['e']))
+            self.assertEqual(1,mydl[['a','b','c']])
+            with self.assertRaises(KeyError):
+                WDict().load_paths(fpath,[['a','x']])
+            # through json lists
+            WDict({'a':[{'b':1},{'b':[2,{'c':'x,]'}]},[]],'n':[]}).write(fpath)
+            mydl = WDict().load_paths(fpath,[['a',0,'b'],['a',1,'b',-1,'c']])
+            self.assertEqual(1,mydl['a',0,'b'])
+            self.assertEqual('x,]',mydl['a',1,'b',1,'c'])
+            with self.assertRaises(IndexError):
+                WDict().load_paths(fpath,[['a',2,0]])
+            with self.assertRaises(TypeError):
+                WDict().load_paths(fpath,[['a','b']])
+            with self.assertRaises(TypeError):
+                WDict().load_paths(fpath,[['a',0,'b','c']])
+            self.assertEqual(0,len(index_json_array(b'[ ]')))
+            self.assertEqual([(1,2),(3,8)],index_json_array(b'[1,[2,3]]'))
+                
+    def test_path_cache(self):
+        '''@brief test caching and invalidation of resolved paths and aliases'''
+        myd = WDict({'a':WDict({'b':WDict({'c':1}),'p':{'q':2}}),'l':[WDict({'x':3})]})
+        myd.add_alias('ali',['a','b'])
+        myd['a'].add_alias('bb','b')
+        self.assertEqual(1,myd[['a','b','c']])
+        self.assertEqual(1,myd[['ali','c']])
+        self.assertEqual(1,myd[['a','bb','c']])
+        self.assertIn(('a','b','c'),myd._path_cache)
+        # changes in nested dicts should invalidate
+        myd['a']['b']['c'] = 4
+        self.assertEqual(4,myd[['a','b','c']])
+        self.assertEqual(4,myd[['ali','c']])
+        myd['a']['b'] = WDict({'c':5})
+        self.assertEqual(5,myd[['a','bb','c']])
+        self.assertEqual(5,myd['ali']['c'])
+        del myd['a']['b']
+        with self.assertRaises(KeyError):
+            myd[['a','b','c']]
+        myd['a']['b'] = WDict({'c':6})
+        self.assertEqual(6,myd[['ali','c']])
+        myd['ali'] = 'real' #real keys take precedence over aliases
+        self.assertEqual('real',myd['ali'])
+        # untracked containers are not cached
+        self.assertEqual(2,myd[['a','p','q']])
+        myd['a']['p']['q'] = 7
+        self.assertEqual(7,myd[['a','p','q']])
+        self.assertEqual(3,myd[['l',0,'x']])
+        myd['l'][0] = WDict({'x':8})
+        self.assertEqual(8,myd[['l',0,'x']])
+        self.assertNotIn(('a','p','q'),myd._path_cache)
+        myd['a'].clear()
+        with self.assertRaises(KeyError):
+            myd[['a','b','c']]
+        
+#%% benchmarking
+
+def benchmark_array_encoding(shape=(1000,1000),complex_=True,nrep=3):
+    '''
+    @brief compare json size and encode/decode time of list and base64 ndarray encoding  
+    @param[in/OPT] shape - shape of the array to encode  
+    @param[in/OPT] complex_ - use a complex array  
+    @param[in/OPT] nrep - number of repetitions to take the best time from  
+    @return dictionary of {encoding:{'bytes':,'dumps_s':,'loads_s':}}  
+    '''
+    vals = np.random.rand(*shape)
+    if complex_: vals = vals+1j*np.random.rand(*shape)
+    myd = WDict({'vals':vals})
+    results = {}
+    for name,kw in {'list':{},'base64':{'base64_arrays':True}}.items():
+        dump_times = []; load_times = []
+        for _ in range(nrep):
+            t0 = time.perf_counter()
+            mystr = myd.dumps(indent=None,**kw)
+            dump_times.append(time.perf_counter()-t0)
+            t0 = time.perf_counter()
+            WDict().loads(mystr)
+            load_times.append(time.perf_counter()-t0)
+        results[name] = {'bytes':len(mystr),'dumps_s':min(dump_times),'loads_s':min(load_times)}
+        print('{:>8}: {:12d} bytes, dumps {:8.4f} s, loads {:8.4f} s'.format(
+            name,len(mystr),min(dump_times),min(load_times)))
+    return results
+    
+def benchmark_json_backends(nkeys=2000,nrep=3):
+    '''
+    @brief compare parse time and peak memory of the json backends and dictionary types  
+    @param[in/OPT] nkeys - number of nested result dictionaries to decode  
+    @param[in/OPT] nrep - number of repetitions to take the best time from  
+    @return dictionary of {(backend,dict_type):{'loads_s':,'peak_bytes':}}  
+    '''
+    import tracemalloc
+    myd = WDict({'run_{}'.format(i):{'params':{'a':i,'b':'text','c':[1.,2.,3.]},
+                                     'results':{'x':list(np.random.rand(10)),'flag':True}}
+                 for i in range(nkeys)})
+    mystr = myd.dumps(indent=None)
+    results = {}
+    for backend in ['json','fast']:
+        for dict_type in [None,dict]:
+            times = []
+            for _ in range(nrep):
+                t0 = time.perf_counter()
+                WDict().loads(mystr,backend=backend,dict_type=dict_type)
+                times.append(time.perf_counter()-t0)
+            tracemalloc.start()
+            mydl = WDict(); mydl.loads(mystr,backend=backend,dict_type=dict_type)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop(); del mydl
+            name = '{} ({})'.format(_resolve_backend(backend),'WDict' if dict_type is None else dict_type.__name__)
+            results[(backend,dict_type)] = {'loads_s':min(times),'peak_bytes':peak}
+            print('{:>16}: loads {:8.4f} s, peak {:12d} bytes'.format(name,min(times),peak))
+    return results
+    
+def benchmark_encoder_dispatch(nvals=20000,nrep=3):
+    '''
+    @brief compare WJSONEncoder against the previous isinstance/hasattr chain on a
+        dictionary of many numpy scalars and small arrays  
+    @param[in/OPT] nvals - number of numpy scalars and arrays in the dictionary  
+    @param[in/OPT] nrep - number of repetitions to take the best time from  
+    @return dictionary of {encoder:seconds}  
+    '''
+    class ChainEncoder(json.JSONEncoder):
+        '''@brief the previous encoder walking the full chain for every object'''
+        def default(self,obj):
+            if isinstance(obj,np.ndarray): return obj.tolist()
+            if isinstance(obj,bytes): return obj.decode()
+            if np.iscomplexobj(obj): return complex_number_encoder(obj)
+            elif isinstance(obj,np.generic): return obj.item()
+            elif hasattr(obj,WJSONEncoder.custom_encoding_method): return class_encoder(obj)
+            elif callable(obj): return function_encoder(obj)
+            else: return super().default(obj)
+    myd = WDict({'v_{}'.format(i):{'i':np.int64(i),'f':np.float32(i),'c':np.complex128(i),
+                                   'a':np.arange(3)} for i in range(nvals)})
+    results = {}
+    for name,cls in {'chain':ChainEncoder,'dispatch':WJSONEncoder}.items():
+        times = []
+        for _ in range(nrep):
+            t0 = time.perf_counter()
+            json.dumps(myd,cls=cls)
+            times.append(time.perf_counter()-t0)
+        results[name] = min(times)
+        print('{:>10}: dumps {:8.4f} s'.format(name,min(times)))
+    return results
+    
+def benchmark_compression(nkeys=200,nrep=1):
+    '''
+    @brief compare bytes on disk and save/load time of the compressed file types  
+    @param[in/OPT] nkeys - number of nested result dictionaries to write  
+    @param[in/OPT] nrep - number of repetitions to take the best time from  
+    @return dictionary of {extension:{'bytes':,'write_s':,'load_s':}}  
+    '''
+    import tempfile
+    myd = WDict({'run_{}'.format(i):{'freqs':np.linspace(1e9,40e9,501),'s21':np.round(np.random.rand(501),4),
+                                     'params':{'a':i,'b':'text'}} for i in range(nkeys)})
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for ext in ['.json']+['.json'+e for e in COMPRESSION_TYPES.keys()]:
+            fpath = os.path.join(tmpdir,'bench'+ext)
+            write_times = []; load_times = []
+            for _ in range(nrep):
+                t0 = time.perf_counter()
+                myd.write(fpath)
+                write_times.append(time.perf_counter()-t0)
+                t0 = time.perf_counter()
+                WDict().load(fpath)
+                load_times.append(time.perf_counter()-t0)
+            results[ext] = {'bytes':os.path.getsize(fpath),'write_s':min(write_times),'load_s':min(load_times)}
+            print('{:>10}: {:12d} bytes, write {:8.4f} s, load {:8.4f} s'.format(
+                ext,results[ext]['bytes'],min(write_times),min(load_times)))
+    return results
+    
+def benchmark_path_access(depth=4,nreads=100000):
+    '''
+    @brief time repeated nested path and alias lookups with and without the path cache  
+    @param[in/OPT] depth - depth of the nested dictionaries  
+    @param[in/OPT] nreads - number of lookups to time  
+    @return dictionary of {lookup:seconds}  
+    '''
+    keys = ['level_{}'.format(i) for i in range(depth)]
+    myd = WDict()
+    myd.set_from_path(keys,1)
+    cur = myd #make all the levels WDicts so the paths can be cached
+    for k in keys[:-1]:
+        cur[k] = WDict(cur[k]); cur = cur[k]
+    myd.add_alias('ali',keys)
+    lookups = {
+        'reduce getitem':lambda: reduce(operator.getitem,keys,myd),
+        'path (cached)':lambda: myd[keys],
+        'alias (cached)':lambda: myd['ali'],
+        }
+    results = {}
+    for name,fun in lookups.items():
+        t0 = time.perf_counter()
+        for _ in range(nreads): fun()
+        results[name] = time.perf_counter()-t0
+        print('{:>16}: {:8.4f} s for {} reads'.format(name,results[name],nreads))
+    return results
+
+def benchmark_nested_merge(width=20,depth=3,deep=500,nmerge=3,nrep=3):
+    '''
+    @brief time merging wide and deep config trees against the previous recursive merge  
+    @param[in/OPT] width - keys at each level of the wide tree (width**depth leaves)  
+    @param[in/OPT] depth - depth of the wide tree  
+    @param[in/OPT] deep - depth of the deep (single chain) tree  
+    @param[in/OPT] nmerge - number of dictionaries to merge  
+    @param[in/OPT] nrep - number of repetitions to take the best time from  
+    @return dictionary of {(tree,method):seconds}  
+    '''
+    def recursive_merge(dict_update,dict_to_add): #previous implementation (without printing)
+        for k,v in dict_to_add.items():
+            if k in dict_update.keys():
+                if type(v) is dict and type(dict_update[k]) is dict:
+                    recursive_merge(dict_update[k],v)
+            else:
+                dict_update[k] = v
+    def make_wide(d,i):
+        return {'k{}'.format(j):(make_wide(d-1,i) if d>1 else i*j) for j in range(width) if d>1 or j%nmerge==i}
+    def make_deep(i):
+        root = {}; cur = root
+        for _ in range(deep): cur['n'] = {'v{}'.format(i):i}; cur = cur['n']
+        return root
+    trees = {'wide':lambda: [make_wide(depth,i) for i in range(nmerge)],
+             'deep':lambda: [make_deep(i) for i in range(nmerge)]}
+    methods = { # merge into the first dictionary
+        'recursive':lambda ds: [recursive_merge(ds[0],d) for d in ds[1:]],
+        'iterative':lambda ds: [update_nested_dict(ds[0],d) for d in ds[1:]],
+        'n-way':lambda ds: update_nested_dict(*ds),
+        'n-way copy':lambda ds: update_nested_dict(*ds,share=False),
+        }
+    results = {}
+    for tree,make_tree in trees.items():
+        for name,fun in methods.items():
+            times = []
+            for _ in range(nrep):
+                ds = make_tree() # merging changes the inputs
+                t0 = time.perf_counter()
+                fun(ds)
+                times.append(time.perf_counter()-t0)
+            results[(tree,name)] = min(times)
+            print('{:>5} {:>12}: {:8.4f} s'.format(tree,name,min(times)))
+    return results
+
+def benchmark_query(nruns=2000,nrep=20):
+    '''
+    @brief time a wildcard query against nested loops over items()  
+    @param[in/OPT] nruns - number of runs in the dictionary  
+    @param[in/OPT] nrep - number of times to repeat the query  
+    @return dictionary of {method:seconds}  
+    '''
+    myd = WDict()
+    runs = WDict({'run_{}'.format(i):WDict({'params':WDict({'a':i}),'results':WDict({'s21':i,'s11':-i})})
+                  for i in range(nruns)})
+    myd['runs'] = runs
+    def loops():
+        return [(('runs',k,'results','s21'),v['results']['s21']) for k,v in myd['runs'].items() if 's21' in v['results']]
+    methods = {
+        'nested loops':loops,
+        'query':lambda: list(myd.query('runs/*/results/s21',use_index=False)),
+        'query (index)':lambda: list(myd.query('runs/*/results/s21')),
+        }
+    results = {}
+    for name,fun in methods.items():
+        t0 = time.perf_counter()
+        for _ in range(nrep): fun()
+        results[name] = time.perf_counter()-t0
+        print('{:>14}: {:8.4f} s for {} queries'.format(name,results[name],nrep))
+    return results
+
+def benchmark_columns(nruns=20000):
+    '''
+    @brief time flattening many result dictionaries to columns against building lists per key  
+    @param[in/OPT] nruns - number of dictionaries  
+    @return dictionary of {method:seconds}  
+    '''
+    runs = [WDict({'params':WDict({'power':float(i)}),'results':WDict({'s21':i+1j,'trace':np.arange(8)*i})})
+            for i in range(nruns)]
+    paths = ['params/power','results/s21','results/trace']
+    def loops():
+        cols = {p:[] for p in paths}
+        for r in runs:
+            for p in paths:
+                cols[p].append(r.get_from_path(p.split('/')))
+        return {p:np.array(v) for p,v in cols.items()}
+    methods = {
+        'loops':loops,
+        'columns':lambda: wdicts_to_columns(runs,paths),
+        'columns (stream)':lambda: wdicts_to_columns((r for r in runs),paths),
+        }
+    results = {}
+    for name,fun in methods.items():
+        t0 = time.perf_counter()
+        fun()
+        results[name] = time.perf_counter()-t0
+        print('{:>16}: {:8.4f} s for {} dictionaries'.format(name,results[name],nruns))
+    return results
+
+def benchmark_records(nrecords=100000):
+    '''
+    @brief compare construction time and memory of WDicts, compiled records, and a record batch  
+    @param[in/OPT] nrecords - number of records  
+    @return dictionary of {method:{'seconds':,'bytes':}}  
+    '''
+    import tracemalloc
+    keys = ['freq','s21','power','name']
+    Rec = compile_record_class(keys,name='BenchmarkRecord')
+    makers = {
+        'WDict':lambda: [WDict(zip(keys,(float(i),i*1j,-10,'run'))) for i in range(nrecords)],
+        'record':lambda: [Rec(float(i),i*1j,-10,'run') for i in range(nrecords)],
+        'batch':lambda: RecordBatch.from_records((Rec(float(i),i*1j,-10,'run') for i in range(nrecords)),nrows=nrecords),
+        }
+    results = {}
+    for name,fun in makers.items():
+        t0 = time.perf_counter()
+        fun()
+        seconds = time.perf_counter()-t0
+        tracemalloc.start()
+        out = fun()
+        nbytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop(); del out
+        results[name] = {'seconds':seconds,'bytes':nbytes}
+        print('{:>8}: {:8.4f} s, {:12d} bytes for {} records'.format(name,seconds,nbytes,nrecords))
+    return results
+
+def benchmark_jsonl_store(nrecords=100000,nreads=10000):
+    '''
+    @brief time appending records to a JSONLinesStore and reading them back  
+    @param[in/OPT] nrecords - number of records to append  
+    @param[in/OPT] nreads - number of random record reads  
+    @return dictionary of {operation:seconds}  
+    '''
+    import tempfile
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fpath = os.path.join(tmpdir,'bench.jsonl')
+        t0 = time.perf_counter()
+        with JSONLinesStore(fpath,batch_size=1000,key_path='name') as store:
+            for i in range(nrecords):
+                store.append(WDict({'name':'run_{}'.format(i),'freq':float(i),'s21':[1.,2.,3.]}))
+        results['append'] = time.perf_counter()-t0
+        store = JSONLinesStore(fpath,mode='r')
+        idx = np.random.randint(0,nrecords,nreads)
+        t0 = time.perf_counter()
+        for i in idx: store[int(i)]
+        results['random read'] = time.perf_counter()-t0
+        t0 = time.perf_counter()
+        for i in idx: store.get('run_{}'.format(i))
+        results['key read'] = time.perf_counter()-t0
+        t0 = time.perf_counter()
+        for r in store: pass
+        results['stream'] = time.perf_counter()-t0
+        store.close()
+    for name,t in results.items():
+        print('{:>12}: {:8.4f} s'.format(name,t))
+    return results
+
+def benchmark_thread_contention(nreaders=8,nreads=20000,nwrites=2000):
+    '''
+    @brief time many reader threads reading paths while one thread writes, with and without locking  
+    @param[in/OPT] nreaders - number of reader threads  
+    @param[in/OPT] nreads - reads per reader thread  
+    @param[in/OPT] nwrites - number of set_from_path calls from the writer thread  
+    @return dictionary of {dictionary type:seconds}  
+    '''
+    results = {}
+    for cls in [WDict,ThreadSafeWDict]:
+        myd = cls()
+        myd.set_from_path(['config','server','port'],0)
+        def reader():
+            for _ in range(nreads): myd[['config','server','port']]
+        def writer():
+            for i in range(nwrites): myd.set_from_path(['config','server','port'],i)
+        threads = [threading.Thread(target=reader) for _ in range(nreaders)]+[threading.Thread(target=writer)]
+        t0 = time.perf_counter()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        results[cls.__name__] = time.perf_counter()-t0
+        print('{:>16}: {:8.4f} s for {} reads and {} writes'.format(cls.__name__,results[cls.__name__],nreaders*nreads,nwrites))
+    return results
     
 if __name__=='__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestWDict)
     unittest.TextTestRunner(verbosity=2).run(suite)
     
+    benchmark_array_encoding()
+    benchmark_path_access()
+    benchmark_json_backends()
+    benchmark_encoder_dispatch()
+    benchmark_compression()
+    benchmark_nested_merge()
+    benchmark_query()
+    benchmark_columns()
+    benchmark_records()
+    benchmark_jsonl_store()
+    benchmark_thread_contention()
+    
     if True:
         def foo(a,b): 
             return a+b
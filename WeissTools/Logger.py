@@ -7,8 +7,23 @@
 import datetime
 import copy
 import sys
+import os
+import re
+import json
+import time
+import threading
+import queue
+import atexit
+import traceback
+import heapq
+import multiprocessing
+import multiprocessing.util
+from collections import deque
+from functools import partial,lru_cache
+from itertools import islice
+import numpy as np
 
-from WeissTools.Dict import WDict
+from WeissTools.Dict import WDict, WJSONEncoder, WJSONDecoder, register_json_encoder
 
 #%% Some default values and aliases
 
@@ -47,57 +62,688 @@ LEVEL_ALIASES = {
 
 LOG_TEMPLATE = '{ts_fmt}{timestamp}\x1b[0m - {lvl_fmt}{level}\x1b[0m - {msg_fmt}{msg}\x1b[0m'
 
+LOG_SEPARATOR = '\n'+' '.join(['---']*10)+'\n'
+
+DEFAULT_LOG_CAPACITY = None # number of entries Logger keeps (None for no limit)
+
+LEVEL_KEYS = {v:k for k,v in DEFAULT_LEVEL_NAMES.items()} # level name to font key
+
 #%% Generic Functions for logging
 def log(msg:str,level:str=None,start_time:datetime.datetime=None,
-        fonts:dict=DEFAULT_FONT_FORMAT,verbose:int=MAX_VERBOSITY,locs:list=[],**kwargs):
+        fonts:dict=DEFAULT_FONT_FORMAT,verbose:int=MAX_VERBOSITY,locs:list=[],sink=None,
+        args:tuple=(),store_filtered:bool=True,**kwargs):
     '''
     @brief function for logging formatted information to select locations
-    @param[in] msg - message to print
+    @param[in] msg - message to print. Can also be a callable returning the message or a
+        format template for args. These are only evaluated if the message is emitted (or stored)
     @param[in] level - what level to print at (SEE DEFAULTS ABOVE)
     @param[in] start_time - time to make timestamps since (if not just print current time)
     @param[in] fonts - font dictionary for formatting
     @param[in] verbose - How verbose to be (see VERBOSITY_LEVELS)
     @param[in] locs - list of supported locations or things with 'write' methods (apart from stdout)
+    @param[in] sink - AsyncLogSink to format and write the message on a background thread instead of stdout
+    @param[in] args - arguments to format msg with (msg.format(*args))
+    @param[in] store_filtered - still add messages filtered out by verbose to locs (default).
+        False returns before doing any work for filtered messages
     @param[in] kwargs - other possible (less useful) arguments... (none yet though)
     @return handles to updated loc values
     '''
-        # set default levels
+    # set default levels
     if level is None:
-        if isinstance(msg,str):
-            level = 'info'
-        elif isinstance(msg,Exception): # make errror if its an exception
-            level = 'error'; msg = repr(msg)
+        level = 'error' if isinstance(msg,Exception) else 'info' # make errror if its an exception
     # get our level if aliased
     level = LEVEL_ALIASES.get(level,level)
+    emit = verbose>=VERBOSITY_LEVELS.get(level,1)
+    if not emit and not (store_filtered and locs): # filtered out
+        return list(locs)
+    msg = render_log_message(msg,args)
     # make our loggin template
     entry = {'timestamp':get_timestamp(start_time),
              'level':DEFAULT_LEVEL_NAMES[level],
              'msg':msg}       
-    log_fonts = {'ts_fmt' :fonts['time'],
-             'lvl_fmt':fonts[level],
-             'msg_fmt':fonts['msg']}
-    log_str = LOG_TEMPLATE.format(**log_fonts,**entry)
-    log_str = (log_str+'\n'+' '.join(['---']*10)+'\n')
+    return _write_entry(entry,level,emit,fonts,locs,sink)
+
+def log_entry(entry,fonts:dict=DEFAULT_FONT_FORMAT,verbose:int=MAX_VERBOSITY,locs:list=[],sink=None,
+              store_filtered:bool=True):
+    '''
+    @brief log an entry that was already made by log() (e.g. in another process)
+    @param[in] entry - log entry dictionary ({timestamp,level,msg})
+    @param[in] fonts,verbose,locs,sink,store_filtered - see log()
+    @return handles to updated loc values
+    '''
+    level = LEVEL_KEYS.get(entry['level'],'info')
+    emit = verbose>=VERBOSITY_LEVELS.get(level,1)
+    if not emit and not (store_filtered and locs): # filtered out
+        return list(locs)
+    return _write_entry(entry,level,emit,fonts,locs,sink)
+
+def _write_entry(entry,level,emit,fonts,locs,sink):
+    '''@brief write an entry to stdout (or the sink) if emit and then to locs (see log())'''
+    log_str = None # only formatted if needed
     # log the value
-    if verbose>=VERBOSITY_LEVELS.get(level,1):
-        sys.stdout.write(log_str)
+    if emit:
+        if sink is not None: # formatted and written on the sink thread
+            sink.put(entry,fonts)
+        else:
+            log_str = get_level_templates(fonts)[level].format(**entry)
+            sys.stdout.write(log_str)
     locs_out = []
     for l in locs:
-        if isinstance(l,str): # append to string
-            l+=log_str
-        elif isinstance(l,list): # append entry to list
+        if isinstance(l,(list,LogBuffer,LogFileSink)): # append entry to list
             l.append(entry)
-        else: #otherwise try and write the string
-            l.write(log_str)
+        else:
+            if log_str is None:
+                log_str = get_level_templates(fonts)[level].format(**entry)
+            if isinstance(l,str): # append to string
+                l+=log_str
+            else: #otherwise try and write the string
+                l.write(log_str)
         locs_out.append(l) # return handles to written values
     return locs_out
 
+def render_log_message(msg,args=()):
+    '''
+    @brief get the message string for a log() message
+    @param[in] msg - message string, callable returning the message, format template, or exception
+    @param[in/OPT] args - arguments to format msg with
+    '''
+    if isinstance(msg,Exception):
+        return repr(msg)
+    if callable(msg):
+        msg = msg()
+    if args:
+        msg = msg.format(*args)
+    return msg
+
+def get_level_templates(fonts=DEFAULT_FONT_FORMAT):
+    '''
+    @brief get LOG_TEMPLATE (with separator) with the fonts and level name filled in for each level.
+        These only need timestamp and msg. Templates are built once per set of font values
+    @param[in/OPT] fonts - font dictionary for formatting
+    @return dictionary of {level:template string}
+    '''
+    return _build_level_templates(frozenset(fonts.items()))
+
+@lru_cache(maxsize=64)
+def _build_level_templates(font_items):
+    '''@brief build the templates for get_level_templates from the (hashable) font items'''
+    fonts = dict(font_items)
+    esc = lambda v: v.replace('{','{{').replace('}','}}')
+    return {lvl:LOG_TEMPLATE.format(ts_fmt=esc(fonts['time']),lvl_fmt=esc(fonts[lvl]),
+                                    msg_fmt=esc(fonts['msg']),level=esc(name),
+                                    timestamp='{timestamp}',msg='{msg}')+esc(LOG_SEPARATOR)
+            for lvl,name in DEFAULT_LEVEL_NAMES.items()}
+
+def format_log_entry(entry,fonts=DEFAULT_FONT_FORMAT):
+    '''@brief get the string log() writes for a log entry ({timestamp,level,msg})'''
+    level = LEVEL_KEYS.get(entry['level'])
+    if level is None: # not a default level name
+        return LOG_TEMPLATE.format(ts_fmt=fonts['time'],lvl_fmt=fonts['info'],msg_fmt=fonts['msg'],**entry)+LOG_SEPARATOR
+    return get_level_templates(fonts)[level].format(**entry)
+
+class LogBuffer(deque):
+    '''
+    @brief log history. A deque of log entries where the oldest entries are dropped once
+        maxlen is reached (if given). Appending is O(1) and the log string is only built
+        when it is asked for (get_str). Slicing returns a list like the previous list history
+    @param[in/OPT] iterable - entries to start with
+    @param[in/OPT] maxlen - maximum number of entries to keep (None for no limit)
+    @param[in/OPT] fonts - font dictionary to format the string view with
+    '''
+    def __init__(self,iterable=(),maxlen=None,fonts=None):
+        super().__init__(iterable,maxlen)
+        self.fonts = DEFAULT_FONT_FORMAT if fonts is None else fonts
+        
+    def __getitem__(self,idx):
+        '''@brief index like a deque or slice like a list (returns a list of entries)'''
+        if isinstance(idx,slice):
+            return list(self)[idx]
+        return super().__getitem__(idx)
+        
+    def get_str(self,fonts=None):
+        '''
+        @brief get the log string of the kept entries (like the output of log())
+        @param[in/OPT] fonts - font dictionary to format with (default self.fonts)
+        '''
+        fonts = self.fonts if fonts is None else fonts
+        return ''.join([format_log_entry(e,fonts) for e in self])
+    
+    def resized(self,maxlen):
+        '''@brief get a copy keeping at most the newest maxlen entries'''
+        return LogBuffer(self,maxlen,self.fonts)
+        
+register_json_encoder(LogBuffer,list) # written as a list of entries
+
+class AsyncLogSink:
+    '''
+    @brief write log messages from a background thread. log() puts entries on a queue
+        and the thread formats and writes them in batches so the caller never waits on the stream
+    @param[in/OPT] stream - stream to write to. Defaults to sys.stdout (looked up when writing)
+    @param[in/OPT] maxsize - maximum number of entries waiting to be written
+    @param[in/OPT] policy - what to do when the queue is full. 'block' waits for room, 'drop'
+        drops the message (counted in dropped)
+    @param[in/OPT] batch_size - maximum number of entries written at once
+    @note waiting entries are written when the interpreter exits (or on flush/close). Entries put
+        after closing (e.g. from later atexit functions) or if the thread stopped are written on the calling thread
+    @note errors writing to the stream are printed to stderr (and counted in errors) and the thread keeps going
+    '''
+    POLICIES = ['block','drop']
+    
+    def __init__(self,stream=None,maxsize=10000,policy='block',batch_size=1000):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown policy '{}'. Must be one of {}".format(policy,self.POLICIES))
+        self.stream = stream
+        self.policy = policy
+        self.batch_size = batch_size
+        self.dropped = 0 # number of messages dropped because the queue was full
+        self.errors = 0 # number of batches that couldnt be written
+        self._queue = queue.Queue(maxsize)
+        self._closed = False
+        self._lock = threading.Lock() # so nothing is queued after the closing sentinel
+        self._thread = threading.Thread(target=self._run,name='AsyncLogSink',daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        
+    def put(self,entry,fonts=DEFAULT_FONT_FORMAT):
+        '''@brief add a log entry to be written'''
+        item = (entry,fonts)
+        with self._lock:
+            if not self._closed and self._thread.is_alive():
+                return self._enqueue(item)
+        return self._write([item])
+        
+    def _enqueue(self,item):
+        '''@brief put an item on the queue following the policy (called holding _lock)'''
+        if self.policy=='drop':
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+            return
+        while True: # block, but dont wait forever if the thread stopped
+            try:
+                return self._queue.put(item,timeout=0.1)
+            except queue.Full:
+                if not self._thread.is_alive():
+                    return self._write([item])
+            
+    def _write(self,items):
+        '''@brief format and write (entry,fonts) items, reporting any error to stderr'''
+        try:
+            log_str = ''.join([format_log_entry(entry,fonts) for entry,fonts in items])
+            if log_str:
+                stream = sys.stdout if self.stream is None else self.stream
+                stream.write(log_str)
+                stream.flush()
+        except Exception:
+            self.errors += 1
+            sys.stderr.write('AsyncLogSink could not write {} log entries:\n'.format(len(items)))
+            traceback.print_exc()
+            
+    def _run(self):
+        '''@brief write batches of entries until closed'''
+        q = self._queue
+        while True:
+            batch = [q.get()]
+            while len(batch)<self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            done = batch[-1] is None # closed
+            try:
+                self._write([b for b in batch if b is not None])
+            finally:
+                for _ in batch:
+                    q.task_done()
+            if done:
+                return
+            
+    def flush(self):
+        '''@brief wait until everything put so far is written'''
+        if self._thread.is_alive():
+            self._queue.join()
+        
+    def close(self):
+        '''@brief write anything waiting and stop the thread'''
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            running = self._thread.is_alive()
+            if running:
+                self._queue.put(None)
+        atexit.unregister(self.close)
+        if running:
+            self._thread.join()
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*args):
+        self.close()
+
+class _LogStrView:
+    '''
+    @brief attribute giving the string of a LogBuffer attribute when accessed (from the class or an instance)
+    @param[in] buffer_attr - name of the LogBuffer attribute
+    @param[in] fonts_attr - name of the font dictionary attribute to format with (so reassigned fonts are used)
+    @note if the owner has no buffer_attr (e.g. instance attributes accessed from the class) this returns itself
+    '''
+    def __init__(self,buffer_attr,fonts_attr):
+        self.buffer_attr = buffer_attr
+        self.fonts_attr = fonts_attr
+        
+    def __get__(self,obj,cls=None):
+        owner = cls if obj is None else obj
+        buffer = getattr(owner,self.buffer_attr,None)
+        if buffer is None:
+            return self
+        return buffer.get_str(getattr(owner,self.fonts_attr,None))
+
 def get_timestamp(start_time=None):
-    '''@brief get a log timestamp. start is start time as a datetime'''
+    '''
+    @brief get a log timestamp. start is start time as a datetime
+    @note relative timestamps use the monotonic clock (from the first time start_time is used in
+        this process) so changes to the wall clock never reorder them
+    '''
     if start_time is not None:
-        return '{:9.6f}'.format((datetime.datetime.now()-start_time).total_seconds())
+        return '{:9.6f}'.format(time.monotonic()-_get_monotonic_origin(start_time))
     else:
         return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    
+@lru_cache(maxsize=256)
+def _get_monotonic_origin(start_time):
+    '''@brief get the time.monotonic() value corresponding to a start time datetime'''
+    return time.monotonic()-(datetime.datetime.now()-start_time).total_seconds()
+
+#%% log files
+
+LOG_INDEX_DTYPE = np.dtype([('offset','<u8'),('time','<f8'),('level','u1')]) # one per entry
+
+def get_timestamp_value(timestamp):
+    '''@brief get a timestamp from get_timestamp as seconds (since the start time or since the epoch)'''
+    try:
+        return float(timestamp)
+    except ValueError:
+        return datetime.datetime.fromisoformat(timestamp).timestamp()
+    
+def get_absolute_time(timestamp,start_time=None):
+    '''
+    @brief get a timestamp from get_timestamp as seconds since the epoch
+    @param[in] timestamp - absolute or relative timestamp string
+    @param[in/OPT] start_time - datetime relative timestamps are from (default Logger._start_time)
+    '''
+    try:
+        seconds = float(timestamp)
+    except ValueError:
+        return datetime.datetime.fromisoformat(timestamp).timestamp()
+    return (Logger._start_time if start_time is None else start_time).timestamp()+seconds
+    
+def get_level_code(level):
+    '''@brief get the verbosity of a level name (e.g. 'ERROR'), level, or alias (0 if unknown)'''
+    level = LEVEL_KEYS.get(level,level)
+    return VERBOSITY_LEVELS.get(LEVEL_ALIASES.get(level,level),0)
+
+def get_log_segments(fpath):
+    '''
+    @brief get the segment files written by LogFileSink for fpath in order
+    @param[in] fpath - base path given to LogFileSink (e.g. run.jsonl)
+    @return list of [(segment number,segment path)]
+    '''
+    root,ext = os.path.splitext(os.path.abspath(fpath))
+    dirpath = os.path.dirname(root)
+    if not os.path.isdir(dirpath):
+        return []
+    pattern = re.compile(re.escape(os.path.basename(root))+r'\.(\d{6})'+re.escape(ext)+'$')
+    matches = [(pattern.match(f),f) for f in os.listdir(dirpath)]
+    return sorted((int(m.group(1)),os.path.join(dirpath,f)) for m,f in matches if m)
+
+def read_log_index(path):
+    '''@brief read the (offset,time,level) index of a log segment (complete rows only)'''
+    idx_path = path+LogFileSink.index_suffix
+    if not os.path.exists(idx_path):
+        return np.empty(0,LOG_INDEX_DTYPE)
+    count = os.path.getsize(idx_path)//LOG_INDEX_DTYPE.itemsize
+    return np.fromfile(idx_path,dtype=LOG_INDEX_DTYPE,count=count)
+
+class LogFileSink:
+    '''
+    @brief append log entries ({timestamp,level,msg}) to json lines files. Entries are written
+        in batches to numbered segments (run.000000.jsonl, run.000001.jsonl, ...) and a binary
+        index of (offset,time,level) per entry is kept next to each one (run.000000.jsonl.lidx)
+        so LogFileReader can find entries without parsing the files. Each line also gets the
+        absolute time of the entry ('time' in seconds since the epoch) so runs appended to the
+        same files can be told apart
+    @param[in] fpath - base path of the log files (e.g. run.jsonl)
+    @param[in/OPT] batch_size - number of entries to keep before writing them
+    @param[in/OPT] flush_interval - also write waiting entries every this many seconds (None to only write full batches)
+    @param[in/OPT] start_time - datetime relative timestamps are from (default Logger._start_time)
+    @param[in/OPT] max_bytes - start a new segment once the current one is this many bytes
+    @param[in/OPT] max_age - start a new segment once the current one has been written to for this many seconds
+    @param[in/OPT] max_segments - remove the oldest segments when there are more than this
+    @param[in/OPT] mode - 'a' to continue the newest segment or 'w' to remove any existing segments
+    @note segments are checked for rotation after each batch so they can be up to a batch over max_bytes
+    @note entries missing from the index of the newest segment (e.g. after a crash) are indexed
+        again when opened and a partially written last line is removed. Waiting entries are
+        written at interpreter exit, so at most flush_interval seconds of entries can be lost in a crash
+    @example
+        Logger.set_file_sink('run.jsonl',max_bytes=2**20)
+        LogFileReader('run.jsonl').iter_entries(levels=['error'])
+    '''
+    index_suffix = '.lidx'
+    
+    def __init__(self,fpath,batch_size=1000,max_bytes=None,max_age=None,max_segments=None,mode='a',
+                 flush_interval=1.0,start_time=None):
+        if mode not in ('a','w'):
+            raise ValueError("mode must be 'a' or 'w'")
+        self.fpath = os.path.abspath(fpath)
+        self.batch_size = batch_size
+        self.start_time = start_time
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_segments = max_segments
+        self._encoder = WJSONEncoder()
+        self._pending = [] # entries not written yet
+        self._lock = threading.Lock()
+        self._file = None; self._index_file = None
+        segments = get_log_segments(self.fpath)
+        if mode=='w':
+            for _,path in segments:
+                self._remove_segment(path)
+            segments = []
+        self._open_segment(segments[-1][0] if segments else 0)
+        atexit.register(self.close)
+        self._stop = threading.Event()
+        self._timer = None
+        if flush_interval is not None:
+            self._timer = threading.Thread(target=self._flush_periodically,args=(flush_interval,),
+                                           name='LogFileSink',daemon=True)
+            self._timer.start()
+            
+    def _flush_periodically(self,interval):
+        '''@brief flush every interval seconds until closed'''
+        while not self._stop.wait(interval):
+            self.flush()
+        
+    def _segment_path(self,n):
+        root,ext = os.path.splitext(self.fpath)
+        return '{}.{:06d}{}'.format(root,n,ext)
+    
+    def _remove_segment(self,path):
+        for p in (path,path+self.index_suffix):
+            if os.path.exists(p): os.remove(p)
+        
+    def _open_segment(self,n):
+        '''@brief open segment n for appending (indexing any entries missing from its index)'''
+        self._nsegment = n
+        self.path = self._segment_path(n)
+        self._end = self._recover(self.path)
+        self._opened = time.monotonic()
+        self._file = open(self.path,'ab')
+        self._index_file = open(self.path+self.index_suffix,'ab')
+        
+    def _recover(self,path):
+        '''@brief index complete entries missing from the index of a segment and get its end offset'''
+        index = read_log_index(path)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        end = 0; rows = []
+        with open(path,'a+b') as data_file:
+            if len(index): # end of the last indexed entry
+                data_file.seek(int(index['offset'][-1]))
+                end = data_file.tell()+len(data_file.readline())
+            if end<size:
+                data_file.seek(end)
+                for line in data_file:
+                    if not line.endswith(b'\n'): # partially written
+                        break
+                    entry = json.loads(line)
+                    t = entry['time'] if 'time' in entry else get_absolute_time(entry['timestamp'],self.start_time)
+                    rows.append((end,t,get_level_code(entry['level'])))
+                    end += len(line)
+                data_file.truncate(end)
+        idx_path = path+self.index_suffix
+        with open(idx_path,'r+b' if os.path.exists(idx_path) else 'wb') as index_file:
+            index_file.truncate(len(index)*LOG_INDEX_DTYPE.itemsize) # drop any partial row
+            index_file.seek(0,os.SEEK_END)
+            index_file.write(np.array(rows,dtype=LOG_INDEX_DTYPE).tobytes())
+        return end
+    
+    def append(self,entry):
+        '''@brief add a log entry. Entries are written once batch_size are waiting (or on flush/close)'''
+        with self._lock:
+            self._pending.append(entry)
+            if len(self._pending)>=self.batch_size:
+                self._flush()
+                
+    def flush(self):
+        '''@brief write waiting entries and then their index'''
+        with self._lock:
+            self._flush()
+    
+    def _flush(self):
+        pending = self._pending
+        if not pending or self._file is None:
+            return
+        self._pending = []
+        encode = self._encoder.encode
+        times = [get_absolute_time(e['timestamp'],self.start_time) for e in pending]
+        lines = [(encode(dict(e,time=t))+'\n').encode() for e,t in zip(pending,times)]
+        lengths = np.array([len(line) for line in lines],dtype='<u8')
+        rows = np.empty(len(lines),LOG_INDEX_DTYPE)
+        rows['offset'] = self._end+np.cumsum(lengths)-lengths
+        rows['time'] = times
+        rows['level'] = [get_level_code(e['level']) for e in pending]
+        self._file.write(b''.join(lines))
+        self._file.flush() # data before the index so the index never points past it
+        self._index_file.write(rows.tobytes())
+        self._index_file.flush()
+        self._end += int(lengths.sum())
+        if ((self.max_bytes is not None and self._end>=self.max_bytes) or
+                (self.max_age is not None and time.monotonic()-self._opened>=self.max_age)):
+            self._rotate()
+            
+    def _rotate(self):
+        '''@brief start the next segment (removing the oldest ones past max_segments)'''
+        self._file.close(); self._index_file.close()
+        self._open_segment(self._nsegment+1)
+        if self.max_segments is not None:
+            segments = get_log_segments(self.fpath)
+            for _,path in segments[:max(len(segments)-self.max_segments,0)]:
+                self._remove_segment(path)
+        
+    def close(self):
+        '''@brief write any waiting entries and close the files'''
+        self._stop.set()
+        with self._lock:
+            self._flush()
+            for f in (self._file,self._index_file):
+                if f is not None: f.close()
+            self._file = None; self._index_file = None
+        atexit.unregister(self.close)
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*args):
+        self.close()
+        
+class LogFileReader:
+    '''
+    @brief read entries written by LogFileSink. Only the indexes are read to find entries so
+        e.g. the errors in a time range are read without parsing the rest of the files
+    @param[in] fpath - base path given to LogFileSink
+    @example
+        reader = LogFileReader('run.jsonl')
+        errors = list(reader.iter_entries(t0=10,t1=20,levels='error'))
+    '''
+    def __init__(self,fpath):
+        self.fpath = os.path.abspath(fpath)
+        self._object_hook = partial(WJSONDecoder,dict_type=dict,sidecar_root=os.path.dirname(self.fpath))
+        
+    @property
+    def segments(self):
+        '''@brief paths of the segment files (oldest first)'''
+        return [path for _,path in get_log_segments(self.fpath)]
+        
+    def __len__(self):
+        return sum(len(read_log_index(path)) for path in self.segments)
+    
+    def __iter__(self):
+        return self.iter_entries()
+    
+    def iter_entries(self,t0=None,t1=None,levels=None):
+        '''
+        @brief stream the entries (oldest first) matching a time range and levels
+        @param[in/OPT] t0 - earliest time (datetime or seconds since the epoch)
+        @param[in/OPT] t1 - latest time (inclusive)
+        @param[in/OPT] levels - level or list of levels (e.g. 'error', 'e', or 'ERROR') to get
+        @return generator of entry dictionaries (with 'time' in seconds since the epoch)
+        '''
+        t0,t1 = [t.timestamp() if isinstance(t,datetime.datetime) else t for t in (t0,t1)]
+        if isinstance(levels,str): levels = [levels]
+        codes = None if levels is None else [get_level_code(l) for l in levels]
+        for path in self.segments:
+            index = read_log_index(path)
+            mask = np.ones(len(index),dtype=bool)
+            if t0 is not None: mask &= index['time']>=t0
+            if t1 is not None: mask &= index['time']<=t1
+            if codes is not None: mask &= np.isin(index['level'],codes)
+            offsets = index['offset'][mask]
+            if not len(offsets):
+                continue
+            with open(path,'rb') as data_file:
+                if len(offsets)==len(index): # everything indexed so just stream it
+                    for line in islice(data_file,len(index)):
+                        yield json.loads(line,object_hook=self._object_hook)
+                else:
+                    for offset in offsets:
+                        data_file.seek(int(offset))
+                        yield json.loads(data_file.readline(),object_hook=self._object_hook)
+
+#%% multiprocess logging
+
+class QueueLogSink:
+    '''
+    @brief send log entries to a LogCollector in another process. Entries are sent in batches
+        (a list per queue put) to keep the interprocess overhead low
+    @param[in] queue - multiprocessing queue of the LogCollector
+    @param[in/OPT] batch_size - number of entries to keep before sending them
+    @param[in/OPT] flush_interval - send waiting entries once they have waited this many seconds
+        (checked when logging and by a timer thread so entries are sent while a task is running). 
+        None to only send full batches
+    @note waiting entries are sent when the process exits (including multiprocessing workers)
+    '''
+    def __init__(self,queue,batch_size=100,flush_interval=0.5):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # run by multiprocessing at exit before its queues are closed (their priority is 10)
+        self._finalizer = multiprocessing.util.Finalize(None,self._close,exitpriority=20)
+        self._timer = None
+        if flush_interval is not None:
+            self._timer = threading.Thread(target=self._flush_periodically,name='QueueLogSink',daemon=True)
+            self._timer.start()
+            
+    def _flush_periodically(self):
+        '''@brief send entries that waited flush_interval seconds until closed'''
+        while not self._stop.wait(self.flush_interval):
+            with self._lock:
+                if self._pending and time.monotonic()-self._last>=self.flush_interval:
+                    self._flush()
+        
+    def put(self,entry,fonts=None):
+        '''@brief add a log entry to be sent (fonts are ignored, the collector formats the entry)'''
+        with self._lock:
+            self._pending.append(entry)
+            if len(self._pending)>=self.batch_size or (self.flush_interval is not None
+                                                       and time.monotonic()-self._last>=self.flush_interval):
+                self._flush()
+                
+    def flush(self):
+        '''@brief send any waiting entries'''
+        with self._lock:
+            self._flush()
+            
+    def _flush(self):
+        self._last = time.monotonic()
+        if self._pending:
+            self.queue.put(self._pending)
+            self._pending = []
+            
+    def _close(self):
+        self._stop.set()
+        self.flush()
+        
+    def close(self):
+        '''@brief send any waiting entries and stop the timer'''
+        self._finalizer() # flushes once
+        
+class LogCollector:
+    '''
+    @brief collect log entries from worker processes into a Logger in this process. A thread
+        receives the batches from QueueLogSink and logs them with the logger's settings
+        (verbosity, history, file sink ...). Batches waiting together are merged in timestamp order
+    @param[in/OPT] logger - Logger class or instance to log the entries to (default the global Logger)
+    @param[in/OPT] queue - queue to receive on. Defaults to a new multiprocessing queue
+        (use a multiprocessing.Manager().Queue() to pass it as a task argument)
+    @example
+        with LogCollector() as collector:
+            with ProcessPoolExecutor(4,initializer=Logger.set_worker,initargs=collector.worker_args()) as pool:
+                pool.map(work,tasks)
+    '''
+    def __init__(self,logger=None,queue=None):
+        self.logger = Logger if logger is None else logger
+        self.queue = multiprocessing.Queue() if queue is None else queue
+        self.received = 0 # number of entries logged
+        self._thread = threading.Thread(target=self._run,name='LogCollector',daemon=True)
+        self._thread.start()
+        
+    def worker_args(self,batch_size=100,flush_interval=0.5,verbose=MAX_VERBOSITY):
+        '''
+        @brief get the arguments for Logger.set_worker in the workers (e.g. for initargs)
+        @param[in/OPT] batch_size,flush_interval - see QueueLogSink
+        @param[in/OPT] verbose - verbosity of the workers. By default everything is sent and 
+            the collecting logger's verbosity is used
+        '''
+        start_time = getattr(self.logger,'_istart_time',None) or self.logger._start_time
+        return (self.queue,start_time,batch_size,flush_interval,verbose)
+    
+    def _run(self):
+        '''@brief log received batches until closed'''
+        while True:
+            batches = [self.queue.get()]
+            while batches[-1] is not None:
+                try:
+                    batches.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = batches[-1] is None
+            batches = [b for b in batches if b]
+            entries = batches[0] if len(batches)==1 else heapq.merge(
+                *batches,key=lambda e: get_timestamp_value(e['timestamp']))
+            log_entry = self.logger.log_entry
+            for entry in entries:
+                log_entry(entry)
+                self.received += 1
+            if done:
+                return
+            
+    def close(self):
+        '''@brief log everything sent so far (workers should have exited or flushed) and stop the thread'''
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*args):
+        self.close()
 
 #%% Our actual logger class
 
@@ -107,39 +753,117 @@ class Logger(WDict):
     @param[in] args - passed to wdict constructor
     @param[in] fonts - dictionary of fonts to pass in. otherwise use default
     @param[in] kwargs - any other info to save in the dict
+    @note the global (_log) and instance (self['log']) logs are LogBuffers. These are deques of
+        log entries that can be indexed and sliced like lists. By default they are not limited,
+        set_log_capacity/set_ilog_capacity (or log_capacity) keep only the newest entries.
+        They are written to json as lists and _log_str/_ilog_str give the log string
     '''
     
     # class variables for global usage
-    _log_str = ''
-    _log = []
+    _log = LogBuffer(maxlen=DEFAULT_LOG_CAPACITY)
+    _log_str = _LogStrView('_log','fonts')
     _start_time = datetime.datetime.now()
     _timestamp = _start_time.strftime('%Y-%m-%d %H:%M:%S.%f')
     _verbose = MAX_VERBOSITY
+    _sink = None
+    _file_sink = None
+    _store_filtered = True
     fonts = DEFAULT_FONT_FORMAT
     
     @classmethod
-    def log(cls,msg:str,level:str=None,**kwargs):
-        '''@brief generic function to log'''
-        cls._log,cls._log_str = log(msg,level=level,verbose=cls._verbose,
-                                        start_time=cls._start_time,fonts=cls.fonts,
-                                        locs=[cls._log,cls._log_str])
+    def log(cls,msg:str,level:str=None,*,args:tuple=(),**kwargs):
+        '''
+        @brief generic function to log
+        @param[in] args - arguments to format msg with, only if it is logged (e.g. log('value {}','d',args=(v,)))
+        '''
+        log(msg,level=level,verbose=cls._verbose,start_time=cls._start_time,
+            fonts=cls.fonts,locs=[cls._log] if cls._file_sink is None else [cls._log,cls._file_sink],sink=cls._sink,
+            args=args,store_filtered=cls._store_filtered)
+        
+    @classmethod
+    def log_entry(cls,entry):
+        '''@brief log an entry made elsewhere (e.g. received by a LogCollector)'''
+        log_entry(entry,verbose=cls._verbose,fonts=cls.fonts,
+                  locs=[cls._log] if cls._file_sink is None else [cls._log,cls._file_sink],
+                  sink=cls._sink,store_filtered=cls._store_filtered)
         
     @classmethod
-    def info(cls,*args,**kwargs): return cls.log(*args,level='i',**kwargs)
+    def info(cls,msg,*args,**kwargs): return cls.log(msg,'i',args=args,**kwargs)
     @classmethod
-    def warning(cls,*args,**kwargs): return cls.log(*args,level='w',**kwargs)
+    def warning(cls,msg,*args,**kwargs): return cls.log(msg,'w',args=args,**kwargs)
     @classmethod
-    def error(cls,*args,**kwargs): return cls.log(*args,level='e',**kwargs)
+    def error(cls,msg,*args,**kwargs): return cls.log(msg,'e',args=args,**kwargs)
     @classmethod
-    def debug(cls,*args,**kwargs): return cls.log(*args,level='d',**kwargs)
+    def debug(cls,msg,*args,**kwargs): return cls.log(msg,'d',args=args,**kwargs)
     
     @classmethod
     def set_verbose(cls,vlevel=MAX_VERBOSITY):
         cls._verbose = vlevel
+        
+    @classmethod
+    def set_store_filtered(cls,store=True):
+        '''@brief keep messages filtered out by the verbosity in the log (default). False skips them entirely (faster)'''
+        cls._store_filtered = store
+        
+    @classmethod
+    def set_async(cls,enable=True,**kwargs):
+        '''
+        @brief write global log messages from a background thread (or stop doing so)
+        @param[in/OPT] enable - False to go back to writing on the calling thread
+        @param[in/OPT] kwargs - passed to AsyncLogSink (e.g. policy='drop')
+        '''
+        if cls._sink is not None:
+            cls._sink.close()
+        cls._sink = AsyncLogSink(**kwargs) if enable else None
+        
+    @classmethod
+    def set_worker(cls,queue,start_time=None,batch_size=100,flush_interval=0.5,verbose=None):
+        '''
+        @brief send global log entries to a LogCollector in another process instead of stdout.
+            Use as a process pool initializer with the LogCollector worker_args
+        @param[in] queue - queue of the LogCollector
+        @param[in/OPT] start_time - start time for timestamps (the collecting logger's so all processes match)
+        @param[in/OPT] batch_size,flush_interval - see QueueLogSink
+        @param[in/OPT] verbose - verbosity to send messages at (default unchanged)
+        @note the global log history of the worker is dropped and no longer kept (the collector keeps it)
+        '''
+        if start_time is not None:
+            cls._start_time = start_time
+        if verbose is not None:
+            cls._verbose = verbose
+        if cls._sink is not None:
+            cls._sink.close()
+        cls._sink = QueueLogSink(queue,batch_size,flush_interval)
+        cls._file_sink = None # the collector writes the files (a forked copy would write them twice)
+        cls._log = cls._log.resized(0) # and keeps the history
+        
+    @classmethod
+    def set_file_sink(cls,fpath=None,**kwargs):
+        '''
+        @brief also write global log entries to rotating json lines files (see LogFileSink)
+        @param[in/OPT] fpath - base path of the log files. None to stop writing them
+        @param[in/OPT] kwargs - passed to LogFileSink (e.g. max_bytes=2**20)
+        '''
+        if cls._file_sink is not None:
+            cls._file_sink.close()
+        kwargs.setdefault('start_time',cls._start_time)
+        cls._file_sink = LogFileSink(fpath,**kwargs) if fpath is not None else None
+        
+    @classmethod
+    def set_log_capacity(cls,capacity=DEFAULT_LOG_CAPACITY):
+        '''@brief set the number of entries kept in the global log (None for no limit)'''
+        cls._log = cls._log.resized(capacity)
+    
+    _ilog_str = _LogStrView('_ilog','ifonts')
     
     # variables for non-global usage
-    def __init__(self,*args,fonts={},**kwargs):
-        '''@brief constructor'''
+    def __init__(self,*args,fonts={},log_capacity=DEFAULT_LOG_CAPACITY,store_filtered=True,**kwargs):
+        '''
+        @brief constructor
+        @param[in/OPT] log_capacity - number of entries to keep in the instance log (None for no limit)
+        @param[in/OPT] store_filtered - keep messages filtered out by the verbosity in the instance log.
+            False skips them entirely (faster)
+        '''
         # init parent
         super().__init__(*args,**kwargs)
         # add in font formats (instance)
@@ -147,18 +871,23 @@ class Logger(WDict):
         self.ifonts.update(fonts)
         #set verbosity (instance)
         self._iverbose = kwargs.get('verbose',MAX_VERBOSITY)
+        self._istore_filtered = store_filtered
         # get the parent timestamp (when we were initialized)
         self._init_timestamp()
         # init the (local) log
-        self._init_log()
+        self._isink = None
+        self._ifile_sink = None
+        self._init_log(log_capacity)
         # initialize instance methods
         self._init_instance()
         
-    def _init_log(self):
-        '''@brief initialize our instance log if it wasnt provided'''
-        if self.get('log',None) is None:
-            self._ilog = self['log'] = []
-            self._ilog_str = ''
+    def _init_log(self,capacity=DEFAULT_LOG_CAPACITY):
+        '''@brief initialize our instance log (keeping any entries that were provided)'''
+        self._ilog = self['log'] = LogBuffer(self.get('log',None) or (),capacity,self.ifonts)
+        
+    def set_ilog_capacity(self,capacity=DEFAULT_LOG_CAPACITY):
+        '''@brief set the number of entries kept in the instance log (None for no limit)'''
+        self._ilog = self['log'] = self._ilog.resized(capacity)
         
     def _init_timestamp(self):
         '''@brief initialize our timestamp values'''
@@ -168,21 +897,43 @@ class Logger(WDict):
     def _init_instance(self):
         '''@brief change from classmethods to instance methods'''
         # instantiate logging
-        def ilog(msg:str,level:str=None,**kwargs):
-            self._ilog,self._ilog_str = log(msg,level=level,verbose=self._iverbose,
-                                            start_time=self._istart_time,fonts=self.ifonts,
-                                            locs=[self._ilog,self._ilog_str])
+        def ilog(msg:str,level:str=None,*,args:tuple=(),**kwargs):
+            log(msg,level=level,verbose=self._iverbose,start_time=self._istart_time,
+                fonts=self.ifonts,locs=[self._ilog] if self._ifile_sink is None else [self._ilog,self._ifile_sink],
+                sink=self._isink,
+                args=args,store_filtered=self._istore_filtered)
         self.log = ilog
+        def ilog_entry(entry):
+            log_entry(entry,verbose=self._iverbose,fonts=self.ifonts,
+                      locs=[self._ilog] if self._ifile_sink is None else [self._ilog,self._ifile_sink],
+                      sink=self._isink,store_filtered=self._istore_filtered)
+        self.log_entry = ilog_entry
         # override easy access methods
-        self.info = lambda *args,**kwargs: self.log(*args,level='i',**kwargs)
-        self.warning = lambda *args,**kwargs: self.log(*args,level='w',**kwargs)
-        self.error = lambda *args,**kwargs: self.log(*args,level='e',**kwargs)
-        self.debug = lambda *args,**kwargs: self.log(*args,level='d',**kwargs)
+        self.info = lambda msg,*args,**kwargs: self.log(msg,'i',args=args,**kwargs)
+        self.warning = lambda msg,*args,**kwargs: self.log(msg,'w',args=args,**kwargs)
+        self.error = lambda msg,*args,**kwargs: self.log(msg,'e',args=args,**kwargs)
+        self.debug = lambda msg,*args,**kwargs: self.log(msg,'d',args=args,**kwargs)
         
         # verbosity setting
         def set_iverbose(vlevel=MAX_VERBOSITY):
             self._iverbose = vlevel
         self.set_verbose = set_iverbose
+        def set_istore_filtered(store=True):
+            self._istore_filtered = store
+        self.set_store_filtered = set_istore_filtered
+        
+        # background writing
+        def set_iasync(enable=True,**kwargs):
+            if self._isink is not None:
+                self._isink.close()
+            self._isink = AsyncLogSink(**kwargs) if enable else None
+        self.set_async = set_iasync
+        def set_ifile_sink(fpath=None,**kwargs):
+            if self._ifile_sink is not None:
+                self._ifile_sink.close()
+            kwargs.setdefault('start_time',self._istart_time)
+            self._ifile_sink = LogFileSink(fpath,**kwargs) if fpath is not None else None
+        self.set_file_sink = set_ifile_sink
         
         
 #%% testing
@@ -215,6 +966,191 @@ class TestLogger(unittest.TestCase):
                 self.assertTrue(l not in gloggers[0]._log)
             
             
+    def test_log_buffer(self):
+        '''@brief test the bounded log history'''
+        mylog = Logger(name='buffered',log_capacity=3,verbose=0,store_filtered=True)
+        for i in range(5):
+            mylog.log('message {}'.format(i))
+        self.assertEqual(['message 2','message 3','message 4'],[e['msg'] for e in mylog._ilog])
+        self.assertEqual(['message 3','message 4'],[e['msg'] for e in mylog['log'][1:]]) # slices like a list
+        self.assertIsInstance(mylog['log'][-2:],list)
+        self.assertEqual('message 2',mylog['log'][0]['msg'])
+        self.assertIsNone(Logger()._ilog.maxlen) # not limited by default
+        self.assertEqual(3,mylog._ilog_str.count('message'))
+        self.assertIn('message 4',mylog._ilog_str)
+        self.assertTrue(mylog._ilog_str.endswith(format_log_entry(mylog._ilog[-1],mylog.ifonts)))
+        mylog.set_ilog_capacity(None)
+        mylog.log('message 5')
+        self.assertEqual(4,len(mylog['log']))
+        mylog2 = Logger(); mylog2.loads(mylog.dumps()) # entries are written as a list
+        self.assertEqual(list(mylog['log']),list(mylog2['log']))
+        self.assertIsInstance(Logger._log_str,str)
+        self.assertIsInstance(Logger._ilog_str,_LogStrView) # instance only
+        self.assertIsInstance(mylog['log'],deque)
+        # reassigned fonts are used for the string
+        mylog.ifonts = dict(mylog.ifonts,msg='<msgfont>')
+        self.assertTrue(mylog._ilog_str.endswith(format_log_entry(mylog._ilog[-1],mylog.ifonts)))
+        self.assertEqual(mylog._ilog_str.count('<msgfont>'),len(mylog['log']))
+        
+    def test_async_sink(self):
+        '''@brief test writing log messages from a background thread'''
+        import io
+        stream = io.StringIO()
+        mylog = Logger(name='async')
+        mylog.set_async(stream=stream,batch_size=7)
+        for i in range(100):
+            mylog.log('message {}'.format(i))
+        mylog._isink.flush()
+        self.assertEqual(mylog._ilog_str,stream.getvalue()) # same output in order
+        mylog.set_async(False)
+        # drop when full
+        release = threading.Event()
+        class SlowStream(io.StringIO):
+            def write(self,s):
+                release.wait(5)
+                return super().write(s)
+        sink = AsyncLogSink(stream=SlowStream(),maxsize=5,policy='drop')
+        for i in range(50):
+            log('message {}'.format(i),sink=sink)
+        self.assertGreater(sink.dropped,0)
+        release.set()
+        sink.close()
+        self.assertEqual(50-sink.dropped,sink.stream.getvalue().count('message'))
+        log('after close',sink=sink) # written on the calling thread
+        self.assertIn('after close',sink.stream.getvalue())
+        # nothing is lost when closing while other threads are logging
+        sink = AsyncLogSink(stream=io.StringIO(),maxsize=50,batch_size=5)
+        threads = [threading.Thread(target=lambda: [log('message {}'.format(i),sink=sink) for i in range(500)]) for _ in range(4)]
+        for t in threads: t.start()
+        sink.close()
+        for t in threads: t.join(5)
+        self.assertEqual(2000,sink.stream.getvalue().count('message'))
+        # write errors are reported and dont stop the thread (or block callers)
+        class BadStream(io.StringIO):
+            def write(self,s):
+                raise IOError('cant write')
+        sink = AsyncLogSink(stream=BadStream(),maxsize=4,batch_size=1)
+        import contextlib
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            t = threading.Thread(target=lambda: [log('message {}'.format(i),sink=sink) for i in range(10)])
+            t.start(); t.join(5)
+            self.assertFalse(t.is_alive())
+            sink.close()
+        self.assertEqual(10,sink.errors)
+        self.assertIn('cant write',err.getvalue())
+        
+    def test_filtered(self):
+        '''@brief test filtered messages do no work unless stored'''
+        calls = []
+        def expensive():
+            calls.append(1); return 'expensive message'
+        mylog = Logger(name='filtered',store_filtered=False)
+        mylog.set_verbose(VERBOSITY_LEVELS['error'])
+        mylog.debug(expensive)
+        mylog.debug('value {} of {}',1,2)
+        self.assertEqual([],calls)
+        self.assertEqual(0,len(mylog._ilog))
+        mylog.set_store_filtered(True)
+        mylog.debug(expensive)
+        mylog.debug('value {} of {}',1,2)
+        self.assertEqual(1,len(calls))
+        self.assertEqual(['expensive message','value 1 of 2'],[e['msg'] for e in mylog._ilog])
+        mylog.log('value {}','d',args=(3,))
+        self.assertEqual('value 3',mylog._ilog[-1]['msg'])
+        with self.assertRaises(TypeError): # template arguments are keyword only for log()
+            mylog.log('value {}','d',3)
+        mylog.set_verbose(0)
+        mylog.error(ValueError('bad'))
+        self.assertEqual(repr(ValueError('bad')),mylog._ilog[-1]['msg'])
+        # precomputed templates give the same strings as the template
+        fonts = dict(DEFAULT_FONT_FORMAT,msg='{bad}')
+        for e in mylog._ilog:
+            lvl = LEVEL_KEYS[e['level']]
+            self.assertEqual(LOG_TEMPLATE.format(ts_fmt=fonts['time'],lvl_fmt=fonts[lvl],msg_fmt=fonts['msg'],**e)+LOG_SEPARATOR,
+                             format_log_entry(e,fonts))
+        # templates are cached by font values (changed or new dictionaries never reuse stale ones)
+        self.assertIs(get_level_templates(fonts),get_level_templates(dict(fonts)))
+        fonts['msg'] = '<msg>'
+        self.assertIn('<msg>',get_level_templates(fonts)['info'])
+        for i in range(200):
+            get_level_templates(dict(fonts,msg=str(i)))
+        self.assertLessEqual(_build_level_templates.cache_info().currsize,64)
+        
+    def test_log_files(self):
+        '''@brief test writing and reading rotating log files'''
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir,'run.jsonl')
+            mylog = Logger(name='files',verbose=0,store_filtered=True)
+            mylog.set_file_sink(fpath,batch_size=16,max_bytes=2000)
+            levels = ['i','w','e','d']
+            for i in range(200):
+                mylog.log('message {}'.format(i),levels[i%4])
+            mylog.set_file_sink(None) # closes it
+            reader = LogFileReader(fpath)
+            self.assertGreater(len(reader.segments),1)
+            start = mylog._istart_time.timestamp()
+            times = [start+float(e['timestamp']) for e in mylog._ilog]
+            self.assertEqual([dict(e,time=t) for e,t in zip(mylog._ilog,times)],list(reader))
+            t0,t1 = times[50],times[150]
+            expected = [dict(e,time=t) for e,t in zip(mylog._ilog,times) if e['level']=='ERROR' and t0<=t<=t1]
+            self.assertEqual(expected,list(reader.iter_entries(t0,t1,levels='error')))
+            # a later run appended to the same files is indexed by its own start time
+            later = datetime.datetime.now() # timestamps start from 0 again
+            with LogFileSink(fpath,start_time=later) as sink:
+                log('next run',start_time=later,verbose=0,locs=[sink],store_filtered=True)
+            self.assertEqual(expected,list(reader.iter_entries(t0,t1,levels='error')))
+            self.assertEqual(['next run'],[e['msg'] for e in reader.iter_entries(t0=later)])
+            # unindexed and partial lines are recovered when opened again
+            with open(reader.segments[-1],'ab') as f:
+                f.write((json.dumps({'timestamp':'1e10','level':'ERROR','msg':'late'})+'\n').encode())
+                f.write(b'{"timestamp": "1e')
+            with LogFileSink(fpath,start_time=datetime.datetime.fromtimestamp(0)) as sink:
+                sink.append({'timestamp':'2e10','level':'INFO','msg':'after'})
+            self.assertEqual(['late','after'],[e['msg'] for e in reader.iter_entries(t0=1e10)])
+            self.assertEqual(203,len(reader))
+            # waiting entries are written after flush_interval
+            with LogFileSink(fpath,flush_interval=0.01) as sink:
+                sink.append({'timestamp':'3e10','level':'INFO','msg':'timed'})
+                for _ in range(500):
+                    if len(reader)==204: break
+                    time.sleep(0.01)
+                self.assertEqual(204,len(reader))
+            # limit the number of segments and start again
+            with LogFileSink(fpath,batch_size=1,max_bytes=1,max_segments=3,mode='w') as sink:
+                for i in range(10):
+                    sink.append({'timestamp':str(i),'level':'INFO','msg':str(i)})
+            self.assertEqual(3,len(reader.segments))
+            self.assertEqual(['8','9'],[e['msg'] for e in reader]) # newest segment is empty
+        
+    def test_collector(self):
+        '''@brief test collecting log entries from worker processes'''
+        from concurrent.futures import ProcessPoolExecutor
+        mylog = Logger(name='collected',verbose=0,store_filtered=True)
+        with LogCollector(mylog) as collector:
+            with ProcessPoolExecutor(2,initializer=Logger.set_worker,initargs=collector.worker_args(batch_size=7)) as pool:
+                nlogged = sum(pool.map(_log_worker_task,range(4)))
+                self.assertEqual([0,0],list(pool.map(_get_worker_history_len,range(2))))
+        self.assertEqual(nlogged,collector.received)
+        self.assertEqual(nlogged,len(mylog._ilog))
+        msgs = [e['msg'] for e in mylog._ilog]
+        for task in range(4):
+            with self.subTest(task=task): # each task's entries arrive in order
+                self.assertEqual(['task {} message {}'.format(task,i) for i in range(50)],
+                                 [m for m in msgs if m.startswith('task {} '.format(task))])
+        # timestamps are relative to the collecting logger start time
+        times = [get_timestamp_value(e['timestamp']) for e in mylog._ilog]
+        elapsed = (datetime.datetime.now()-mylog._istart_time).total_seconds()
+        self.assertTrue(all(0<=t<=elapsed for t in times))
+        # waiting entries are sent by the timer without logging again
+        q = queue.Queue()
+        sink = QueueLogSink(q,batch_size=100,flush_interval=0.01)
+        sink.put({'timestamp':'0','level':'INFO','msg':'waiting'})
+        self.assertEqual('waiting',q.get(timeout=5)[0]['msg'])
+        sink.close()
+        sink._timer.join(5)
+        self.assertFalse(sink._timer.is_alive())
+        
     def get_loggers(self):
         '''@brief get a variety of loggin instances'''
         loggers = {'global_{}'.format(i):Logger for i in range(2)}
@@ -227,11 +1163,172 @@ class TestLogger(unittest.TestCase):
                 loggers[k].log("this is a {} test on {}".format(lvl_name,k),lvl)
         return loggers
 
+def _log_worker_task(task,nmsgs=50):
+    '''@brief log messages from a worker process (for test_collector and benchmark_collector)'''
+    for i in range(nmsgs):
+        Logger.debug('task {} message {}',task,i)
+    return nmsgs
+
+def _get_worker_history_len(_):
+    '''@brief get the length of the global log history in a worker process (for test_collector)'''
+    return len(Logger._log)
+
+#%% benchmarking
+
+def benchmark_log_history(nmsgs=1000000,nlegacy=20000,capacity=100000):
+    '''
+    @brief time logging to the bounded LogBuffer against the previous list and string history
+    @param[in/OPT] nmsgs - number of messages to log to the LogBuffer
+    @param[in/OPT] capacity - number of entries the LogBuffer keeps
+    @param[in/OPT] nlegacy - number of messages for the previous history (it is quadratic so keep this small)
+    @return dictionary of {history:seconds per message}
+    '''
+    results = {}
+    entries,log_str = [],''
+    t0 = time.perf_counter()
+    for i in range(nlegacy):
+        entries,log_str = log('message {}'.format(i),verbose=0,locs=[entries,log_str],store_filtered=True)
+    results['list+str'] = (time.perf_counter()-t0)/nlegacy
+    print('{:>10}: {:8.3f} us/message ({} messages)'.format('list+str',results['list+str']*1e6,nlegacy))
+    buffer = LogBuffer(maxlen=capacity)
+    t0 = time.perf_counter()
+    for i in range(nmsgs):
+        log('message {}'.format(i),verbose=0,locs=[buffer],store_filtered=True)
+    results['LogBuffer'] = (time.perf_counter()-t0)/nmsgs
+    print('{:>10}: {:8.3f} us/message ({} messages, {} kept)'.format('LogBuffer',results['LogBuffer']*1e6,nmsgs,len(buffer)))
+    t0 = time.perf_counter()
+    buffer.get_str()
+    print('{:>10}: {:8.3f} s to build the string view'.format('get_str',time.perf_counter()-t0))
+    return results
+
+def benchmark_async_sink(nmsgs=20000,write_delay=1e-5):
+    '''
+    @brief time the calling thread overhead of logging with and without an AsyncLogSink
+    @param[in/OPT] nmsgs - number of messages to log
+    @param[in/OPT] write_delay - seconds each write to the stream takes (to model a slow terminal or file)
+    @return dictionary of {method:seconds per message on the calling thread}
+    '''
+    import io
+    class SlowStream(io.StringIO):
+        def write(self,s):
+            time.sleep(write_delay)
+            return super().write(s)
+    stream = SlowStream()
+    results = {}
+    # synchronous write on the calling thread
+    t0 = time.perf_counter()
+    for i in range(nmsgs):
+        log('message {}'.format(i),verbose=0,locs=[stream],store_filtered=True)
+    results['sync'] = (time.perf_counter()-t0)/nmsgs
+    for policy in AsyncLogSink.POLICIES:
+        sink = AsyncLogSink(stream=SlowStream(),policy=policy)
+        t0 = time.perf_counter()
+        for i in range(nmsgs):
+            log('message {}'.format(i),sink=sink)
+        results[policy] = (time.perf_counter()-t0)/nmsgs
+        sink.close()
+    for k,v in results.items():
+        print('{:>10}: {:8.3f} us/message on the calling thread'.format(k,v*1e6))
+    return results
+
+def benchmark_filtered_log(nmsgs=200000):
+    '''
+    @brief time debug messages filtered out by the verbosity
+    @param[in/OPT] nmsgs - number of messages to log
+    @return dictionary of {method:seconds per message}
+    '''
+    value = list(range(10))
+    verbose = VERBOSITY_LEVELS['info']
+    methods = {
+        'stored'  :lambda: log('value {}'.format(value),'d',verbose=verbose,locs=[[]],store_filtered=True),
+        'eager'   :lambda: log('value {}'.format(value),'d',verbose=verbose),
+        'template':lambda: log('value {}','d',verbose=verbose,args=(value,)),
+        'callable':lambda: log(lambda: 'value {}'.format(value),'d',verbose=verbose),
+        }
+    results = {}
+    for k,fn in methods.items():
+        t0 = time.perf_counter()
+        for i in range(nmsgs):
+            fn()
+        results[k] = (time.perf_counter()-t0)/nmsgs
+        print('{:>10}: {:8.3f} us/message'.format(k,results[k]*1e6))
+    return results
+
+def benchmark_log_files(nmsgs=200000,max_bytes=2**22):
+    '''
+    @brief time writing entries to a LogFileSink and reading the errors in a time range with
+        the index against parsing every line
+    @param[in/OPT] nmsgs - number of entries to write
+    @param[in/OPT] max_bytes - segment size
+    @return dictionary of {operation:seconds}
+    '''
+    import tempfile
+    results = {}
+    levels = ['i','i','i','w','d','d','d','d','d','e']
+    start_time = datetime.datetime.now()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fpath = os.path.join(tmpdir,'run.jsonl')
+        t0 = time.perf_counter()
+        with LogFileSink(fpath,max_bytes=max_bytes,start_time=start_time) as sink:
+            for i in range(nmsgs):
+                log('message {}'.format(i),levels[i%len(levels)],start_time=start_time,verbose=0,
+                    locs=[sink],store_filtered=True)
+        results['write'] = time.perf_counter()-t0
+        reader = LogFileReader(fpath)
+        index = np.concatenate([read_log_index(p) for p in reader.segments])
+        t_lo,t_hi = np.quantile(index['time'],[0.45,0.55])
+        t0 = time.perf_counter()
+        nindexed = sum(1 for _ in reader.iter_entries(t_lo,t_hi,levels='error'))
+        results['indexed query'] = time.perf_counter()-t0
+        t0 = time.perf_counter()
+        nparsed = 0
+        for path in reader.segments:
+            with open(path,'rb') as f:
+                for line in f:
+                    e = json.loads(line)
+                    nparsed += (e['level']=='ERROR' and t_lo<=start_time.timestamp()+float(e['timestamp'])<=t_hi)
+        results['full parse'] = time.perf_counter()-t0
+        assert nindexed==nparsed
+        nsegments = len(reader.segments)
+    print('{:>14}: {:8.3f} us/entry ({} entries, {} segments)'.format('write',results['write']/nmsgs*1e6,nmsgs,nsegments))
+    for k in ['indexed query','full parse']:
+        print('{:>14}: {:8.3f} ms ({} errors)'.format(k,results[k]*1e3,nindexed))
+    return results
+
+def benchmark_collector(nmsgs=20000,worker_counts=(1,2,4,8),batch_sizes=(1,100)):
+    '''
+    @brief time collecting log entries from process pool workers as the number of workers grows
+    @param[in/OPT] nmsgs - number of messages logged by each worker
+    @param[in/OPT] worker_counts - numbers of workers to time
+    @param[in/OPT] batch_sizes - QueueLogSink batch sizes to time (1 is sending each entry)
+    @return dictionary of {(workers,batch size):entries per second}
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    results = {}
+    for batch_size in batch_sizes:
+        for nworkers in worker_counts:
+            collected = Logger(name='collected',verbose=0,store_filtered=True,log_capacity=nmsgs)
+            t0 = time.perf_counter()
+            with LogCollector(collected) as collector:
+                with ProcessPoolExecutor(nworkers,initializer=Logger.set_worker,
+                                         initargs=collector.worker_args(batch_size=batch_size)) as pool:
+                    ntotal = sum(pool.map(partial(_log_worker_task,nmsgs=nmsgs),range(nworkers)))
+            results[(nworkers,batch_size)] = ntotal/(time.perf_counter()-t0)
+            assert collector.received==ntotal
+            print('{:>2} workers, batch {:>4}: {:10.0f} entries/s'.format(nworkers,batch_size,results[(nworkers,batch_size)]))
+    return results
+
 if __name__=='__main__':
     
     suite = unittest.TestLoader().loadTestsFromTestCase(TestLogger)
     rv = unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(suite))  
     
+    benchmark_log_history()
+    benchmark_async_sink()
+    benchmark_filtered_log()
+    benchmark_log_files()
+    benchmark_collector()
+    
     """
     mylog = Logger()
     for lvl in ['i','w','e','d']:
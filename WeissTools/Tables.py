@@ -11,6 +11,8 @@ import numpy as np
 import copy
 import re
 
+from WeissTools.Dict import wdicts_to_columns, iter_column_chunks
+
 #%% Some defaults
 DEFAULT_FORMATS = {
     float:'%5.5g',
@@ -20,6 +22,30 @@ DEFAULT_FORMATS = {
 #%% Table conversions
 # these are essentially just wrappers of DataFrame functions for now
 
+def wdicts2table(dicts,key_paths,names=None,chunk_size=None,**kwargs):
+    '''
+    @brief build a DataFrame from values at key paths in many (W)Dicts (e.g. one per run)
+    @param[in] dicts - iterable of dictionaries (can be a generator)
+    @param[in] key_paths - list of key paths (lists of keys or 'a/b/c' strings), one per column
+    @param[in/OPT] names - list of column names. Defaults to the key paths joined with '/'
+    @param[in/OPT] chunk_size - if not None, build the table from chunks of this many dictionaries
+        so only one chunk of them is needed at a time (see Dict.iter_column_chunks)
+    @param[in/OPT] kwargs - passed to Dict.wdicts_to_columns (e.g. fill_value)
+    @note array valued columns are stored with one array per cell
+    @example table2latex(wdicts2table(runs,['params/power','results/s21']),index=False)
+    '''
+    if chunk_size is None:
+        chunks = [wdicts_to_columns(dicts,key_paths,names=names,**kwargs)]
+    else:
+        chunks = iter_column_chunks(dicts,key_paths,chunk_size=chunk_size,names=names,**kwargs)
+    def columns2table(columns):
+        data = {k:(list(v) if v.ndim>1 else v) for k,v in columns.items()} # pandas columns are 1D
+        return pd.DataFrame(data,columns=list(columns.keys()))
+    tables = [columns2table(columns) for columns in chunks]
+    if not tables: # no dictionaries
+        return columns2table(wdicts_to_columns([],key_paths,names=names,**kwargs))
+    return pd.concat(tables,ignore_index=True) if len(tables)>1 else tables[0]
+
 def table2word(table,cols=None,rows=None,rtype='text',formats={},**kwargs):
     '''
     @brief change table data to format usable in word